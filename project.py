@@ -3,11 +3,22 @@
 # ----------------------------
 
 import datetime as dt
+import glob
+import os
 
 # Utils
 from utils.__init__ import init_db
+from utils.metrics import metrics
 #from utils.flick_utils import log_error, log_activity, send_email
-from utils.db_handler import (check_user,add_user,add_book, delete_book, list_books, search_books, update_book,find_book,check_book,csv_importer,csv_exporter)
+from utils.db_handler import (check_user,add_user,add_book, delete_book, search_books, update_book,find_book,csv_importer,csv_batch_importer,csv_exporter,iter_book_pages,book_stats,near_duplicates,SORT_KEYS)
+
+PAGE_SIZE = 20
+
+
+def format_book(book) -> str:
+    """One table line for a Book record, in the ID | Title | ... header order."""
+    read_status = "✅" if book.read else "❌"
+    return f"{book.id} | {book.title} | {book.author} | {book.year} | {read_status} | {book.genre} | {book.note} | "
 
 
 # ----------------------------
@@ -63,7 +74,9 @@ def main():
         5. ❌ Delete Book
         6. 📥 Import CSV
         7. 📤 Export CSV
-        8. 🚪 Exit
+        8. 📊 Statistics
+        9. 🧹 Find Duplicates
+        10. 🚪 Exit
         """)
 
         choice = input("Choose an option: ").strip()
@@ -103,28 +116,38 @@ def main():
         # LIST BOOKS
         # ----------------------------
         elif choice == "2":
-            books = list_books(user_id)
-
-            if not books:
-                print("📭 No books found.")
+            sort = input("Sort by (id/title/author/year/read) [id]: ").strip().lower() or "id"
+            if sort not in SORT_KEYS:
+                print("❌ Unknown sort order.")
                 continue
 
-            print("\nID | Title | Author | Year | Read | Genre | Note")
-            print("-" * 80)
-            for book in books:
-                read_status = "✅" if book[5] else "❌"
-                print(f"{book[0]} | {book[1]} | {book[2]} | {book[3]} | {book[4]} | {read_status} | {book[6]} | ")
+            filter_input = input("Show (a)ll, (r)ead or (u)nread? [a]: ").strip().lower()
+            read = {"r": True, "u": False}.get(filter_input)
+
+            shown = 0
+            for page in iter_book_pages(user_id, sort=sort, read=read, page_size=PAGE_SIZE):
+                print("\nID | Title | Author | Year | Read | Genre | Note")
+                print("-" * 80)
+                for book in page:
+                    print(format_book(book))
+                shown += len(page)
+
+                if len(page) < PAGE_SIZE or input(f"-- {shown} shown, Enter for more, q to stop: ").strip().lower() == "q":
+                    break
+
+            if not shown:
+                print("📭 No books found.")
         # ----------------------------
         # SEARCH BOOKS
         # ----------------------------
         elif choice == "3":
-            keyword = input("Search keyword (title/author): ").strip()
+            keyword = input("Search keyword (title/author/genre/note): ").strip()
 
             if not keyword:
                 print("❌ Search keyword cannot be empty.")
                 continue
 
-            results = search_books(user_id, keyword)
+            results = search_books(user_id, keyword, ranked=True)
 
             if not results:
                 print("🔍 No matching books found.")
@@ -133,8 +156,9 @@ def main():
             print("\nID | Title | Author | Year | Read | Genre | Note")
             print("-" * 80)
             for book in results:
-                read_status = "✅" if book[5] else "❌"
-                print(f"{book[0]} | {book[1]} | {book[2]} | {book[3]} | {book[4]} | {read_status} | {book[6]} | ")
+                print(format_book(book))
+                if book.snippet:
+                    print(f"    ↳ {book.snippet}")
 
         # ----------------------------
         # UPDATE BOOK
@@ -177,8 +201,9 @@ def main():
             genre = input("New Genre/Tags (leave blank to skip): ").strip() or None
             note = input("New Note (leave blank to skip): ").strip() or None
 
-            updated = update_book(book_id, title, author, year, read, genre, note)
-            print("✅ Book updated!" if updated else "❌ Failed to update.")
+            updated = update_book(book_id, title=title, author=author, year=year, genre=genre,
+                                  read=read, note=note, user_id=user_id)
+            print("✅ Book updated!" if updated else "❌ Failed to update. Book Id does not exist or nothing changed")
 
         # ----------------------------
         # DELETE BOOK
@@ -193,17 +218,16 @@ def main():
                 continue
 
     
-            if check_book(user_id,book_id):
-                book=find_book(user_id,book_id)
-                read_status = "✅" if book[5] else "❌"
-                print(f"{book[0]} | {book[1]} | {book[2]} | {book[3]} | {book[4]} | {read_status} | {book[6]} | ")
+            book=find_book(user_id,book_id)
+            if book:
+                print(format_book(book))
 
                 confirm = input("Are you sure you want to delete this book? (y/n): ").strip().lower()
                 if confirm != "y":
                     print("❎ Delete cancelled.")
                     continue
 
-                success = delete_book(book_id)
+                success = delete_book(book_id, user_id=user_id)
                 print("✅ Book deleted!" if success else "❌ Could not delete.")
             else:
                 print("❌ Could not delete. Book Id does not exist")
@@ -213,9 +237,37 @@ def main():
         # ----------------------------
         elif choice == "6":
             try:
-               file_path=input("Enter the file path to the csv: ")
-               csv_importer(user_id=user_id,file_path=file_path)
-               print("Books imported sucesfully")
+               file_path=input("Enter the file path to the csv (or a folder / *.csv pattern): ").strip()
+               policy = {"s": "skip", "u": "update", "k": "keep"}.get(
+                   input("Books already in your library: skip, update or keep both? (s/u/k) [s]: ").strip().lower()[:1],
+                   "skip")
+               if os.path.isdir(file_path) or glob.has_magic(file_path):
+                   summary = csv_batch_importer(user_id, file_path, on_duplicate=policy)
+                   if not summary:
+                       print("❌ Import failed.")
+                       continue
+                   for name, result in summary["files"].items():
+                       status = f"❌ {result['error']}" if result["error"] else "✅"
+                       print(f"{status} {name}: {result['imported']} added, {result['rejected']} rejected")
+                   print(f"Books imported sucesfully: {summary['imported']} added, {summary['duplicates']} already in library "
+                         f"({summary['rows_per_sec']:.0f} rows/sec)")
+                   continue
+               resume = input("Resume an interrupted import? (y/n): ").strip().lower() == "y"
+               summary = csv_importer(
+                   user_id=user_id,
+                   file_path=file_path,
+                   resume=resume,
+                   on_duplicate=policy,
+                   progress=lambda s: print(f"   ... {s['imported']} books imported"),
+               )
+               if summary:
+                   print(f"Books imported sucesfully: {summary['imported']} added, {summary['rejected']} rejected, "
+                         f"{summary['duplicates']} already in library "
+                         f"({summary['rows_per_sec']:.0f} rows/sec)")
+                   if summary["reject_file"]:
+                       print(f"Rejected rows written to {summary['reject_file']}")
+               else:
+                   print("❌ Import failed.")
             except Exception as e:
                 print("Failed during importing",e)
 
@@ -224,15 +276,64 @@ def main():
         # ----------------------------
         elif choice == "7":
             try:
-               csv_exporter(user_id)
-               print("Files Exported Succesfully, Check DATA/export/your.csv")
+               fmt = input("Format (csv/jsonl) [csv]: ").strip().lower() or "csv"
+               sort = input("Order by (id/title/author/year/read) [id]: ").strip().lower() or "id"
+               compress = input("Compress with gzip? (y/n): ").strip().lower() == "y"
+               summary = csv_exporter(user_id, fmt=fmt, compress=compress, sort=sort)
+               if summary:
+                   print(f"Files Exported Succesfully, {summary['rows']} books written to {summary['file']}")
+               else:
+                   print("❌ Export failed.")
             except Exception as e:
-                print("Failed during importing",e)
+                print("Failed during exporting",e)
 
         # ----------------------------
-        # EXIT
+        # Reading Statistics
         # ----------------------------
         elif choice == "8":
+            stats = book_stats(user_id)
+            if not stats:
+                print("❌ Could not load statistics.")
+                continue
+            if not stats["total"]:
+                print("📭 No books found.")
+                continue
+
+            print(f"\n📚 {stats['total']} books: {stats['read']} read, {stats['unread']} unread "
+                  f"({stats['read_pct']}% read)")
+            print("\nTop authors:")
+            for author, books, read in stats["authors"]:
+                print(f"  {author}: {books} ({read} read)")
+            print("\nTop genres:")
+            for genre, books, read in stats["genres"]:
+                print(f"  {genre or 'Unknown'}: {books} ({read} read)")
+            print("\nBy decade:")
+            for decade, books, read in stats["decades"]:
+                print(f"  {f'{decade}s' if decade is not None else 'Unknown'}: {books} ({read} read)")
+            print("\nAdded per month:")
+            for month, books in stats["added"]:
+                print(f"  {month or 'Unknown'}: {books}")
+
+        # ----------------------------
+        # Find Duplicates
+        # ----------------------------
+        elif choice == "9":
+            pairs = near_duplicates(user_id)
+            if not pairs:
+                print("✅ No likely duplicates found.")
+                continue
+            for score, book, other in pairs:
+                print(f"\n{score:.0%} alike:")
+                print(format_book(book))
+                print(format_book(other))
+            print(f"\n{len(pairs)} possible duplicates; delete the extra copies with option 5.")
+
+        # ----------------------------
+        # EXIT
+        # ----------------------------
+        elif choice == "10":
+            if metrics.enabled:
+                print(f"📈 Metrics written to {metrics.write_snapshot()}")
             print("👋 Goodbye!")
             break
 
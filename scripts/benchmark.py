@@ -0,0 +1,1036 @@
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from difflib import SequenceMatcher
+from pathlib import Path
+
+base = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(base))
+
+from utils import connection, init_db
+from utils.async_handler import AsyncLibrary
+from utils.cache import configure_cache
+from utils.changelog import change_cursor
+from utils.db_handler import (SORT_KEYS, add_book, add_books, add_user, book_changes, check_user, csv_exporter,
+                              csv_importer, delete_book, delete_books, find_book, list_books, list_books_columns,
+                              list_books_page, login, search_books, session_user, update_book)
+from utils.duplicates import find_near_duplicates
+from utils.importer import MappedCSV, bulk_import_csv, import_csv, import_many, insert_book_sql, read_csv, to_params
+from utils.maintenance import backup, database_metrics, incremental_vacuum, vacuum
+from utils.metrics import configure_metrics, metrics
+from utils.sharding import configure_shards
+from scripts.synthetic import WORDS, populate, synthetic_books, write_csv
+
+
+def timed(fn, ops: int) -> float:
+    """Run fn `ops` times and return operations per second."""
+    start = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    return ops / (time.perf_counter() - start)
+
+
+def percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_report(samples: list, elapsed: float) -> dict:
+    """Summarise per-call latencies (seconds) as throughput and ms percentiles."""
+    return {
+        "ops": len(samples),
+        "ops_per_sec": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def seed(user_id: int, count: int):
+    for i in range(count):
+        add_book(user_id, f"Book {i}", f"Author {i % 50}", 1900 + i % 120, "Genre", i % 2 == 0, None)
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bulk_seed(user_id: int, count: int, batch: int = 10000):
+    """Insert `count` pseudo-random books in large transactions (collisions kept as copies)."""
+    books = synthetic_books(count, user_id)
+
+    def rows(n):
+        for _ in range(n):
+            yield (user_id, *next(books))
+
+    for done in range(0, count, batch):
+        with connection.transaction() as conn:
+            conn.executemany(insert_book_sql("keep"), rows(min(batch, count - done)))
+
+
+# ----------------------------
+# Scenarios
+# ----------------------------
+
+def bench_pool(workdir: Path, args) -> dict:
+    """find_book through the pool vs. the old connect-per-call path."""
+    db_path = workdir / "library.db"
+    connection.configure(db_path)
+    init_db()
+    seed(1, args.books)
+
+    def legacy_find_book(i):
+        conn = sqlite3.connect(db_path)
+        c = conn.cursor()
+        conn.execute("BEGIN")
+        c.execute(
+            "SELECT id, title, author, year, read, genre, note FROM books WHERE user_id = ? AND id = ?",
+            (1, i % args.books + 1),
+        )
+        c.fetchone()
+        conn.close()
+
+    def legacy_add_book(i):
+        conn = sqlite3.connect(db_path)
+        c = conn.cursor()
+        conn.execute("BEGIN")
+        c.execute(
+            "INSERT INTO books (user_id, title, author, year, genre, read, note) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (2, f"Legacy {i}", "Author", 2000, "Genre", 0, None),
+        )
+        conn.commit()
+        conn.close()
+
+    return {
+        "find_book": {
+            "before_ops_per_sec": timed(legacy_find_book, args.ops),
+            "after_ops_per_sec": timed(lambda i: find_book(1, i % args.books + 1), args.ops),
+        },
+        "add_book": {
+            "before_ops_per_sec": timed(legacy_add_book, args.ops),
+            "after_ops_per_sec": timed(lambda i: add_book(3, f"Pooled {i}", "Author", 2000, "Genre"), args.ops),
+        },
+    }
+
+
+def bench_stress(workdir: Path, args) -> dict:
+    """Concurrent readers and writers for a fixed duration, per journal profile."""
+    results = {}
+    for profile in ("legacy", "default"):
+        connection.configure(workdir / f"{profile}.db", readers=args.readers, profile=profile)
+        init_db()
+        seed(1, args.books)
+
+        samples = {"read": [], "write": []}
+        stop = time.perf_counter() + args.seconds
+
+        def reader_loop(n):
+            local = []
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                if n % 2:
+                    search_books(1, "Book 1")
+                else:
+                    list_books(1)
+                local.append(time.perf_counter() - start)
+            samples["read"].extend(local)
+
+        def writer_loop(n):
+            local = []
+            i = 0
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                add_book(1, f"Stress {n}-{i}", "Writer", 2024, "Genre")
+                local.append(time.perf_counter() - start)
+                i += 1
+            samples["write"].extend(local)
+
+        threads = [threading.Thread(target=reader_loop, args=(n,)) for n in range(args.readers)]
+        threads += [threading.Thread(target=writer_loop, args=(n,)) for n in range(args.writers)]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        results[profile] = {
+            "journal_mode": connection.get_pool().journal_mode(),
+            "read": latency_report(samples["read"], elapsed),
+            "write": latency_report(samples["write"], elapsed),
+        }
+    return results
+
+
+def bench_search(workdir: Path, args) -> dict:
+    """LIKE scan vs. ranked FTS5 search on one large library."""
+    connection.configure(workdir / "library.db")
+    init_db()
+    bulk_seed(1, args.books)
+
+    results = {"books": args.books}
+    for mode, ranked in (("like", False), ("fts", True)):
+        samples = []
+        began = time.perf_counter()
+        for i in range(args.ops):
+            start = time.perf_counter()
+            search_books(1, WORDS[i * 7919 % len(WORDS)], ranked=ranked)
+            samples.append(time.perf_counter() - start)
+        results[mode] = latency_report(samples, time.perf_counter() - began)
+    return results
+
+
+def bench_paging(workdir: Path, args) -> dict:
+    """Keyset page latency vs. OFFSET at increasing depth into one library."""
+    connection.configure(workdir / "library.db")
+    init_db()
+    bulk_seed(1, args.books)
+    page_size = 50
+    depths = [d for d in (1, 10, 100, 1000, 10000) if d * page_size < args.books]
+
+    results = {"books": args.books, "page_size": page_size}
+    for sort in ("id", "title", "author", "year"):
+        # walk the cursor chain once to collect the cursors at each depth
+        cursors, after = {}, None
+        for page_number in range(1, max(depths) + 1):
+            if page_number in depths:
+                cursors[page_number] = after
+            _, after = list_books_page(1, sort=sort, after=after, limit=page_size)
+
+        order = ", ".join(SORT_KEYS[sort][0])
+        per_depth = {}
+        for depth in depths:
+            start = time.perf_counter()
+            list_books_page(1, sort=sort, after=cursors[depth], limit=page_size)
+            keyset_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            with connection.reader() as conn:
+                conn.execute(
+                    f"SELECT id, title, author, year, read, genre, note FROM books WHERE user_id = ? "
+                    f"ORDER BY {order} LIMIT ? OFFSET ?",
+                    (1, page_size, (depth - 1) * page_size),
+                ).fetchall()
+            offset_ms = (time.perf_counter() - start) * 1000
+            per_depth[depth] = {"keyset_ms": keyset_ms, "offset_ms": offset_ms}
+        results[sort] = per_depth
+    return results
+
+
+def bench_ordered(workdir: Path, args) -> dict:
+    """Whole-library listings by title and author: sort key indexes vs. sorting on each query."""
+    connection.configure(workdir / "library.db")
+    init_db()
+    bulk_seed(1, args.books)
+    # what the listings had to do without the sort keys
+    sorted_orders = {"title": "lower(title), id", "author": "lower(author), lower(title), id"}
+
+    results = {"books": args.books}
+    for sort, sorted_order in sorted_orders.items():
+        keys, index = SORT_KEYS[sort]
+        with connection.reader() as conn:
+            start = time.perf_counter()
+            conn.execute(
+                f"SELECT id, title, author, year, read, genre, note FROM books WHERE user_id = ? "
+                f"ORDER BY {sorted_order}", (1,)
+            ).fetchall()
+            sort_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            conn.execute(
+                f"SELECT id, title, author, year, read, genre, note FROM books INDEXED BY {index} "
+                f"WHERE user_id = ? ORDER BY {', '.join(keys)}", (1,)
+            ).fetchall()
+            index_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        list_books_page(1, sort=sort, limit=50)
+        first_page_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        export = csv_exporter(1, path=workdir / f"by_{sort}.csv", sort=sort)
+        results[sort] = {
+            "order_by_sort_ms": sort_ms,
+            "index_walk_ms": index_ms,
+            "first_page_ms": first_page_ms,
+            "export_ms": (time.perf_counter() - start) * 1000,
+            "exported": export["rows"],
+        }
+    return results
+
+
+def bench_async(workdir: Path, args) -> dict:
+    """Mixed request load from concurrent clients through AsyncLibrary vs. sync calls in turn."""
+    connection.configure(workdir / "library.db", readers=args.readers)
+    init_db()
+    configure_cache(enabled=False)
+    bulk_seed(1, args.books)
+
+    def request(i):
+        if i % 5 == 0:
+            return "add_book", (1, f"Async {i}", "Author", 2024, "Genre")
+        if i % 2:
+            return "search_books", (1, WORDS[i * 7919 % len(WORDS)])
+        return "list_books_page", (1, "title")
+
+    samples = []
+    began = time.perf_counter()
+    for i in range(args.ops):
+        name, call_args = request(i)
+        start = time.perf_counter()
+        getattr(sys.modules["utils.db_handler"], name)(*call_args)
+        samples.append(time.perf_counter() - start)
+    results = {"sync": latency_report(samples, time.perf_counter() - began)}
+
+    async def run_async():
+        async with AsyncLibrary(readers=args.readers) as library:
+            latencies = []
+
+            async def client(first):
+                for i in range(first, args.ops, args.clients):
+                    name, call_args = request(i)
+                    start = time.perf_counter()
+                    await getattr(library, name)(*call_args)
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(client(n) for n in range(args.clients)))
+            return latencies, time.perf_counter() - start
+
+    samples, elapsed = asyncio.run(run_async())
+    results["async"] = latency_report(samples, elapsed)
+    configure_cache(enabled=True)
+    return results
+
+
+def bench_logins(workdir: Path, args) -> dict:
+    """Logins per second: legacy plaintext vs. scrypt, sync and through AsyncLibrary, vs. session lookups."""
+    connection.configure(workdir / "logins.db")
+    init_db()
+    users = 20
+    for n in range(users):
+        add_user(f"reader{n}", f"reader{n}@example.com", f"secret{n}")
+    logins = min(args.ops, 100)
+
+    def plaintext(i):
+        # the old check_user: compare the plaintext column in SQL
+        with connection.reader() as conn:
+            conn.execute("SELECT id FROM users WHERE username = ? AND password = ?",
+                         (f"reader{i % users}", f"secret{i % users}")).fetchone()
+
+    results = {"cpus": multiprocessing.cpu_count()}
+    results["plaintext_sql"] = timed(plaintext, args.ops)
+    results["check_user"] = timed(lambda i: check_user(f"reader{i % users}", f"secret{i % users}"), logins)
+
+    async def run_async():
+        async with AsyncLibrary() as library:
+            start = time.perf_counter()
+            await asyncio.gather(*(library.check_user(f"reader{i % users}", f"secret{i % users}")
+                                   for i in range(logins)))
+            return logins / (time.perf_counter() - start)
+
+    results["async_check_user"] = asyncio.run(run_async())
+    tokens = [login(f"reader{n}", f"secret{n}") for n in range(users)]
+    results["session_user"] = timed(lambda i: session_user(tokens[i % users]), args.ops)
+    return results
+
+
+def bench_parallel(workdir: Path, args) -> dict:
+    """Multi-file import scaling across 1-8 parser processes."""
+    inbox = workdir / "inbox"
+    inbox.mkdir()
+    files = 8
+    for n in range(files):
+        write_csv(inbox / f"dump{n}.csv", args.books // files, seed=n)
+
+    results = {"books": args.books, "files": files, "cpus": multiprocessing.cpu_count()}
+    for workers in (1, 2, 4, 8):
+        connection.configure(workdir / f"workers{workers}.db")
+        init_db()
+        summary = import_many(1, inbox, workers=workers, chunk_size=5000)
+        results[workers] = {"seconds": summary["seconds"], "rows_per_sec": summary["rows_per_sec"]}
+    return results
+
+
+def _load_in_child(mode: str, db_path: str, csv_path: str, results):
+    connection.configure(db_path)
+    init_db()
+    began = time.perf_counter()
+    if mode == "executemany":
+        # the pre-streaming csv_importer: whole file in a list, one executemany
+        rows = []
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for book in reader:
+                book.pop(0)
+                book.append(1)
+                rows.append(book)
+        with connection.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO books (title, author, year, read, genre, note, user_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+    elif mode == "chunked":
+        import_csv(1, csv_path, chunk_size=10000)
+    else:
+        bulk_import_csv(1, csv_path)
+    results.put((mode, time.perf_counter() - began, peak_rss_mb()))
+    connection.close_pool()
+
+
+def bench_batch(workdir: Path, args) -> dict:
+    """add_book/delete_book per call vs. add_books/delete_books in one transaction."""
+    connection.configure(workdir / "batch.db")
+    init_db()
+    books = list(synthetic_books(args.books))
+    results = {"books": args.books}
+
+    began = time.perf_counter()
+    for book in books:
+        add_book(1, *book, on_duplicate="keep")
+    results["add_book"] = args.books / (time.perf_counter() - began)
+    began = time.perf_counter()
+    add_books(2, books, on_duplicate="keep")
+    results["add_books"] = args.books / (time.perf_counter() - began)
+
+    ids = {user_id: [book.id for book in list_books(user_id)] for user_id in (1, 2)}
+    began = time.perf_counter()
+    for book_id in ids[1]:
+        delete_book(book_id)
+    results["delete_book"] = args.books / (time.perf_counter() - began)
+    began = time.perf_counter()
+    delete_books(2, ids[2])
+    results["delete_books"] = args.books / (time.perf_counter() - began)
+    return results
+
+
+def bench_changes(workdir: Path, args) -> dict:
+    """Syncing a library after --ops edits: pulling the change feed vs. a full export."""
+    connection.configure(workdir / "changes.db")
+    init_db()
+    configure_cache(enabled=False)
+    bulk_seed(1, args.books)
+    cursor = change_cursor(1)
+
+    rng = random.Random(args.seed)
+    ids = [book.id for book in list_books(1)]
+    for _ in range(args.ops):
+        update_book(rng.choice(ids), read=rng.random() < 0.5, note=rng.choice(WORDS), user_id=1)
+
+    began = time.perf_counter()
+    pulled = 0
+    while True:
+        batch = book_changes(1, cursor, 1000)
+        pulled += len(batch["changes"])
+        cursor = batch["cursor"]
+        if not batch["more"]:
+            break
+    feed = time.perf_counter() - began
+
+    began = time.perf_counter()
+    exported = csv_exporter(1, path=workdir / "full.csv")["rows"]
+    export = time.perf_counter() - began
+    configure_cache(enabled=True)
+    return {
+        "books": args.books,
+        "edits": args.ops,
+        "feed": {"seconds": feed, "rows": pulled},
+        "full_export": {"seconds": export, "rows": exported},
+    }
+
+
+def bench_shards(workdir: Path, args) -> dict:
+    """Aggregate add_book throughput of --writers threads (one user each) by shard count.
+
+    0 shards is the single library.db. Commits use the "durable" profile
+    (synchronous=FULL), so each write waits for an fsync of its own file.
+    """
+    results = {"writers": args.writers, "seconds": args.seconds, "cpus": multiprocessing.cpu_count()}
+    for count in (0, 1, 2, 4, 8):
+        directory = workdir / f"shards{count}"
+        connection.configure(directory / "library.db", profile="durable")
+        configure_shards(count, directory / "shards", profile="durable")
+        init_db()
+        user_ids = list(range(1, args.writers + 1))
+        done = [0] * args.writers
+        deadline = time.perf_counter() + args.seconds
+
+        def write(slot: int):
+            i = 0
+            while time.perf_counter() < deadline:
+                add_book(user_ids[slot], f"Book {i}", "Author", 2000, None, False, None, on_duplicate="keep")
+                i += 1
+            done[slot] = i
+
+        threads = [threading.Thread(target=write, args=(slot,)) for slot in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[f"shards_{count}"] = {"writes_per_sec": sum(done) / args.seconds}
+        configure_shards(0)
+    return results
+
+
+class _Writer(threading.Thread):
+    """Adds books for user 9 until stopped, recording each call's latency.
+
+    Pauses `pause` seconds between calls like live traffic would; a writer
+    that never lets go of the write connection starves every other writer.
+    """
+
+    def __init__(self, pause: float = 0.002):
+        super().__init__()
+        self.pause = pause
+        self.samples = []
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.is_set():
+            began = time.perf_counter()
+            add_book(9, f"Live {len(self.samples)}", "Writer", 2000, None, False, None, on_duplicate="keep")
+            self.samples.append(time.perf_counter() - began)
+            time.sleep(self.pause)
+
+    def measure(self, work, limit: float = None) -> tuple:
+        """Run work() while writing, for at most `limit` seconds of writes;
+        returns (work's result, seconds, latency report)."""
+        if limit is not None:
+            threading.Timer(limit, self.done.set).start()
+        self.start()
+        began = time.perf_counter()
+        try:
+            result = work()
+        finally:
+            elapsed = time.perf_counter() - began
+            self.done.set()
+            self.join()
+        return result, elapsed, latency_report(self.samples, elapsed)
+
+
+def bench_maintenance(workdir: Path, args) -> dict:
+    """Online backup and vacuuming while a writer thread keeps adding books.
+
+    The backup reads from one WAL snapshot; the comparison copies with a
+    plain backup connection, which restarts whenever a write commits, so
+    its writer stops after --seconds to let the copy finish at all.
+    """
+    db_path = workdir / "maintenance.db"
+    connection.configure(db_path)
+    init_db()
+    bulk_seed(1, args.books)
+    bulk_seed(2, args.books)
+    results = {"books": 2 * args.books}
+
+    _, elapsed, results["writes_idle"] = _Writer().measure(lambda: time.sleep(args.seconds))
+    size = database_metrics()["file_bytes"]
+    copied, elapsed, latency = _Writer().measure(lambda: backup(workdir / "backups", pages=256))
+    results["backup"] = {"mb_per_sec": size / 2 ** 20 / elapsed, "seconds": elapsed, "writes": latency}
+
+    def unpinned():
+        restarts, remaining = 0, [None]
+
+        def step(status, left, total):
+            nonlocal restarts
+            restarts += remaining[0] is not None and left > remaining[0]
+            remaining[0] = left
+
+        source, target = sqlite3.connect(db_path), sqlite3.connect(workdir / "unpinned.db")
+        source.backup(target, pages=256, progress=step, sleep=0.005)
+        source.close()
+        target.close()
+        return restarts
+
+    restarts, elapsed, latency = _Writer().measure(unpinned, limit=args.seconds)
+    results["unpinned_backup"] = {"restarts": restarts, "seconds": elapsed, "writes": latency}
+
+    for user_id, name, work in ((1, "incremental_vacuum", incremental_vacuum), (2, "vacuum", vacuum)):
+        delete_books(user_id, [book.id for book in list_books(user_id)])
+        free = database_metrics()["free_pages"]
+        _, elapsed, latency = _Writer().measure(work)
+        results[name] = {"free_pages": free, "seconds": elapsed, "writes": latency}
+    return results
+
+
+def bench_bulk(workdir: Path, args) -> dict:
+    """Load N synthetic books per import path, each in a fresh process."""
+    csv_path = workdir / "books.csv"
+    write_csv(csv_path, args.books)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {"books": args.books}
+    for mode in ("executemany", "chunked", "bulk"):
+        queue = ctx.Queue()
+        child = ctx.Process(target=_load_in_child, args=(mode, str(workdir / f"{mode}.db"), str(csv_path), queue))
+        child.start()
+        _, seconds, rss = queue.get()
+        child.join()
+        results[mode] = {
+            "seconds": seconds,
+            "rows_per_sec": args.books / seconds,
+            "peak_rss_mb": rss,
+        }
+    return results
+
+
+class SlotsBook:
+    __slots__ = ("id", "title", "author", "year", "read", "genre", "note")
+
+    def __init__(self, id, title, author, year, read, genre, note):
+        self.id, self.title, self.author, self.year = id, title, author, year
+        self.read, self.genre, self.note = read, genre, note
+
+
+def _traced(load) -> tuple:
+    """Return (result, bytes still allocated by load() when it returns)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = load()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def _working_bytes(rows, sample: int) -> float:
+    """Mean of the peak bytes allocated while producing each of the first `sample` rows."""
+    rows = iter(rows)
+    total = count = 0
+    tracemalloc.start()
+    try:
+        while count < sample:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            if next(rows, None) is None:
+                break
+            total += tracemalloc.get_traced_memory()[1] - before
+            count += 1
+    finally:
+        tracemalloc.stop()
+    return total / count if count else 0.0
+
+
+def bench_csv(workdir: Path, args) -> dict:
+    """Parsing a large export into INSERT_BOOK tuples: csv.reader + to_params vs. MappedCSV.
+
+    Allocation churn is reported as the peak bytes allocated while each
+    row is produced (tracemalloc); CPython does not count allocations.
+    """
+    csv_path = workdir / "export.csv"
+    write_csv(csv_path, args.books)
+    megabytes = csv_path.stat().st_size / 2 ** 20
+
+    def text_rows():
+        with csv_path.open(newline="", encoding="utf-8") as f:
+            positions, records = read_csv(f)
+            for _, row in records:
+                yield to_params(1, row, positions)
+
+    def mapped_rows():
+        with MappedCSV(csv_path) as mapped:
+            for _, params in mapped.params(1):
+                yield params
+
+    results = {"books": args.books, "megabytes": round(megabytes, 1)}
+    for name, rows in (("csv_reader", text_rows), ("mapped", mapped_rows)):
+        began = time.perf_counter()
+        count = sum(1 for _ in rows())
+        elapsed = time.perf_counter() - began
+        results[name] = {
+            "mb_per_sec": megabytes / elapsed,
+            "rows_per_sec": count / elapsed,
+            "working_bytes_per_row": round(_working_bytes(rows(), min(count, 50000)), 1),
+        }
+
+    connection.configure(workdir / "csv.db")
+    init_db()
+    summary = import_csv(1, csv_path, chunk_size=10000, on_duplicate="keep")
+    results["import_csv"] = {"mb_per_sec": megabytes / summary["seconds"], "rows_per_sec": summary["rows_per_sec"]}
+    return results
+
+
+def bench_memory(workdir: Path, args) -> dict:
+    """Bytes per book held by one user's library in each result representation."""
+    connection.configure(workdir / "memory.db")
+    init_db()
+    configure_cache(enabled=False)
+    bulk_seed(1, args.books)
+
+    def rows(factory=None):
+        with connection.reader() as conn:
+            c = conn.cursor()
+            c.row_factory = factory
+            return c.execute(
+                "SELECT id, title, author, year, read, genre, note FROM books WHERE user_id = ?", (1,)
+            ).fetchall()
+
+    names = SlotsBook.__slots__
+    loads = {
+        "tuple": rows,
+        "dict": lambda: rows(lambda cursor, row: dict(zip(names, row))),
+        "slots": lambda: rows(lambda cursor, row: SlotsBook(*row)),
+        "book": lambda: list_books(1),
+        "columns": lambda: list_books_columns(1),
+    }
+    results = {"books": args.books}
+    for name, load in loads.items():
+        began = time.perf_counter()
+        result, size = _traced(load)
+        results[name] = {
+            "bytes_per_book": round(size / args.books, 1),
+            "seconds": time.perf_counter() - began,
+        }
+        del result
+    configure_cache(enabled=True)
+    return results
+
+
+def bench_metrics(workdir: Path, args) -> dict:
+    """find_book throughput uninstrumented, with metrics disabled and enabled."""
+    connection.configure(workdir / "metrics.db")
+    init_db()
+    configure_cache(enabled=False)
+    seed(1, args.books)
+    ids = list(range(1, args.books + 1))
+    raw = find_book.__wrapped__
+
+    results = {"books": args.books, "ops": args.ops}
+    results["uninstrumented"] = timed(lambda i: raw(1, ids[i % len(ids)]), args.ops)
+    configure_metrics(enabled=False)
+    results["disabled"] = timed(lambda i: find_book(1, ids[i % len(ids)]), args.ops)
+    collected = configure_metrics(enabled=True)
+    results["enabled"] = timed(lambda i: find_book(1, ids[i % len(ids)]), args.ops)
+    results["snapshot"] = collected.snapshot()["calls"]["find_book"]
+    configure_metrics(enabled=False)
+    configure_cache(enabled=True)
+    return results
+
+
+def _typo(text: str, rng: random.Random) -> str:
+    i = rng.randrange(len(text) - 1)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def bench_duplicates(workdir: Path, args) -> dict:
+    """Re-importing a library under each policy, and the near-duplicate finder vs. all pairs."""
+    connection.configure(workdir / "duplicates.db")
+    init_db()
+    configure_cache(enabled=False)
+    csv_path = workdir / "books.csv"
+    write_csv(csv_path, args.books)
+    import_csv(1, csv_path)
+
+    results = {"books": args.books}
+    for policy in ("skip", "update", "keep"):
+        began = time.perf_counter()
+        summary = import_csv(1, csv_path, on_duplicate=policy)
+        seconds = time.perf_counter() - began
+        results[f"reimport_{policy}"] = {"rows_per_sec": args.books / seconds, "duplicates": summary["duplicates"]}
+
+    # a fresh library with 1% misspelt copies to find
+    rng = random.Random(args.seed)
+    books = list(synthetic_books(args.books, 2))
+    books += [(_typo(title, rng), *rest) for title, *rest in rng.sample(books, args.books // 100)]
+    with connection.transaction() as conn:
+        conn.executemany(insert_book_sql("keep"), ((2, *book) for book in books))
+
+    began = time.perf_counter()
+    pairs = find_near_duplicates(2)
+    results["blocked"] = {"seconds": time.perf_counter() - began, "pairs": len(pairs), "planted": args.books // 100}
+
+    # every pair of a sample, extrapolated to the whole library
+    sample = [f"{title.lower()}|{author.lower()}" for title, author, *_ in books[:1000]]
+    began = time.perf_counter()
+    matcher = SequenceMatcher(autojunk=False)
+    for i, text in enumerate(sample):
+        matcher.set_seq2(text)
+        for other in sample[i + 1:]:
+            matcher.set_seq1(other)
+            if matcher.real_quick_ratio() >= 0.85 and matcher.quick_ratio() >= 0.85:
+                matcher.ratio()
+    sample_pairs = len(sample) * (len(sample) - 1) / 2
+    all_pairs = len(books) * (len(books) - 1) / 2
+    results["all_pairs_estimate"] = {"seconds": (time.perf_counter() - began) * all_pairs / sample_pairs}
+    configure_cache(enabled=True)
+    return results
+
+
+# Startup budget for short scripted runs, in ms. Imports of optional or
+# process-pool modules (flask, smtplib, dotenv, multiprocessing) would blow it.
+STARTUP_BUDGET_MS = {"import": 150.0, "launch": 400.0}
+STARTUP_MODULES = ("utils.db_handler", "utils", "utils.importer", "utils.exporter", "utils.credentials")
+
+
+def import_times(module: str = "utils.db_handler") -> dict:
+    """Cumulative import time (ms) per module from a fresh `python -X importtime` run."""
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=base,
+                         capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def bench_startup(workdir: Path, args) -> dict:
+    """Import time of the data layer and wall time of a scripted CLI run, against STARTUP_BUDGET_MS."""
+    db_path = workdir / "startup.db"
+    connection.configure(db_path)
+    init_db()
+    bulk_seed(1, args.books)
+    connection.close_pool()
+
+    runs = 5
+    imports = [import_times() for _ in range(runs)]
+    import_ms = sorted(times["utils.db_handler"] for times in imports)[runs // 2]
+    launches = []
+    command = [sys.executable, str(base / "scripts" / "library.py"), "--db", str(db_path), "--user", "1", "--quiet", "list"]
+    for _ in range(runs):
+        began = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        launches.append((time.perf_counter() - began) * 1000)
+    launch_ms = sorted(launches)[runs // 2]
+
+    measured = {"import": import_ms, "launch": launch_ms}
+    return {
+        "books": args.books,
+        "import_ms": import_ms,
+        "launch_ms": launch_ms,
+        "modules_ms": {name: imports[0].get(name) for name in STARTUP_MODULES},
+        "budget_ms": STARTUP_BUDGET_MS,
+        "over_budget": [name for name, ms in measured.items() if ms > STARTUP_BUDGET_MS[name]],
+    }
+
+
+# ----------------------------
+# Standard Workload
+# ----------------------------
+
+# Relative frequency of each operation in the standard workload.
+WORKLOAD_MIX = {"add": 20, "list": 20, "search": 25, "update": 15, "delete": 10, "import": 5, "export": 5}
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+
+def _workload_ops(workdir: Path, user_ids: list, book_ids: dict, seed: int):
+    """Bind each workload operation to its arguments, drawn from one seeded RNG."""
+    rng = random.Random(seed)
+    imports = []
+    for n in range(4):
+        imports.append(workdir / f"import{n}.csv")
+        write_csv(imports[-1], 20, seed=seed + n)
+
+    new_books = synthetic_books(10 ** 9, seed + 1)
+
+    def add():
+        add_book(rng.choice(user_ids), *next(new_books))
+
+    def page():
+        list_books_page(rng.choice(user_ids), sort=rng.choice(sorted(SORT_KEYS)), limit=20)
+
+    def search():
+        search_books(rng.choice(user_ids), rng.choice(WORDS)[:4], ranked=True)
+
+    def update():
+        user_id = rng.choice(user_ids)
+        update_book(rng.choice(book_ids[user_id]), read=rng.random() < 0.5, user_id=user_id)
+
+    def delete():
+        ids = book_ids[rng.choice(user_ids)]
+        delete_book(ids.pop(rng.randrange(len(ids))))
+
+    def import_():
+        csv_importer(rng.choice(user_ids), rng.choice(imports))
+
+    def export():
+        csv_exporter(rng.choice(user_ids), path=workdir / "export.csv")
+
+    ops = {"add": add, "list": page, "search": search, "update": update,
+           "delete": delete, "import": import_, "export": export}
+    return rng, ops
+
+
+def _run_mix(workdir: Path, db_path: Path, ops: int, seed: int, mix: dict, profile: bool) -> dict:
+    connection.configure(db_path)
+    with connection.reader() as conn:
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        book_ids = {user_id: [] for user_id in user_ids}
+        for user_id, book_id in conn.execute("SELECT user_id, id FROM books ORDER BY id"):
+            book_ids[user_id].append(book_id)
+    rng, calls = _workload_ops(workdir, user_ids, book_ids, seed)
+    names = rng.choices(sorted(mix), weights=[mix[name] for name in sorted(mix)], k=ops)
+
+    samples = {name: [] for name in mix}
+    work = {name: [0, 0] for name in mix}
+    configure_cache(enabled=True)
+    configure_metrics(enabled=profile)
+    began = time.perf_counter()
+    for name in names:
+        if profile:
+            statements, steps = metrics.counters.get("statements", 0), metrics.counters.get("vm_steps", 0)
+        start = time.perf_counter()
+        calls[name]()
+        samples[name].append(time.perf_counter() - start)
+        if profile:
+            work[name][0] += metrics.counters.get("statements", 0) - statements
+            work[name][1] += metrics.counters.get("vm_steps", 0) - steps
+    elapsed = time.perf_counter() - began
+    configure_metrics(enabled=False)
+    connection.close_pool()
+    return {"samples": samples, "work": work, "elapsed": elapsed}
+
+
+def run_workload(workdir: Path, users: int = 5, books: int = 1000, ops: int = 2000, seed: int = 0,
+                 mix: dict = None) -> dict:
+    """Run the standard operation mix against a fresh synthetic database.
+
+    The database is seeded once and copied, then the same seeded sequence
+    of operations runs twice: once timed, once under utils.metrics to count
+    the statements and SQLite VM steps each operation needs. The timings
+    depend on the machine; the work counts only on the code and the seed.
+    """
+    mix = mix or WORKLOAD_MIX
+    workdir = Path(workdir)
+    seeded = workdir / "seeded.db"
+    connection.configure(seeded)
+    init_db()
+    populate(users, books, seed)
+    connection.close_pool()
+    for name in ("timed", "profiled"):
+        shutil.copyfile(seeded, workdir / f"{name}.db")
+
+    timed_run = _run_mix(workdir, workdir / "timed.db", ops, seed, mix, profile=False)
+    profiled = _run_mix(workdir, workdir / "profiled.db", ops, seed, mix, profile=True)
+
+    operations = {}
+    for name, samples in timed_run["samples"].items():
+        if not samples:
+            continue
+        report = latency_report(samples, sum(samples))
+        statements, steps = profiled["work"][name]
+        report["statements_per_op"] = round(statements / len(samples), 2)
+        report["vm_steps_per_op"] = round(steps / len(samples))
+        operations[name] = report
+    return {
+        "config": {"users": users, "books": books, "ops": ops, "seed": seed, "mix": mix},
+        "ops_per_sec": ops / timed_run["elapsed"],
+        "peak_rss_mb": peak_rss_mb(),
+        "operations": operations,
+    }
+
+
+def compare_to_baseline(result: dict, baseline: dict, slowdown: float = None, extra_work: float = 0.25) -> list:
+    """List the ways `result` is worse than `baseline`; empty means no regression.
+
+    Statements and VM steps per operation are deterministic, so they may
+    grow by at most `extra_work` (plus one statement / one progress tick of
+    slack) before counting as a regression. Throughput is only compared
+    when `slowdown` is given, and may then drop by up to that factor:
+    timings depend on the machine and its load, so the unit tests leave
+    them out and `--check-baseline` checks them on demand.
+    """
+    regressions = []
+    if slowdown is not None and result["ops_per_sec"] < baseline["ops_per_sec"] / slowdown:
+        regressions.append(f"throughput {result['ops_per_sec']:.0f} ops/s vs baseline {baseline['ops_per_sec']:.0f}")
+    for name, base_op in baseline["operations"].items():
+        op = result["operations"].get(name)
+        if op is None:
+            continue
+        if slowdown is not None and op["ops_per_sec"] < base_op["ops_per_sec"] / slowdown:
+            regressions.append(f"{name}: {op['ops_per_sec']:.0f} ops/s vs baseline {base_op['ops_per_sec']:.0f}")
+        if op["statements_per_op"] > base_op["statements_per_op"] * (1 + extra_work) + 1:
+            regressions.append(f"{name}: {op['statements_per_op']} statements/op "
+                               f"vs baseline {base_op['statements_per_op']}")
+        if op["vm_steps_per_op"] > base_op["vm_steps_per_op"] * (1 + extra_work) + 1000:
+            regressions.append(f"{name}: {op['vm_steps_per_op']} VM steps/op vs baseline {base_op['vm_steps_per_op']}")
+    return regressions
+
+
+def bench_workload(workdir: Path, args) -> dict:
+    """Standard add/list/search/update/delete/import/export mix over synthetic users.
+
+    With --check-baseline the workload runs with the configuration stored in
+    scripts/baseline.json and is compared with it, throughput included.
+    """
+    baseline_path = BASELINE if args.check_baseline else args.baseline
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8")) if baseline_path else None
+    if args.check_baseline:
+        config = baseline["config"]
+        result = run_workload(workdir, config["users"], config["books"], config["ops"], config["seed"], config["mix"])
+    else:
+        result = run_workload(workdir, users=args.users, books=args.books, ops=args.ops, seed=args.seed)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(result, indent=2) + "\n", encoding="utf-8")
+    if baseline:
+        result["regressions"] = compare_to_baseline(result, baseline, slowdown=2.0)
+    return result
+
+
+BENCHMARKS = {
+    "async": bench_async,
+    "batch": bench_batch,
+    "bulk": bench_bulk,
+    "changes": bench_changes,
+    "csv": bench_csv,
+    "ordered": bench_ordered,
+    "duplicates": bench_duplicates,
+    "logins": bench_logins,
+    "maintenance": bench_maintenance,
+    "memory": bench_memory,
+    "metrics": bench_metrics,
+    "paging": bench_paging,
+    "parallel": bench_parallel,
+    "pool": bench_pool,
+    "search": bench_search,
+    "shards": bench_shards,
+    "startup": bench_startup,
+    "stress": bench_stress,
+    "workload": bench_workload,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Library Manager micro-benchmarks")
+    parser.add_argument("scenario", choices=sorted(BENCHMARKS))
+    parser.add_argument("--ops", type=int, default=2000, help="operations per measurement")
+    parser.add_argument("--books", type=int, default=1000, help="books to seed before measuring")
+    parser.add_argument("--readers", type=int, default=4, help="concurrent reader threads")
+    parser.add_argument("--writers", type=int, default=1, help="concurrent writer threads")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent async clients")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of timed runs")
+    parser.add_argument("--users", type=int, default=5, help="synthetic users for the workload")
+    parser.add_argument("--seed", type=int, default=0, help="seed for synthetic data and operations")
+    parser.add_argument("--baseline", help="compare the workload with this stored result")
+    parser.add_argument("--check-baseline", action="store_true",
+                        help="rerun the workload of scripts/baseline.json and fail on regressions, throughput included")
+    parser.add_argument("--save-baseline", help="store the workload result here as the new baseline")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            result = BENCHMARKS[args.scenario](Path(tmp), args)
+        finally:
+            connection.close_pool()
+
+    print(json.dumps({args.scenario: result}, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main().get("regressions") else 0)
@@ -1,16 +1,23 @@
 import os
+import sys
 import sqlite3
 import csv
 from pathlib import Path
 from dotenv import load_dotenv
 
 base = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(base))
 ENV = base / ".env"
 DB = base / "DATA" / "DB"
 file_path = Path(__file__).resolve().parent / "dummy.csv"
 load_dotenv()
 
-def make_dummy():
+def make_dummy(bulk: bool = False, source=file_path):
+    """Create the dummy user and load its books from `source`.
+
+    `bulk=True` loads through utils.importer.bulk_import_csv (staging table,
+    deferred indexes), which is the path to use for multi-million-row files.
+    """
     if ENV.exists():
         name = os.getenv("USER")
         password = os.getenv("PASS")
@@ -19,8 +26,24 @@ def make_dummy():
         name = "user"
         password = "password"
         mail = "somegeneriname@somegenericdomain.com"
-        
-    ls = (name, mail, password)  # order must match DB columns
+
+    from utils.db_handler import add_user
+
+    # add_user stores the password hashed, so login() works for the dummy user
+    user_id = add_user(name, mail, password)
+    if user_id is None:
+        print("DB Integrity Error: user already exists")
+        return False
+
+    if bulk:
+        from utils.importer import bulk_import_csv
+
+        summary = bulk_import_csv(user_id, source)
+        print(f"Dummy books loaded: {summary['imported']} added, {summary['duplicates']} duplicates, "
+              f"{summary['rejected']} rejected")
+        if summary["reject_file"]:
+            print(f"Rejected rows written to {summary['reject_file']}")
+        return True
 
     try:
         conn = sqlite3.connect(DB / "library.db")
@@ -28,12 +51,8 @@ def make_dummy():
         
         conn.execute("BEGIN")
 
-        # insert user
-        c.execute("INSERT INTO users (username, email, password) VALUES (?, ?, ?)", ls)
-        user_id = c.lastrowid
-
         rows = []
-        target = Path(file_path)
+        target = Path(source)
 
         with target.open(newline="", encoding="utf-8") as f:
             reader = csv.reader(f)
@@ -0,0 +1,177 @@
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+base = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(base))
+
+from utils import connection, init_db
+from utils.db_handler import add_books, check_user, csv_importer, delete_books, list_books, search_books
+from utils.importer import DUPLICATE_POLICIES, parse_read, parse_year
+from utils.records import BOOK_COLUMNS
+
+FORMATS = ("jsonl", "json", "csv")
+
+
+def read_books(stream, fmt: str):
+    """Yield book dicts from JSON (one array), JSON lines or a CSV with a header row."""
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            row = {name.strip().lower(): (value or "").strip() for name, value in row.items() if name}
+            yield {**row, "year": parse_year(row.get("year") or ""), "read": parse_read(row.get("read") or "")}
+        return
+    books = json.load(stream) if fmt == "json" else (json.loads(line) for line in stream if line.strip())
+    for book in books:
+        if isinstance(book.get("read"), str):
+            book["read"] = parse_read(book["read"])
+        yield book
+
+
+def read_ids(stream) -> list:
+    """Book ids from stdin: whitespace/comma separated, a JSON array, or JSON objects with an "id"."""
+    text = stream.read().strip()
+    if not text:
+        return []
+    if text[0] in "[{":
+        items = json.loads(text) if text[0] == "[" else [json.loads(line) for line in text.splitlines() if line.strip()]
+        return [int(item["id"] if isinstance(item, dict) else item) for item in items]
+    return [int(token) for token in text.replace(",", " ").split()]
+
+
+def write_books(books: list, stream, fmt: str):
+    if fmt == "csv":
+        out = csv.writer(stream)
+        out.writerow(books[0]._fields if books else BOOK_COLUMNS)
+        out.writerows(books)
+    elif fmt == "json":
+        json.dump([book._asdict() for book in books], stream, indent=2)
+        stream.write("\n")
+    else:
+        for book in books:
+            stream.write(json.dumps(book._asdict()) + "\n")
+
+
+class _Counted:
+    """Wraps an iterable and counts the items taken from it."""
+
+    def __init__(self, items):
+        self.items = items
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.count += 1
+            yield item
+
+
+# Each command returns (items processed, summary dict to print) or None
+# when the handler failed; commands that stream books return no summary.
+
+def cmd_add(args, user_id: int, stdin, stdout):
+    books = _Counted(read_books(stdin, args.format))
+    added = add_books(user_id, books, on_duplicate=args.on_duplicate)
+    if added is False:
+        return None
+    return books.count, {"added": added, "duplicates": books.count - added}
+
+
+def cmd_delete(args, user_id: int, stdin, stdout):
+    ids = args.ids or read_ids(stdin)
+    deleted = delete_books(user_id, ids)
+    if deleted is False:
+        return None
+    return len(ids), {"deleted": deleted, "missing": len(ids) - deleted}
+
+
+def cmd_list(args, user_id: int, stdin, stdout):
+    books = list_books(user_id)
+    write_books(books, stdout, args.format)
+    return len(books), None
+
+
+def cmd_search(args, user_id: int, stdin, stdout):
+    books = search_books(user_id, args.keyword, ranked=True, limit=args.limit)
+    write_books(books, stdout, args.format)
+    return len(books), None
+
+
+def cmd_import(args, user_id: int, stdin, stdout):
+    summary = csv_importer(user_id, args.file, bulk=args.bulk, on_duplicate=args.on_duplicate)
+    if not summary:
+        return None
+    return summary["rows_read"], summary
+
+
+COMMANDS = {"add": cmd_add, "delete": cmd_delete, "list": cmd_list, "search": cmd_search, "import": cmd_import}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Non-interactive Library Manager: books are read from stdin and results written to stdout",
+    )
+    parser.add_argument("--db", help="database file (default: DATA/DB/library.db)")
+    who = parser.add_mutually_exclusive_group(required=True)
+    who.add_argument("--user", type=int, help="user id")
+    who.add_argument("--username", help="log in as this user; the password is read from LIBRARY_PASSWORD")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl", help="input and output format")
+    parser.add_argument("--quiet", action="store_true", help="do not print timing to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="add the books read from stdin in one transaction")
+    add.add_argument("--on-duplicate", choices=DUPLICATE_POLICIES, default="skip")
+    delete = commands.add_parser("delete", help="delete books by id (arguments, or ids read from stdin)")
+    delete.add_argument("ids", nargs="*", type=int)
+    commands.add_parser("list", help="write every book")
+    search = commands.add_parser("search", help="write the best matching books")
+    search.add_argument("keyword")
+    search.add_argument("--limit", type=int, default=50)
+    load = commands.add_parser("import", help="stream a CSV file into the library")
+    load.add_argument("file")
+    load.add_argument("--bulk", action="store_true", help="use the bulk loader for very large files")
+    load.add_argument("--on-duplicate", choices=DUPLICATE_POLICIES, default="skip")
+    return parser
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None) -> int:
+    """Run one command; returns the exit status (0 on success, 1 on failure)."""
+    stdin, stdout, stderr = stdin or sys.stdin, stdout or sys.stdout, stderr or sys.stderr
+    args = build_parser().parse_args(argv)
+
+    # handlers report problems with print(); keep stdout for data
+    with contextlib.redirect_stdout(stderr):
+        if args.db:
+            connection.configure(args.db)
+        init_db()
+        user_id = args.user
+        if args.username:
+            user_id = check_user(args.username, os.getenv("LIBRARY_PASSWORD", ""))
+            if user_id is None:
+                print("❌ Invalid username or password.")
+                return 1
+
+        began = time.perf_counter()
+        result = COMMANDS[args.command](args, user_id, stdin, stdout)
+        seconds = time.perf_counter() - began
+
+    if result is None:
+        return 1
+    items, summary = result
+    if summary is not None:
+        stdout.write(json.dumps(summary) + "\n")
+    if not args.quiet:
+        stderr.write(json.dumps({
+            "command": args.command,
+            "items": items,
+            "seconds": round(seconds, 4),
+            "items_per_sec": round(items / seconds, 1) if seconds else 0.0,
+        }) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
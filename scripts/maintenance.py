@@ -0,0 +1,84 @@
+import argparse
+import contextlib
+import json
+import sys
+from pathlib import Path
+
+base = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(base))
+
+from utils import connection, init_db
+from utils.maintenance import SETTINGS, TASKS, MaintenanceScheduler, database_metrics, last_runs
+from utils.sharding import all_pools, configure_shards
+
+
+def setting(text: str) -> tuple:
+    """Parse NAME=VALUE into a typed maintenance setting."""
+    name, _, value = text.partition("=")
+    if name not in SETTINGS:
+        raise argparse.ArgumentTypeError(f"unknown setting {name!r} (one of {', '.join(SETTINGS)})")
+    default = SETTINGS[name]
+    if isinstance(default, bool):
+        return name, value.lower() in ("1", "true", "yes", "on")
+    try:
+        return name, type(default)(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{name} expects a {type(default).__name__}, got {value!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Back up, analyze and vacuum the library databases")
+    parser.add_argument("--db", help="database file (default: DATA/DB/library.db)")
+    parser.add_argument("--shards", type=int, help="number of shard files (default: LIBRARY_SHARDS)")
+    parser.add_argument("--backup-dir", help="where backups go (default: backups/ next to the database)")
+    parser.add_argument("--set", type=setting, action="append", default=[], metavar="NAME=VALUE",
+                        help="override a setting of utils.maintenance.SETTINGS; may be repeated")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="print size, free space, last runs and due tasks per database")
+    run = commands.add_parser("run", help="run the tasks that are due")
+    run.add_argument("--task", choices=TASKS, action="append",
+                     help="run this task on every database now, due or not; may be repeated")
+    commands.add_parser("watch", help="keep running due tasks every check_every seconds")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        connection.configure(args.db)
+    if args.shards is not None:
+        configure_shards(args.shards)
+    # keep stdout for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db()
+    scheduler = MaintenanceScheduler(dict(args.set), backup_dir=args.backup_dir)
+
+    if args.command == "status":
+        due = {}
+        for task, pool, reason in scheduler.due():
+            due.setdefault(str(pool.path), {})[task] = reason
+        status = [
+            {**database_metrics(pool, detail=True), "last_runs": last_runs(pool), "due": due.get(str(pool.path), {})}
+            for pool in all_pools()
+        ]
+        print(json.dumps(status, indent=2))
+        return 0
+
+    if args.command == "watch":
+        scheduler.start(report=lambda reports: print(json.dumps(reports), flush=True))
+        try:
+            scheduler._thread.join()
+        except KeyboardInterrupt:
+            scheduler.stop()
+        return 0
+
+    if args.task:
+        reports = []
+        for task in args.task:
+            for pool in [None] if task == "backup" else all_pools():
+                reports.append({"task": task, **scheduler.run(task, pool)})
+    else:
+        reports = scheduler.run_pending()
+    print(json.dumps(reports, indent=2))
+    return 1 if any("error" in report for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+base = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(base))
+
+from utils import connection, init_db
+from utils.sharding import configure_shards, move_user, plan_rebalance
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Move users' books between shard databases (run while the app is stopped)")
+    parser.add_argument("--shards", type=int, required=True, help="number of shard files")
+    parser.add_argument("--db", help="catalog database (default: DATA/DB/library.db)")
+    parser.add_argument("--dir", help="shard directory (default: shards/ next to the catalog)")
+    parser.add_argument("--user", type=int, help="move only this user")
+    parser.add_argument("--to", type=int, help="with --user: the target shard (default: user_id %% shards)")
+    parser.add_argument("--dry-run", action="store_true", help="only print the moves")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        connection.configure(args.db)
+    router = configure_shards(args.shards, args.dir)
+    init_db()
+
+    if args.user is not None:
+        target = args.to if args.to is not None else args.user % args.shards
+        # shard_of places a user it has not seen, which a dry run must not do
+        source = router._placed(args.user) if args.dry_run else router.shard_of(args.user)
+        plan = [(args.user, source, target)] if source is not None else []
+    else:
+        plan = plan_rebalance(router)
+
+    total = 0
+    for user_id, source, target in plan:
+        where = "library.db" if source == -1 else f"shard {source}"
+        if args.dry_run:
+            print(f"user {user_id}: {where} -> shard {target}")
+            continue
+        began = time.perf_counter()
+        moved = move_user(user_id, target, router)
+        total += moved
+        print(f"user {user_id}: {where} -> shard {target}, {moved} books in {time.perf_counter() - began:.2f}s")
+    print(f"✅ {len(plan)} users {'to move' if args.dry_run else 'moved'}, {total} books.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import argparse
+import sys
+from pathlib import Path
+
+base = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(base))
+
+from utils import init_db
+from utils.connection import using
+from utils.sharding import all_pools
+from utils.stats import check_stats, rebuild_stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify or rebuild the reading statistics summaries")
+    parser.add_argument("--user", type=int, help="only this user id (default: everyone)")
+    parser.add_argument("--check", action="store_true", help="only report drift, do not rebuild")
+    args = parser.parse_args(argv)
+
+    init_db()
+    # a single user is routed to their shard; everyone means every database
+    pools = [None] if args.user is not None else all_pools()
+    if args.check:
+        drift = []
+        for pool in pools:
+            drift += _on(pool, check_stats, args.user)
+        for user_id, dimension, bucket, stored, actual in drift:
+            print(f"user {user_id} {dimension} {bucket!r}: stored {stored}, actual {actual}")
+        print("✅ Statistics are consistent." if not drift else f"❌ {len(drift)} buckets out of date.")
+        return 1 if drift else 0
+
+    buckets = drifted = 0
+    for pool in pools:
+        result = _on(pool, rebuild_stats, args.user)
+        buckets += result["buckets"]
+        drifted += result["drifted"]
+    print(f"✅ Rebuilt {buckets} buckets ({drifted} had drifted).")
+    return 0
+
+
+def _on(pool, fn, *args):
+    if pool is None:
+        return fn(*args)
+    with using(pool):
+        return fn(*args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import argparse
+import csv
+import math
+import random
+import sys
+from itertools import accumulate
+from pathlib import Path
+
+base = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(base))
+
+from utils import connection, init_db
+from utils.importer import insert_book_sql
+
+SYLLABLES = ("ri", "ver", "sha", "dow", "gar", "den", "win", "ter", "em", "pire",
+             "glas", "si", "lent", "har", "bor", "let", "or", "chard", "ma", "chine")
+WORDS = tuple(a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES[:5])
+GENRES = ("Fiction", "Fantasy", "Science Fiction", "Mystery", "Romance", "History", "Biography",
+          "Classic", "Horror", "Poetry", "Philosophy", "Travel", "Cooking", "Graphic Novel", "Essays")
+
+
+def zipf_weights(n: int, skew: float) -> list:
+    """Cumulative weights where item k is picked in proportion to 1 / k**skew."""
+    return list(accumulate(1 / rank ** skew for rank in range(1, n + 1)))
+
+
+def synthetic_books(count: int, seed: int = 0, authors: int = 500, skew: float = 1.1,
+                    note_words: int = 12, noted: float = 0.4):
+    """Yield (title, author, year, genre, read, note) tuples for `count` fake books.
+
+    Authors and genres follow a Zipf distribution (`skew`), so a few authors
+    own a large share of a library, as in real ones. Years cluster around the
+    last decades, about 40% of books are read, and a `noted` share of books
+    carries a note whose length is log-normal around `note_words` words.
+    The same arguments always produce the same books.
+    """
+    rng = random.Random(seed)
+    names = [f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}son" for _ in range(authors)]
+    author_weights = zipf_weights(authors, skew)
+    genre_weights = zipf_weights(len(GENRES), skew)
+    for _ in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5))).title()
+        author = rng.choices(names, cum_weights=author_weights)[0]
+        genre = rng.choices(GENRES, cum_weights=genre_weights)[0] if rng.random() < 0.9 else None
+        year = min(2025, max(1500, int(rng.gauss(1985, 35))))
+        note = None
+        if rng.random() < noted:
+            words = max(1, int(rng.lognormvariate(math.log(note_words), 0.8)))
+            note = " ".join(rng.choice(WORDS) for _ in range(words))
+        yield (title, author, year, genre, rng.random() < 0.4, note)
+
+
+def write_csv(path: Path, count: int, seed: int = 0, **options):
+    """Write `count` synthetic books as an export-style CSV."""
+    with Path(path).open("w", newline="", encoding="utf-8") as f:
+        out = csv.writer(f)
+        out.writerow(["id", "title", "author", "year", "read", "genre", "note"])
+        for i, (title, author, year, genre, read, note) in enumerate(synthetic_books(count, seed, **options), 1):
+            out.writerow([i, title, author, year, "yes" if read else "no", genre, note])
+
+
+def populate(users: int, books_per_user: int, seed: int = 0, batch: int = 10000, **options) -> list:
+    """Create `users` users with `books_per_user` synthetic books each.
+
+    Books are inserted with executemany in large transactions, so this is
+    the quick way to build big test libraries. Generated books that happen
+    to collide are kept as extra copies. Returns the new user ids.
+    """
+    user_ids = []
+    for n in range(users):
+        with connection.transaction() as conn:
+            user_ids.append(conn.execute(
+                "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                (f"reader{seed}_{n}", f"reader{seed}_{n}@example.com", "password"),
+            ).lastrowid)
+        books = synthetic_books(books_per_user, seed * 100003 + n, **options)
+        for done in range(0, books_per_user, batch):
+            size = min(batch, books_per_user - done)
+            with connection.transaction() as conn:
+                conn.executemany(
+                    insert_book_sql("keep"),
+                    ((user_ids[-1], *book) for _, book in zip(range(size), books)),
+                )
+    return user_ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic libraries")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--books", type=int, default=1000, help="books per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--authors", type=int, default=500, help="distinct authors per library")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of authors and genres")
+    parser.add_argument("--note-words", type=int, default=12, help="typical note length in words")
+    parser.add_argument("--db", help="database file (default: DATA/DB/library.db)")
+    parser.add_argument("--csv", help="write one CSV per user into this directory instead")
+    args = parser.parse_args(argv)
+    options = {"authors": args.authors, "skew": args.skew, "note_words": args.note_words}
+
+    if args.csv:
+        out = Path(args.csv)
+        out.mkdir(parents=True, exist_ok=True)
+        for n in range(args.users):
+            write_csv(out / f"library{n}.csv", args.books, args.seed * 100003 + n, **options)
+        print(f"✅ Wrote {args.users} CSV files to {out}")
+        return
+
+    if args.db:
+        connection.configure(args.db)
+    init_db()
+    user_ids = populate(args.users, args.books, args.seed, **options)
+    print(f"✅ Created {len(user_ids)} users with {args.books} books each")
+
+
+if __name__ == "__main__":
+    main()
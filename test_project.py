@@ -1,25 +1,54 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
 import os
 import sqlite3
-import pytest
-
+import subprocess
+import sys
+import threading
+import time
 from pathlib import Path
+import pytest
 
-base=Path(__file__).resolve().parent.parent
-DB = base / "DATA" / "DB" 
-
-
-
+from scripts import benchmark, library, rebalance
+from utils import connection, db_handler, importer, init_db, maintenance
+from utils.async_handler import AsyncLibrary
+from utils.cache import configure_cache
+from utils.changelog import change_cursor, compact_changes, truncate_changes
+from utils.migrations import SCHEMA_VERSION, schema_version
 from utils.db_handler import (
     add_book,
     search_books,
     list_books,
     update_book,
+    update_books,
     delete_book,
     check_book,
     find_book,
+    csv_importer,
+    csv_batch_importer,
+    csv_exporter,
+    add_user,
+    check_user,
+    login,
+    session_user,
+    logout,
+    iter_book_pages,
+    list_books_columns,
+    book_stats,
+    add_books,
+    delete_books,
+    SORT_KEYS,
 )
-
-TEST_DB = DB / "library.db"
+from utils.importer import MappedCSV, bulk_import_csv, import_csv, read_csv, to_params, RowError
+from utils.records import Book, SearchHit
+from utils.credentials import configure_hashing, sessions
+from utils.maintenance import MaintenanceScheduler, backup, database_metrics
+from utils.metrics import configure_metrics
+from utils.sharding import SHARD_BITS, configure_shards, move_user, plan_rebalance
+from utils.stats import check_stats, rebuild_stats
 
 
 # ----------------------------
@@ -27,40 +56,30 @@ TEST_DB = DB / "library.db"
 # ----------------------------
 
 @pytest.fixture(scope="function")
-def test_db(monkeypatch):
-    os.makedirs("DB", exist_ok=True)
+def test_db(tmp_path):
+    test_db_path = tmp_path / "library.db"
 
-    # Save the real connect function
-    real_connect = sqlite3.connect
+    # Point the connection pool at a throwaway database and build the schema
+    connection.configure(test_db_path)
+    init_db()
+    # tests below poke the tables directly, so reads must not be cached
+    configure_cache(enabled=False)
+    # keep password hashing cheap; the format is the same as in production
+    configure_hashing("scrypt", n=2 ** 4, r=1)
 
-    conn = real_connect(TEST_DB)
-    c = conn.cursor()
+    yield test_db_path
 
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS books (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            year INTEGER,
-            genre TEXT,
-            read INTEGER,
-            note TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    connection.close_pool()
+    configure_cache(enabled=True)
+    configure_hashing("scrypt")
+    sessions.clear()
 
-    # Patch connect safely
-    monkeypatch.setattr(
-        sqlite3,
-        "connect",
-        lambda _: real_connect(TEST_DB)
-    )
 
-    yield
-
-    os.remove(TEST_DB)
+@pytest.fixture(scope="function")
+def cached_db(test_db):
+    cache = configure_cache(maxsize=8, ttl=60, enabled=True)
+    cache.hits = cache.misses = cache.evictions = cache.expirations = cache.invalidations = 0
+    yield cache
 
 
 # ----------------------------
@@ -130,13 +149,31 @@ def test_update_book_changes_data(test_db):
         read=True
     )
 
-    assert updated is True
+    assert updated == 1
 
     book = find_book(1, book_id)
     assert book[1] == "New Title"
     assert book[4] == 1  # read flag
 
 
+def test_update_into_an_equal_book_keeps_a_copy(test_db):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    add_book(1, "Dune", "Frank Herbert", 1966, "SF", False, None)
+    add_book(1, "dune ", "frank herbert", 1967, "SF", False, None)
+    first, second, third = (book.id for book in list_books(1))
+
+    def copies():
+        with connection.reader() as conn:
+            return conn.execute("SELECT id, copy FROM books ORDER BY id").fetchall()
+
+    assert update_book(second, year=1965, user_id=1) == 1
+    assert update_books(1, [second, third], year=1965) == 2
+    assert copies() == [(first, 0), (second, 1), (third, 2)]
+    # leaving the group frees the copy number
+    assert update_book(second, title="Dune Messiah", year=1969) == 1
+    assert copies()[1] == (second, 0)
+
+
 def test_delete_book_removes_entry(test_db):
     add_book(1, "To Delete", "Author", 2020, "Genre", False, None)
     book_id = list_books(1)[0][0]
@@ -145,3 +182,1328 @@ def test_delete_book_removes_entry(test_db):
     assert deleted is True
 
     assert list_books(1) == []
+
+
+# ----------------------------
+# CONNECTION POOL TESTS
+# ----------------------------
+
+def test_pool_reuses_connections(test_db):
+    for _ in range(5):
+        add_book(1, "Emma", "Jane Austen", 1815, "Classic", False, None)
+        list_books(1)
+
+    stats = connection.get_pool().stats()
+    assert stats["write"]["opened"] == 1
+    assert stats["read"]["opened"] == 1
+
+
+def test_transaction_rolls_back_on_error(test_db):
+    with pytest.raises(RuntimeError):
+        with connection.transaction() as conn:
+            conn.execute(
+                "INSERT INTO books (user_id, title, author) VALUES (1, 'Ghost', 'Nobody')"
+            )
+            raise RuntimeError("boom")
+
+    assert list_books(1) == []
+    assert connection.get_pool().stats()["write"]["idle"] == 1
+
+
+def test_reader_is_query_only(test_db):
+    with pytest.raises(sqlite3.OperationalError):
+        with connection.reader() as conn:
+            conn.execute("DELETE FROM books")
+
+
+def test_pool_uses_wal_profile(test_db):
+    pool = connection.get_pool()
+    add_book(1, "Persuasion", "Jane Austen", 1817, "Classic", True, None)
+
+    assert pool.journal_mode() == "wal"
+    with connection.reader() as conn:
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2   # MEMORY
+
+
+def test_readers_not_blocked_by_open_write(test_db):
+    add_book(1, "Dracula", "Bram Stoker", 1897, "Horror", False, None)
+
+    with connection.transaction() as conn:
+        conn.execute(
+            "INSERT INTO books (user_id, title, author) VALUES (1, 'Pending', 'Writer')"
+        )
+        # another thread reads the last committed snapshot instead of waiting
+        seen = []
+        worker = threading.Thread(target=lambda: seen.extend(list_books(1)))
+        worker.start()
+        worker.join(timeout=2)
+        assert [book[1] for book in seen] == ["Dracula"]
+
+    assert len(list_books(1)) == 2
+    assert connection.checkpoint("PASSIVE")[0] == 0
+
+
+# ----------------------------
+# SCHEMA TESTS
+# ----------------------------
+
+def query_plan(sql: str, params: tuple = ()) -> str:
+    with connection.reader() as conn:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_migrations_reach_latest_version(test_db):
+    with connection.reader() as conn:
+        assert schema_version(conn) == SCHEMA_VERSION
+
+    # running again is a no-op
+    init_db()
+    with connection.reader() as conn:
+        assert schema_version(conn) == SCHEMA_VERSION
+
+
+def test_migrations_upgrade_existing_database(tmp_path):
+    legacy = tmp_path / "legacy.db"
+    conn = sqlite3.connect(legacy)
+    conn.execute("""
+        CREATE TABLE books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            year INTEGER,
+            genre TEXT,
+            read BOOLEAN DEFAULT 0,
+            note TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("INSERT INTO books (user_id, title, author) VALUES (1, 'Old', 'Row')")
+    conn.commit()
+    conn.close()
+
+    connection.configure(legacy)
+    try:
+        init_db()
+        assert [book[1] for book in list_books(1)] == ["Old"]
+        assert "idx_books_user" in query_plan("SELECT id FROM books WHERE user_id = ?", (1,))
+    finally:
+        connection.close_pool()
+
+
+def test_init_db_skips_migrations_when_schema_is_current(test_db):
+    connection.configure(test_db)
+    init_db()
+    pool = connection.get_pool()
+    assert pool.schema_ready
+    assert pool.stats()["commits"] == 0
+    assert pool.stats()["read"]["opened"] == 0
+
+
+def test_importing_data_layer_skips_optional_modules():
+    code = ("import sys, utils.db_handler, utils.flick_utils; "
+            "print([m for m in ('flask', 'smtplib', 'dotenv', 'multiprocessing', 'tempfile') if m in sys.modules])")
+    out = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+    assert "utils.db_handler" in benchmark.import_times()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT id, title, author, year, read, genre, note FROM books WHERE user_id = ?",
+    "SELECT id, title, author, year, read, genre, note FROM books WHERE user_id = ? AND id = 1",
+    "SELECT id FROM books WHERE user_id = ? AND author = 'x'",
+    "SELECT id FROM books WHERE user_id = ? AND title = 'x' COLLATE NOCASE",
+])
+def test_user_queries_use_an_index(test_db, sql):
+    plan = query_plan(sql, (1,))
+    assert "SEARCH books USING" in plan, plan
+    assert "SCAN" not in plan, plan
+
+
+# ----------------------------
+# FULL-TEXT SEARCH TESTS
+# ----------------------------
+
+def test_ranked_search_matches_prefix_across_fields(test_db):
+    add_book(1, "The Hobbit", "J.R.R. Tolkien", 1937, "Fantasy", True, "dragon hoard")
+    add_book(1, "Dragon Rider", "Cornelia Funke", 1997, "Fantasy", False, None)
+    add_book(2, "Dragonflight", "Anne McCaffrey", 1968, "Fantasy", False, None)
+
+    results = search_books(1, "drag", ranked=True)
+
+    # title matches outrank note matches, other users are excluded
+    assert [book[1] for book in results] == ["Dragon Rider", "The Hobbit"]
+    assert "[dragon]" in results[1][7].lower()
+
+
+def test_ranked_search_follows_updates_and_deletes(test_db):
+    add_book(1, "Old Title", "Author", 2000, "Genre", False, None)
+    book_id = list_books(1)[0][0]
+
+    update_book(book_id, title="Brand New")
+    assert search_books(1, "old", ranked=True) == []
+    assert search_books(1, "brand", ranked=True)[0][0] == book_id
+
+    delete_book(book_id)
+    assert search_books(1, "brand", ranked=True) == []
+
+
+def test_ranked_search_falls_back_to_like(test_db):
+    add_book(1, "Middlemarch", "George Eliot", 1871, "Classic", False, None)
+    with connection.transaction() as conn:
+        conn.execute("DROP TABLE books_fts")
+
+    results = search_books(1, "march", ranked=True)
+    assert [(book[1], book[7]) for book in results] == [("Middlemarch", None)]
+
+
+# ----------------------------
+# CSV IMPORT TESTS
+# ----------------------------
+
+FLICK_CSV = """id,title,author,year,genre,read,note
+1,No longer human,osamu dazai,1998,1,,My favourite book
+2,2 states,cheetan bhagat,2007,1,,
+3,A Tale of Two Cities,Charles Dickens,1859,yes,Historical,Classic
+4,The Hobbit,J.R.R. Tolkien,1937,no,Fantasy,
+"""
+
+
+def test_csv_importer_parses_read_flags(test_db, tmp_path):
+    source = tmp_path / "flick.csv"
+    source.write_text(FLICK_CSV, encoding="utf-8")
+
+    summary = csv_importer(1, source)
+
+    assert summary["imported"] == 4
+    assert summary["rejected"] == 0
+    books = {book[1]: book for book in list_books(1)}
+    assert books["No longer human"][3] == 1998
+    assert books["No longer human"][4] == 1
+    assert books["A Tale of Two Cities"][4] == 1
+    assert books["A Tale of Two Cities"][5] == "Historical"
+    assert books["The Hobbit"][4] == 0
+
+
+def test_csv_importer_rejects_bad_rows(test_db, tmp_path):
+    source = tmp_path / "mixed.csv"
+    source.write_text(
+        "title,author,year,read\n"
+        "Good,Someone,2001,yes\n"
+        ",Nobody,2001,no\n"
+        "Bad Year,Someone,soon,no\n"
+        "Bad Flag,Someone,2001,maybe\n",
+        encoding="utf-8",
+    )
+
+    summary = csv_importer(1, source)
+
+    assert (summary["imported"], summary["rejected"]) == (1, 3)
+    rejects = (tmp_path / "mixed.rejects.csv").read_text(encoding="utf-8").splitlines()
+    assert [line.split(",")[0] for line in rejects[1:]] == ["2", "3", "4"]
+
+
+def test_csv_importer_commits_per_chunk_and_resumes(test_db, tmp_path):
+    source = tmp_path / "big.csv"
+    lines = ["title,author,year,read"] + [f"Book {i},Author,2000,no" for i in range(10)]
+    source.write_text("\n".join(lines), encoding="utf-8")
+
+    def crash(summary):
+        raise RuntimeError("interrupted")
+
+    with pytest.raises(RuntimeError):
+        import_csv(1, source, chunk_size=4, progress=crash)
+    assert len(list_books(1)) == 4
+
+    seen = []
+    summary = csv_importer(1, source, chunk_size=4, resume=True, progress=seen.append)
+
+    assert summary["resumed_from"] == 4
+    assert [s["imported"] for s in seen] == [4, 6]
+    assert sorted(book[1] for book in list_books(1)) == sorted(f"Book {i}" for i in range(10))
+    with connection.reader() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM import_progress").fetchone()[0] == 0
+
+
+def test_bulk_import_dedups_and_restores_indexes(test_db, tmp_path):
+    add_book(1, "The Hobbit", "J.R.R. Tolkien", 1937, "Fantasy", False, None)
+    source = tmp_path / "flick.csv"
+    source.write_text(FLICK_CSV + "5,2 States,Cheetan Bhagat,2007,1,,\n6,Nameless,,2001,no,,\n", encoding="utf-8")
+
+    summary = csv_importer(1, source, bulk=True)
+
+    assert (summary["imported"], summary["duplicates"], summary["rejected"]) == (3, 2, 1)
+    books = {book[1]: book for book in list_books(1)}
+    assert books["A Tale of Two Cities"][3:6] == (1859, 1, "Historical")
+    assert search_books(1, "dickens", ranked=True)[0][1] == "A Tale of Two Cities"
+    assert "idx_books_user_title" in query_plan(
+        "SELECT id FROM books WHERE user_id = ? AND title = 'x' COLLATE NOCASE", (1,))
+
+
+MESSY_HEADER = "id,title,author,year,read,genre,note\r\n"
+MESSY_ROWS = (
+    '1, Dune ,Frank Herbert,1965,YES,SF,spice\r\n'
+    '2,"Emma, or not",Jane Austen,,no,,"two\nlines, ""quoted"""\r\n'
+    '\r\n'
+    '3,Short\r\n'
+    '4,Bad Year,Someone,soon,no,,\r\n'
+    '5,Ōkagami,Anonymous,1100,1,History,\r\n'
+    '6,"Multi\n\nline",Writer,2001,0,,last\r\n'
+)
+
+
+def test_mapped_csv_matches_csv_module_by_range(tmp_path):
+    source = tmp_path / "messy.csv"
+    source.write_text(MESSY_HEADER + MESSY_ROWS * 3 + "7,Tail,Writer,1999,no,,", encoding="utf-8", newline="")
+
+    def reference(user_id):
+        with source.open(newline="", encoding="utf-8") as f:
+            positions, records = read_csv(f)
+            for number, row in records:
+                try:
+                    yield number, to_params(user_id, row, positions)
+                except RowError as e:
+                    yield number, str(e)
+
+    def mapped(reader, *bounds):
+        rows = []
+        for number, params in reader.params(1, *bounds, reject=lambda n, e, row: rows.append((n, str(e)))):
+            rows.append((number, params))
+        return sorted(rows)
+
+    expected = list(reference(1))
+    with MappedCSV(source, block_size=16) as reader:
+        assert mapped(reader) == expected
+        assert expected[1][1][1:3] == ("Emma, or not", "Jane Austen") and expected[2][1] == "title is empty"
+        assert expected[-1] == (22, (1, "Tail", "Writer", 1999, None, 0, None))
+        # workers reading ranges see the same records, numbered as a whole
+        ranges = reader.split(4)
+        assert len(ranges) == 4 and ranges[0][0] == reader.data_start and ranges[-1][1] == source.stat().st_size
+        assert sum((mapped(reader, *bounds) for bounds in ranges), []) == expected
+        offset = reader.skip(8)
+        assert mapped(reader, offset, None, 8) == expected[8:]
+        assert [row[0] for row in reader.fields()] == [number for number, _ in expected]
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_mid_field_quotes_are_text_and_unreadable_records_rejected(test_db, tmp_path, bulk):
+    source = tmp_path / "singles.csv"
+    singles = "".join(f'{i},The 12" Single {i},Band,1990,no,,\r\n' for i in range(2000))
+    source.write_text(MESSY_HEADER + singles + '9,"Broken",Wri\rter,2001,no,,\r\n', encoding="utf-8", newline="")
+
+    with MappedCSV(source, block_size=1024) as reader:
+        # a stray quote does not glue the rest of the file into one record
+        assert max(len(block) for block in reader._blocks(reader.data_start, reader.size)) < 2048
+        first = next(reader.params(1))[1]
+    assert first[1] == 'The 12" Single 0'
+
+    summary = csv_importer(1, source, bulk=bulk)
+    assert (summary["imported"], summary["rejected"]) == (2000, 1)
+    rejects = Path(summary["reject_file"]).read_text(encoding="utf-8")
+    assert "unreadable CSV record" in rejects
+
+
+def test_csv_batch_importer_splits_large_files(test_db, tmp_path):
+    source = tmp_path / "export.csv"
+    source.write_text(MESSY_HEADER + MESSY_ROWS * 40, encoding="utf-8", newline="")
+
+    summary = csv_batch_importer(1, [source], workers=3, split_size=1024, on_duplicate="keep")
+    result = summary["files"][str(source)]
+
+    assert (result["rows_read"], result["imported"], result["rejected"]) == (280, 160, 120)
+    rejects = (tmp_path / "export.rejects.csv").read_text(encoding="utf-8").splitlines()
+    assert rejects[0].startswith("row,reason") and len(rejects) == 121
+    assert [int(line.split(",")[0]) for line in rejects[1:4]] == [3, 4, 5]
+    assert not list(tmp_path.glob("*.part*"))
+    assert import_csv(1, source, on_duplicate="keep")["imported"] == 160
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.parametrize("policy, books, read", [("skip", 4, 0), ("update", 4, 1), ("keep", 8, 0)])
+def test_reimport_duplicate_policies(test_db, tmp_path, bulk, policy, books, read):
+    source = tmp_path / "flick.csv"
+    source.write_text(FLICK_CSV, encoding="utf-8")
+    csv_importer(1, source)
+    # same books with different spacing/case, and The Hobbit now read
+    source.write_text(FLICK_CSV.replace("The Hobbit,J.R.R. Tolkien,1937,no", "the  hobbit,J.R.R. TOLKIEN,1937,yes"),
+                      encoding="utf-8")
+
+    summary = csv_importer(1, source, bulk=bulk, on_duplicate=policy)
+
+    assert summary["imported"] == (4 if policy == "keep" else 0)
+    assert summary["duplicates"] == (0 if policy == "keep" else 4)
+    assert len(list_books(1)) == books
+    hobbit = [book for book in list_books(1) if book.year == 1937]
+    assert hobbit[0].read == read
+    assert check_stats(1) == []
+
+
+def test_add_book_duplicate_policies(test_db):
+    assert add_book(1, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    assert not add_book(1, " dune ", "frank  herbert", 1965, None, True, None)
+    assert add_book(2, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    assert add_book(1, "Dune", "Frank Herbert", 1984, "SF", False, None)
+    assert len(list_books(1)) == 2
+
+    assert add_book(1, "DUNE", "Frank Herbert", 1965, None, True, None, on_duplicate="update")
+    dune = [book for book in list_books(1) if book.year == 1965]
+    assert [(book.read, book.genre) for book in dune] == [(1, "SF")]
+
+    assert add_book(1, "Dune", "Frank Herbert", 1965, "SF", False, None, on_duplicate="keep")
+    assert len([book for book in list_books(1) if book.year == 1965]) == 2
+    with connection.reader() as conn:
+        assert "idx_books_user_fingerprint" in str(conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM books WHERE user_id = 1 AND fingerprint = 'dune|frank herbert|1965'"
+        ).fetchall())
+
+
+def test_migration_numbers_existing_duplicates(tmp_path):
+    legacy = tmp_path / "legacy.db"
+    conn = sqlite3.connect(legacy)
+    conn.execute("""
+        CREATE TABLE books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            year INTEGER,
+            genre TEXT,
+            read BOOLEAN DEFAULT 0,
+            note TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.executemany("INSERT INTO books (user_id, title, author, year) VALUES (?, ?, ?, ?)",
+                     [(1, "Emma", "Jane Austen", 1815), (1, "emma ", "Jane  Austen", 1815), (1, "Emma", "Jane Austen", None)])
+    conn.commit()
+    conn.close()
+
+    connection.configure(legacy)
+    try:
+        init_db()
+        with connection.reader() as conn:
+            assert conn.execute("SELECT copy FROM books ORDER BY id").fetchall() == [(0,), (1,), (0,)]
+        assert not add_book(1, "Emma", "Jane Austen", 1815, None, False, None)
+    finally:
+        connection.close_pool()
+
+
+def test_near_duplicates_finds_typos_not_different_books(test_db):
+    add_book(1, "The Lord of the Rings", "J.R.R. Tolkien", 1954, None, False, None)
+    add_book(1, "Lord of the Rigns", "J.R.R. Tolkien", 1954, None, False, None)
+    add_book(1, "Pride and Prejudice", "Jane Austen", 1813, None, False, None)
+    add_book(1, "Pride and Prejudice", "Jane Austin", 1813, None, False, None)
+    add_book(1, "Persuasion", "Jane Austen", 1817, None, False, None)
+    add_book(1, "Emma", "Jane Austen", 1815, None, False, None)
+    add_book(1, "Emma", "Jane Austen", 1815, None, False, None, on_duplicate="keep")
+    add_book(2, "Lord of the Rings", "J.R.R. Tolkien", 1954, None, False, None)
+
+    pairs = db_handler.near_duplicates(1)
+
+    assert sorted((first.title, second.title) for _, first, second in pairs) == [
+        ("Pride and Prejudice", "Pride and Prejudice"),
+        ("The Lord of the Rings", "Lord of the Rigns"),
+    ]
+    assert all(0.85 <= score < 1 for score, _, _ in pairs)
+
+
+def test_add_books_and_delete_books_in_one_transaction(test_db):
+    books = [("Dune", "Frank Herbert", 1965, "SF", True, None),
+             {"title": "Emma", "author": "Jane Austen", "read": False},
+             ("dune", "frank herbert", 1965, None, False, None)]
+    assert add_books(1, books) == 2
+    assert add_books(2, [("Dune", "Frank Herbert", 1965, "SF", True, None)]) == 1
+    # one invalid book rolls back the whole batch
+    assert add_books(1, [("Persuasion", "Jane Austen"), ("", "Nobody")]) is False
+    assert sorted(book.title for book in list_books(1)) == ["Dune", "Emma"]
+
+    ids = [book.id for book in list_books(1)]
+    other = list_books(2)[0].id
+    assert delete_books(1, ids + [other, 999]) == 2
+    assert list_books(1) == []
+    assert [book.id for book in list_books(2)] == [other]
+
+
+def test_library_cli_pipes_books_through_stdin(test_db, capsys):
+    books = io.StringIO("title,author,year,read\nDune,Frank Herbert,1965,yes\nEmma,Jane Austen,,no\n")
+    assert library.main(["--user", "1", "--format", "csv", "add"], stdin=books) == 0
+    out, err = capsys.readouterr()
+    assert json.loads(out) == {"added": 2, "duplicates": 0}
+    assert json.loads(err.splitlines()[-1])["items"] == 2
+
+    assert library.main(["--user", "1", "--quiet", "list"]) == 0
+    listed = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {(book["title"], book["read"]) for book in listed} == {("Dune", 1), ("Emma", 0)}
+
+    ids = io.StringIO("\n".join(json.dumps(book) for book in listed))
+    assert library.main(["--user", "2", "--quiet", "delete"], stdin=ids) == 0
+    assert json.loads(capsys.readouterr().out) == {"deleted": 0, "missing": 2}
+    assert library.main(["--user", "1", "--quiet", "--format", "json", "add"],
+                        stdin=io.StringIO('[{"title": ""}]')) == 1
+
+
+def pull_all(user_id, cursor=0, limit=2):
+    changes = []
+    while True:
+        batch = db_handler.book_changes(user_id, cursor, limit)
+        assert len(batch["changes"]) <= limit and not batch["resync"]
+        changes += batch["changes"]
+        cursor = batch["cursor"]
+        if not batch["more"]:
+            return changes, cursor
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_change_feed_records_every_write(test_db, tmp_path, bulk):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    add_book(2, "Other", "Someone", None, None, False, None)
+    dune = list_books(1)[0].id
+    update_book(dune, read=True, note="great", user_id=1)
+    update_book(dune, read=True, user_id=1)  # no change, not logged
+    source = tmp_path / "flick.csv"
+    source.write_text(FLICK_CSV, encoding="utf-8")
+    csv_importer(1, source, bulk=bulk)
+    delete_book(dune)
+
+    changes, cursor = pull_all(1)
+
+    assert [change.op for change in changes] == ["insert", "update"] + ["insert"] * 4 + ["delete"]
+    assert changes[0].fields == {"title": "Dune", "author": "Frank Herbert", "year": 1965,
+                                 "genre": "SF", "read": 0, "note": None}
+    assert changes[1].fields == {"read": 1, "note": "great"}
+    assert {change.fields["title"] for change in changes[2:6]} == {book.title for book in list_books(1)}
+    assert (changes[-1].book_id, changes[-1].fields) == (dune, None)
+    assert [change.seq for change in changes] == sorted(change.seq for change in changes)
+    assert pull_all(1, cursor) == ([], cursor)
+    assert [change.op for change in pull_all(2)[0]] == ["insert"]
+    assert "idx_book_changes_user" in query_plan(
+        "SELECT seq FROM book_changes WHERE user_id = ? AND seq > 0 ORDER BY seq", (1,))
+
+
+def test_change_feed_compaction_and_truncation(test_db):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    add_book(1, "Emma", "Jane Austen", 1815, None, False, None)
+    dune, emma = sorted(book.id for book in list_books(1))
+    update_book(dune, read=True, user_id=1)
+    update_book(dune, genre="Classic", user_id=1)
+    update_book(emma, note="reread", user_id=1)
+    first, middle = db_handler.book_changes(1, 0, 1)["cursor"], db_handler.book_changes(1, 0, 3)["cursor"]
+    delete_book(emma)
+
+    assert compact_changes() == {"removed": 4, "books": 2}
+    changes, cursor = pull_all(1)
+    assert [(change.book_id, change.op) for change in changes] == [(dune, "insert"), (emma, "delete")]
+    assert changes[0].fields == {"title": "Dune", "author": "Frank Herbert", "year": 1965,
+                                 "genre": "Classic", "read": 1, "note": None}
+    # a consumer that was half way through only sees the merged results
+    assert [change.op for change in pull_all(1, middle)[0]] == ["insert", "delete"]
+
+    assert truncate_changes(changes[0].seq + 1) == 1
+    assert db_handler.book_changes(1, first)["resync"]
+    assert change_cursor(1) == cursor
+    assert db_handler.book_changes(1, first)["cursor"] == cursor
+    assert [change.op for change in pull_all(1, changes[0].seq)[0]] == ["delete"]
+
+
+@pytest.fixture(scope="function")
+def sharded_db(test_db, tmp_path):
+    router = configure_shards(2, tmp_path / "shards")
+    init_db()
+    yield router
+    configure_shards(0)
+
+
+def books_in(pool, user_id=None):
+    with pool.reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM books WHERE ifnull(?, user_id) = user_id", (user_id,)).fetchone()[0]
+
+
+def test_sharded_handlers_route_by_user(sharded_db, tmp_path):
+    assert add_user("odd", "odd@example.com", "pw") and add_user("even", "even@example.com", "pw")
+    odd, even = check_user("odd", "pw"), check_user("even", "pw")
+    add_book(odd, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    add_books(even, [("Emma", "Jane Austen", 1815, None, True, None), ("Persuasion", "Jane Austen", 1817, None, False, None)])
+
+    catalog, (shard0, shard1) = connection.get_pool(), sharded_db.pools
+    assert (books_in(catalog), books_in(shard0, even), books_in(shard1, odd)) == (0, 2, 1)
+    with catalog.reader() as conn:
+        assert dict(conn.execute("SELECT user_id, shard FROM user_shards")) == {odd: 1, even: 0}
+
+    dune = list_books(odd)[0]
+    assert dune.id >> 40 == 2 and all(book.id >> 40 == 1 for book in list_books(even))
+    assert search_books(even, "austen", ranked=True)[0].author == "Jane Austen"
+    assert update_book(dune.id, read=True) == 1 and find_book(odd, dune.id).read == 1
+    assert book_stats(even)["total"] == 2
+    assert [change.op for change in db_handler.book_changes(odd)["changes"]] == ["insert", "update"]
+    assert csv_exporter(even, path=tmp_path / "even.csv")["rows"] == 2
+    assert delete_book(dune.id) and books_in(shard1) == 0
+
+
+def test_rebalance_moves_legacy_books_and_resyncs_feeds(test_db, tmp_path):
+    add_user("reader", "reader@example.com", "pw")
+    user_id = check_user("reader", "pw")
+    add_book(user_id, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    add_book(user_id, "Emma", "Jane Austen", 1815, None, True, None)
+    cursor = db_handler.book_changes(user_id)["cursor"]
+    ids = sorted(book.id for book in list_books(user_id))
+
+    router = configure_shards(2, tmp_path / "shards")
+    try:
+        init_db()
+        # not moved yet: still served from library.db
+        assert sorted(book.id for book in list_books(user_id)) == ids
+        assert plan_rebalance() == [(user_id, -1, user_id % 2)]
+
+        assert move_user(user_id, user_id % 2) == 2
+        assert plan_rebalance() == []
+        assert books_in(connection.get_pool()) == 0
+        assert books_in(router.pools[user_id % 2], user_id) == 2
+        assert sorted(book.id for book in list_books(user_id)) == ids
+        assert search_books(user_id, "dune", ranked=True)[0].id == ids[0]
+        assert book_stats(user_id)["read"] == 1
+        assert check_stats(user_id) == []
+        assert db_handler.book_changes(user_id, cursor)["resync"]
+        assert [change.op for change in db_handler.book_changes(user_id)["changes"]] == ["insert", "insert"]
+
+        assert move_user(user_id, 1 - user_id % 2) == 2
+        assert books_in(router.pools[user_id % 2]) == 0
+        assert add_book(user_id, "Persuasion", "Jane Austen", 1817, None, False, None)
+        assert books_in(router.pools[1 - user_id % 2], user_id) == 3
+    finally:
+        configure_shards(0)
+
+
+def test_rebalance_dry_run_does_not_place_users(test_db, tmp_path, capsys):
+    add_user("reader", "reader@example.com", "pw")
+    user_id = check_user("reader", "pw")
+    try:
+        args = ["--shards", "2", "--dir", str(tmp_path / "shards"), "--dry-run"]
+        assert rebalance.main([*args, "--user", str(user_id)]) == 0
+        assert "0 users to move" in capsys.readouterr().out
+        with connection.get_pool().reader() as conn:
+            assert conn.execute("SELECT count(*) FROM user_shards").fetchone()[0] == 0
+    finally:
+        configure_shards(0)
+
+
+
+def test_moving_a_user_down_keeps_shard_book_ids_apart(test_db, tmp_path):
+    router = configure_shards(2, tmp_path / "shards")
+    try:
+        init_db()
+        mover, stay_low, stay_high = (add_user(name, f"{name}@example.com", "pw") for name in ("a", "b", "c"))
+        for user_id in (mover, stay_low, stay_high):
+            move_user(user_id, 1 if user_id in (mover, stay_high) else 0)
+        add_book(mover, "Dune", "Frank Herbert", 1965, "SF", False, None)
+
+        assert move_user(mover, 0) == 1
+        assert list_books(mover)[0].id >> SHARD_BITS == 1
+        add_book(stay_low, "Emma", "Jane Austen", 1815, None, True, None)
+        add_book(stay_high, "Persuasion", "Jane Austen", 1817, None, False, None)
+        low, high = list_books(stay_low)[0].id, list_books(stay_high)[0].id
+        assert low >> SHARD_BITS == 1 and high >> SHARD_BITS == 2
+
+        # an id of another user's book is refused, not deleted on their shard
+        assert delete_book(high, user_id=stay_low) is False
+        assert update_book(high, note="mine", user_id=stay_low) == 0
+        assert delete_book(low, user_id=stay_low) is True
+        assert list_books(stay_low) == [] and len(list_books(stay_high)) == 1
+    finally:
+        configure_shards(0)
+
+# ----------------------------
+# EXPORT TESTS
+# ----------------------------
+
+def test_csv_exporter_keeps_file_modes(test_db, tmp_path):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", False, None)
+    target = tmp_path / "books.csv"
+    umask = os.umask(0o022)
+    try:
+        csv_exporter(1, path=target)
+    finally:
+        os.umask(umask)
+    assert target.stat().st_mode & 0o777 == 0o644
+
+    target.chmod(0o640)
+    csv_exporter(1, path=target)
+    assert target.stat().st_mode & 0o777 == 0o640
+
+
+def test_csv_exporter_writes_matching_header_and_truncates(test_db, tmp_path):
+    target = tmp_path / "out.csv"
+    for i in range(3):
+        add_book(1, f"Book {i}", "Author", 2000 + i, "Genre", i == 0, None)
+    assert csv_exporter(1, path=target)["rows"] == 3
+
+    delete_book(list_books(1)[0][0])
+    csv_exporter(1, path=target)
+
+    lines = target.read_text(encoding="utf-8").splitlines()
+    assert lines[0] == "id,title,author,year,read,genre,note"
+    assert len(lines) == 3
+    assert lines[1].split(",")[4:6] == ["0", "Genre"]
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+
+
+def test_csv_exporter_round_trips_through_importer(test_db, tmp_path):
+    user_id = add_user("reader", "reader@example.com", "secret")
+    add_book(user_id, "Beloved", "Toni Morrison", 1987, "Fiction", True, "Pulitzer")
+    summary = csv_exporter(user_id, path=tmp_path / "beloved.csv")
+
+    csv_importer(2, summary["file"])
+    assert [book[1:] for book in list_books(2)] == [book[1:] for book in list_books(user_id)]
+
+
+def test_export_jsonl_gzip_incremental(test_db, tmp_path):
+    add_book(1, "Old", "Author", 1990, "Genre", False, None)
+    add_book(1, "New", "Author", 2020, "Genre", True, None)
+    with connection.transaction() as conn:
+        conn.execute("""
+            UPDATE books SET updated_at = '2000-01-01 00:00:00',
+                added_at = CASE title WHEN 'New' THEN '2030-01-01 00:00:00' ELSE '2000-01-01 00:00:00' END
+        """)
+
+    summary = csv_exporter(1, path=tmp_path / "books.jsonl.gz", fmt="jsonl", compress=True,
+                           since="2010-01-01 00:00:00")
+
+    with gzip.open(summary["file"], "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [(r["title"], r["read"]) for r in records] == [("New", True)]
+
+    update_book(list_books(1)[0][0], note="changed")
+    summary = csv_exporter(1, path=tmp_path / "changes.csv", since="2010-01-01 00:00:00")
+    assert summary["rows"] == 2
+
+
+# ----------------------------
+# PAGINATION TESTS
+# ----------------------------
+
+def seed_library():
+    books = [("beta", 2001, True), ("Alpha", 1999, False), ("alpha", None, True),
+             ("Gamma", 2001, False), ("delta", 1999, True), ("Beta", 2001, False)]
+    for title, year, read in books:
+        add_book(1, title, "Author", year, "Genre", read, None, on_duplicate="keep")
+    add_book(2, "Other user", "Author", 2000, "Genre", True, None)
+
+
+@pytest.mark.parametrize("sort", ["id", "title", "author", "year", "read"])
+@pytest.mark.parametrize("read", [None, True, False])
+def test_iter_book_pages_matches_full_sort(test_db, sort, read):
+    seed_library()
+    expected = [book for book in list_books(1) if read is None or book[4] == read]
+    sort_key = {
+        "id": lambda b: b[0],
+        "title": lambda b: (b[1].lower(), b[0]),
+        "author": lambda b: (b[2].lower(), b[1].lower(), b[0]),
+        "year": lambda b: (b[3] if b[3] is not None else -1, b[0]),
+        "read": lambda b: (b[4], b[1].lower(), b[0]),
+    }[sort]
+
+    pages = list(iter_book_pages(1, sort=sort, read=read, page_size=2))
+
+    assert [book for page in pages for book in page] == sorted(expected, key=sort_key)
+    assert all(len(page) <= 2 for page in pages)
+
+
+@pytest.mark.parametrize("sort", ["id", "title", "author", "year", "read"])
+@pytest.mark.parametrize("read", [None, True])
+def test_page_queries_seek_without_sorting(test_db, sort, read):
+    seed_library()
+    # readers are reused last-in first-out, so the pages run on this connection
+    statements = []
+    with connection.reader() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        list(iter_book_pages(1, sort=sort, read=read, page_size=2))
+    finally:
+        conn.set_trace_callback(None)
+
+    assert statements
+    for sql in statements:
+        plan = query_plan(sql)
+        assert "TEMP B-TREE" not in plan, (sql, plan)
+        assert "SCAN" not in plan, (sql, plan)
+
+
+
+def test_page_listing_reports_errors_instead_of_raising(test_db, monkeypatch, capsys):
+    seed_library()
+
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(db_handler, "reader", locked)
+    assert db_handler.list_books_page(1) == ([], None)
+    assert list(iter_book_pages(1)) == []
+    assert "Error in list_books_page: database is locked" in capsys.readouterr().out
+    assert db_handler.list_books_page(1, sort="colour") == ([], None)
+    assert "unknown sort order 'colour'" in capsys.readouterr().out
+
+def test_sort_keys_drop_articles_and_order_by_surname(test_db, tmp_path):
+    library = [("The Hobbit", "J.R.R. Tolkien"), ("Anna Karenina", "Leo Tolstoy"),
+               ("a Game of Thrones", "Martin, George R.R."), ("Emma", "Jane Austen"), ("Odyssey", "Homer")]
+    for title, author in library:
+        add_book(1, title, author, 2000, "Genre", False, None)
+
+    def titles(sort):
+        return [book[1] for page in iter_book_pages(1, sort=sort, page_size=2) for book in page]
+
+    assert titles("title") == ["Anna Karenina", "Emma", "a Game of Thrones", "The Hobbit", "Odyssey"]
+    assert titles("author") == ["Emma", "Odyssey", "a Game of Thrones", "The Hobbit", "Anna Karenina"]
+
+    # the keys follow every write
+    emma = next(book for book in list_books(1) if book[1] == "Emma")
+    update_book(emma[0], title="The Watsons", author="Austen, Jane")
+    assert titles("title")[-1] == "The Watsons"
+
+    summary = csv_exporter(1, path=tmp_path / "by_author.csv", sort="author")
+    with open(summary["file"], newline="", encoding="utf-8") as f:
+        exported = [row["title"] for row in csv.DictReader(f)]
+    assert exported == ["The Watsons", "Odyssey", "a Game of Thrones", "The Hobbit", "Anna Karenina"]
+    assert csv_exporter(1, path=tmp_path / "x.csv", sort="colour") is False
+
+
+@pytest.mark.parametrize("sort", sorted(SORT_KEYS))
+def test_export_order_comes_from_an_index(test_db, sort):
+    keys, index = SORT_KEYS[sort]
+    plan = query_plan(f"""
+        SELECT id, title, author, year, read, genre, note FROM books INDEXED BY {index}
+        WHERE user_id = ? AND (added_at > ? OR updated_at > ?) ORDER BY {", ".join(keys)}
+    """, (1, "", ""))
+    assert "TEMP B-TREE" not in plan and index in plan, plan
+
+# ----------------------------
+# READ CACHE TESTS
+# ----------------------------
+
+def test_cache_serves_repeated_lookups(cached_db):
+    add_book(1, "Ulysses", "James Joyce", 1922, "Modernist", False, None)
+    book_id = list_books(1)[0][0]
+
+    assert check_book(1, book_id) is True
+    assert find_book(1, book_id)[1] == "Ulysses"
+    list_books(1)
+
+    stats = cached_db.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+
+
+def test_cached_results_are_not_shared_with_callers(cached_db):
+    add_book(1, "Ulysses", "James Joyce", 1922, "Modernist", False, None)
+
+    first = list_books(1)  # a miss: stored, then returned
+    first.append("junk")
+    second = list_books(1)  # a hit
+    second.clear()
+    assert [book.title for book in list_books(1)] == ["Ulysses"]
+
+
+def test_cache_invalidated_by_writes(cached_db, tmp_path):
+    add_book(1, "Ulysses", "James Joyce", 1922, "Modernist", False, None)
+    book_id = list_books(1)[0][0]
+    assert search_books(1, "Ulysses")
+
+    update_book(book_id, title="Dubliners")
+    assert find_book(1, book_id)[1] == "Dubliners"
+    assert search_books(1, "Ulysses") == []
+
+    source = tmp_path / "more.csv"
+    source.write_text("title,author\nFinnegans Wake,James Joyce\n", encoding="utf-8")
+    csv_importer(1, source)
+    assert len(list_books(1)) == 2
+
+    delete_book(book_id)
+    assert check_book(1, book_id) is False
+    assert len(list_books(1)) == 1
+
+
+def test_cache_is_per_user_and_bounded(cached_db):
+    for user_id in range(1, 11):
+        list_books(user_id)
+    stats = cached_db.stats()
+    assert stats["size"] == 8
+    assert stats["evictions"] == 2
+
+    list_books(10)
+    add_book(9, "Emma", "Jane Austen", 1815, "Classic", False, None)
+    assert cached_db.stats()["size"] == 7
+    assert len(list_books(9)) == 1
+    list_books(10)
+    assert cached_db.stats()["hits"] == 2
+
+
+# ----------------------------
+# UPDATE TESTS
+# ----------------------------
+
+def test_update_book_is_one_statement_and_checks_owner(test_db):
+    add_book(1, "Title", "Author", 2000, "Genre", False, None)
+    book_id = list_books(1)[0][0]
+
+    statements = []
+    with connection.transaction() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        assert update_book(book_id, author="New Author", year=2001, read=True, user_id=1) == 1
+    finally:
+        conn.set_trace_callback(None)
+
+    # triggers re-report their parent statement, so compare distinct statements
+    updates = {sql for sql in statements if sql.startswith("UPDATE books SET")}
+    # an author or year change also picks the book's copy number
+    [update] = updates
+    assert update.startswith("UPDATE books SET author = 'New Author', year = 2001, read = 1, copy = (")
+    assert update.endswith(f"WHERE id = {book_id} AND user_id = 1")
+    assert update_book(book_id, title="Stolen", user_id=2) == 0
+    assert update_book(book_id) == 0
+    assert find_book(1, book_id)[1:5] == ("Title", "New Author", 2001, 1)
+
+
+def test_update_books_marks_many_read(test_db):
+    for i in range(5):
+        add_book(1, f"Book {i}", "Author", 2000, "Genre", False, None)
+    add_book(2, "Not mine", "Author", 2000, "Genre", False, None)
+    ids = [book[0] for book in list_books(1)] + [list_books(2)[0][0]]
+
+    assert update_books(1, ids, read=True, genre="Finished") == 5
+    assert {(book[4], book[5]) for book in list_books(1)} == {(1, "Finished")}
+    assert list_books(2)[0][4] == 0
+
+
+def test_failed_updates_report_zero_rows(test_db, monkeypatch, capsys):
+    add_book(1, "Title", "Author", 2000, "Genre", False, None)
+    book_id = list_books(1)[0][0]
+
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(db_handler, "transaction", locked)
+    counts = [update_book(book_id, read=True, user_id=1), update_books(1, [book_id], read=True)]
+    # 0, not False, as the docstrings promise a row count
+    assert counts == [0, 0] and all(type(count) is int for count in counts)
+    out = capsys.readouterr().out
+    assert "Error in update_book: database is locked" in out
+    assert "Error in update_books: database is locked" in out
+
+
+# ----------------------------
+# ASYNC API TESTS
+# ----------------------------
+
+def test_async_library_mirrors_handlers(test_db):
+    async def scenario():
+        async with AsyncLibrary(readers=2) as library:
+            added = await asyncio.gather(*(
+                library.add_book(1, f"Book {i}", "Author", 2000, "Genre") for i in range(10)
+            ))
+            books, found = await asyncio.gather(library.list_books(1), library.search_books(1, "Book 3"))
+            changed = await library.update_book(books[0][0], read=True, user_id=1)
+            return added, books, found, changed, library.stats()
+
+    added, books, found, changed, stats = asyncio.run(scenario())
+    assert added == [True] * 10
+    assert len(books) == 10
+    assert [book[1] for book in found] == ["Book 3"]
+    assert changed == 1
+    assert stats["writer"]["completed"] == 11
+    assert stats["reader"]["completed"] == 2
+
+
+def test_async_library_times_out_and_applies_backpressure(test_db, monkeypatch):
+    release = threading.Event()
+    running = []
+
+    def slow_list_books(user_id):
+        running.append(user_id)
+        release.wait(2)
+        return []
+
+    monkeypatch.setattr(db_handler, "list_books", slow_list_books)
+
+    async def scenario():
+        library = AsyncLibrary(readers=1, max_pending=2, timeout=5)
+        try:
+            calls = [asyncio.create_task(library.list_books(n)) for n in range(4)]
+            await asyncio.sleep(0.1)
+            in_flight = library.reader.pending
+            with pytest.raises(asyncio.TimeoutError):
+                await library.list_books(99, timeout=0.05)
+            calls[3].cancel()
+            release.set()
+            results = await asyncio.gather(*calls, return_exceptions=True)
+            return in_flight, results, library.stats()["reader"]
+        finally:
+            library.close()
+
+    in_flight, results, stats = asyncio.run(scenario())
+    assert in_flight == 2
+    assert results[:3] == [[], [], []]
+    assert isinstance(results[3], asyncio.CancelledError)
+    assert sorted(running) == [0, 1, 2]
+    assert stats["timed_out"] == 1 and stats["cancelled"] == 1
+
+
+def test_csv_batch_importer_uses_worker_processes(test_db, tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    for n in range(3):
+        lines = ["title,author,year,read"] + [f"File{n} Book {i},Author,2000,yes" for i in range(25)]
+        if n == 1:
+            lines.append("Broken,Author,later,no")
+        (inbox / f"dump{n}.csv").write_text("\n".join(lines), encoding="utf-8")
+
+    summary = csv_batch_importer(1, inbox, workers=2, chunk_size=10)
+
+    assert summary["imported"] == 75
+    assert summary["rejected"] == 1
+    per_file = {Path(name).name: result for name, result in summary["files"].items()}
+    assert per_file["dump1.csv"]["rejected"] == 1
+    assert all(result["imported"] == 25 and result["error"] is None for result in per_file.values())
+    assert len(list_books(1)) == 75
+
+    missing = csv_batch_importer(1, [inbox / "nope.csv"], workers=1)
+    assert "FileNotFoundError" in missing["files"][str(inbox / "nope.csv")]["error"]
+
+
+def test_unreadable_header_fails_the_import_like_a_missing_file(test_db, tmp_path, capsys):
+    broken = tmp_path / "broken.csv"
+    broken.write_text("title,au\rthor,year,read\n" + "Book,Author,2000,yes\n" * 50, encoding="utf-8")
+
+    assert csv_importer(1, broken) is False
+    assert "header: unreadable CSV record" in capsys.readouterr().out
+    assert csv_importer(1, broken, bulk=True) is False
+
+    # large enough to be split, which reads the header in this process
+    summary = csv_batch_importer(1, [broken], workers=2, split_size=64)
+    assert summary["imported"] == 0
+    assert "RowError: header" in summary["files"][str(broken)]["error"]
+    assert list_books(1) == []
+
+
+
+def test_csv_batch_importer_survives_writer_errors(test_db, tmp_path, monkeypatch):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    for n in range(2):
+        lines = ["title,author,year,read"] + [f"File{n} Book {i},Author,2000,yes" for i in range(200)]
+        (inbox / f"dump{n}.csv").write_text("\n".join(lines), encoding="utf-8")
+
+    def locked(conn, rows, on_duplicate):
+        raise sqlite3.OperationalError("database is locked")
+
+    # chunks of one row fill the queue, so the workers block on it
+    monkeypatch.setattr(importer, "insert_books", locked)
+    summary = csv_batch_importer(1, inbox, workers=2, chunk_size=1)
+    assert summary["imported"] == 0
+    assert all("database is locked" in result["error"] for result in summary["files"].values())
+
+    class Abort(BaseException):
+        pass
+
+    def abort(conn, rows, on_duplicate):
+        raise Abort()
+
+    monkeypatch.setattr(importer, "insert_books", abort)
+    with pytest.raises(Abort):
+        csv_batch_importer(1, inbox, workers=2, chunk_size=1)
+    assert list_books(1) == []
+
+def test_handlers_return_book_records(test_db):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", True, "spice")
+    add_book(1, "Emma", "Jane Austen", None, None, False, None)
+
+    books = sorted(list_books(1))
+    dune = find_book(1, books[0].id)
+    page, _ = db_handler.list_books_page(1)
+    hit = search_books(1, "dune", ranked=True)[0]
+
+    assert all(type(book) is Book for book in books + page + [dune])
+    assert dune == (books[0].id, "Dune", "Frank Herbert", 1965, 1, "SF", "spice")
+    assert (dune.read, dune.genre) == (1, "SF")
+    assert page == books
+    assert type(hit) is SearchHit and hit.title == "Dune" and "[" in hit.snippet
+
+
+def test_list_books_columns(test_db):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", True, None)
+    add_book(1, "Emma", "Jane Austen", None, None, False, None)
+    add_book(2, "Other user", "Author", 2000, "Genre", True, None)
+
+    columns = list_books_columns(1)
+
+    assert columns["title"] == ["Dune", "Emma"]
+    assert columns["read"].typecode == "q" and list(columns["read"]) == [1, 0]
+    assert columns["year"] == [1965, None]
+    assert list(zip(*columns.values())) == sorted(list_books(1))
+    assert all(len(column) == 0 for column in list_books_columns(3).values())
+
+
+def test_bulk_import_defers_indexes_only_for_large_loads(test_db, tmp_path, monkeypatch):
+    def index_names():
+        with connection.reader() as conn:
+            return {row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE tbl_name = 'books' AND sql IS NOT NULL")}
+
+    indexes = index_names()
+    path = tmp_path / "few.csv"
+    path.write_text("title,author,year,read\nSandman,Neil Gaiman,2005,yes\n", encoding="utf-8")
+    assert bulk_import_csv(1, path)["deferred_indexes"] is False
+
+    # a load that fails after the drop leaves every index and trigger in place
+    def broken(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(importer, "log_inserts", broken)
+    path.write_text("title,author,year,read\nDune,Frank Herbert,1965,no\n", encoding="utf-8")
+    with pytest.raises(sqlite3.OperationalError):
+        bulk_import_csv(1, path, defer_indexes=True)
+    assert index_names() == indexes
+    assert [book.title for book in list_books(1)] == ["Sandman"]
+
+    monkeypatch.undo()
+    assert bulk_import_csv(1, path, defer_indexes=True)["imported"] == 1
+    assert index_names() == indexes
+    assert search_books(1, "dune")[0].title == "Dune"
+
+
+def test_reading_stats_follow_writes(test_db, tmp_path):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", True, None)
+    add_book(1, "Children of Dune", "Frank Herbert", 1976, "SF", False, None)
+    add_book(1, "Emma", "Jane Austen", 1815, None, False, None)
+    add_book(2, "Other user", "Author", 2000, "Genre", True, None)
+    emma = next(book for book in list_books(1) if book.title == "Emma")
+    update_book(emma.id, read=True, genre="Classic", user_id=1)
+    delete_book(next(book.id for book in list_books(1) if book.title == "Children of Dune"))
+    path = tmp_path / "more.csv"
+    path.write_text("title,author,year,read\nPersuasion,Jane Austen,1817,no\n", encoding="utf-8")
+    csv_importer(1, path)
+    path.write_text("title,author,year,read\nSandman,Neil Gaiman,2005,yes\n", encoding="utf-8")
+    bulk_import_csv(1, path)
+
+    stats = book_stats(1)
+
+    assert (stats["total"], stats["read"], stats["unread"]) == (4, 3, 1)
+    assert stats["read_pct"] == 75.0
+    assert stats["authors"][0] == ("Jane Austen", 2, 1)
+    assert ("Classic", 1, 1) in stats["genres"] and (None, 2, 1) in stats["genres"]
+    assert [decade for decade, _, _ in stats["decades"]] == [1810, 1960, 2000]
+    assert sum(books for _, books in stats["added"]) == 4
+    assert check_stats() == []
+
+
+def test_rebuild_stats_repairs_drift(test_db):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", True, None)
+    with connection.transaction() as conn:
+        conn.execute("UPDATE book_stats SET total = 7 WHERE user_id = 1 AND dimension = 'author'")
+        conn.execute("DROP TRIGGER books_stats_insert")
+        conn.execute("INSERT INTO books (user_id, title, author, read) VALUES (1, 'Emma', 'Jane Austen', 0)")
+
+    drift = check_stats(1)
+    assert ("Frank Herbert", (7, 1), (1, 1)) in [(bucket, stored, actual) for _, dim, bucket, stored, actual in drift
+                                                 if dim == "author"]
+    result = rebuild_stats(1)
+
+    assert result["drifted"] == len(drift) and result["consistent"]
+    assert check_stats() == []
+    assert book_stats(1)["total"] == 2
+
+
+@pytest.fixture
+def metrics_on(test_db):
+    collected = configure_metrics(enabled=True, slow_ms=1e9)
+    yield collected
+    configure_metrics(enabled=False, slow_ms=100.0)
+
+
+def test_metrics_record_calls_statements_and_counters(metrics_on):
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", True, None)
+    add_book(1, "Emma", "Jane Austen", 1815, None, False, None)
+    list_books(1)
+    find_book(1, 12345)
+
+    snapshot = json.loads(json.dumps(metrics_on.snapshot()))
+
+    assert snapshot["calls"]["add_book"]["count"] == 2
+    assert snapshot["calls"]["list_books"]["p99_ms"] >= snapshot["calls"]["list_books"]["p50_ms"] > 0
+    assert snapshot["counters"]["transactions"] == 2
+    assert snapshot["counters"]["rows_written"] >= 2
+    assert snapshot["counters"]["rows_returned"] == 2
+    inserts = [shape for shape in snapshot["statements"] if shape.startswith("INSERT INTO books")]
+    assert len(inserts) == 1 and "'Dune'" not in inserts[0]
+    assert snapshot["statements"][inserts[0]]["count"] == 2
+    assert snapshot["slow"] == []
+
+
+def test_metrics_log_slow_statements_with_plan(metrics_on, tmp_path):
+    configure_metrics(slow_ms=0, slow_log=tmp_path / "slow.jsonl")
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", True, None)
+    find_book(1, 1)
+
+    slow = [entry for entry in metrics_on.snapshot()["slow"] if entry["sql"].startswith("SELECT id, title")]
+    assert slow and any("USING INTEGER PRIMARY KEY" in step for step in slow[0]["plan"])
+    logged = [json.loads(line) for line in (tmp_path / "slow.jsonl").read_text().splitlines()]
+    assert len(logged) == len(metrics_on.snapshot()["slow"])
+
+
+def test_metrics_disabled_records_nothing(test_db):
+    collected = configure_metrics(enabled=False)
+    add_book(1, "Dune", "Frank Herbert", 1965, "SF", True, None)
+    list_books(1)
+
+    snapshot = collected.snapshot()
+    assert snapshot["calls"] == {} and snapshot["statements"] == {} and snapshot["counters"] == {}
+
+
+def test_workload_does_no_more_work_than_stored_baseline(test_db, tmp_path):
+    baseline = json.loads(benchmark.BASELINE.read_text(encoding="utf-8"))
+    config = baseline["config"]
+
+    result = benchmark.run_workload(tmp_path, config["users"], config["books"], config["ops"], config["seed"],
+                                    config["mix"])
+
+    assert set(result["operations"]) == set(baseline["operations"])
+    # statements and VM steps only: throughput is machine-dependent (see --check-baseline)
+    assert benchmark.compare_to_baseline(result, baseline) == []
+
+
+def test_compare_to_baseline_flags_extra_work():
+    op = {"ops_per_sec": 1000.0, "statements_per_op": 3.0, "vm_steps_per_op": 4000}
+    baseline = {"ops_per_sec": 1000.0, "operations": {"list": op}}
+    slower = {"ops_per_sec": 900.0, "operations": {"list": {**op, "vm_steps_per_op": 40000}}}
+
+    assert benchmark.compare_to_baseline(baseline, baseline) == []
+    assert [r.split(":")[0] for r in benchmark.compare_to_baseline(slower, baseline)] == ["list"]
+    # throughput counts only when asked for
+    halved = {"ops_per_sec": 400.0, "operations": {"list": {**op, "ops_per_sec": 400.0}}}
+    assert benchmark.compare_to_baseline(halved, baseline) == []
+    assert len(benchmark.compare_to_baseline(halved, baseline, slowdown=2.0)) == 2
+
+
+def test_add_user_stores_salted_hash(test_db):
+    first = add_user("reader", "reader@example.com", "secret")
+    second = add_user("writer", "writer@example.com", "secret")
+
+    with connection.reader() as conn:
+        stored = [row[0] for row in conn.execute("SELECT password FROM users ORDER BY id")]
+    assert all(value.startswith("scrypt$16$1$1$") for value in stored)
+    assert stored[0] != stored[1] and "secret" not in stored[0]
+    assert check_user("reader", "secret") == first
+    assert check_user("writer", "secret") == second
+    assert check_user("reader", "wrong") is None
+    assert check_user("nobody", "secret") is None
+
+
+def test_check_user_rehashes_legacy_and_outdated_rows(test_db):
+    with connection.transaction() as conn:
+        conn.execute("INSERT INTO users (username, email, password) VALUES ('old', 'old@example.com', 'plain')")
+
+    def stored():
+        with connection.reader() as conn:
+            return conn.execute("SELECT password FROM users WHERE username = 'old'").fetchone()[0]
+
+    assert check_user("old", "wrong") is None and stored() == "plain"
+    user_id = check_user("old", "plain")
+    assert user_id and stored().startswith("scrypt$16$")
+
+    configure_hashing("pbkdf2_sha256", iterations=1000)
+    assert check_user("old", "plain") == user_id
+    assert stored().startswith("pbkdf2_sha256$1000$")
+    assert check_user("old", "plain") == user_id
+
+
+def test_login_sessions_skip_rehashing(test_db, monkeypatch):
+    user_id = add_user("reader", "reader@example.com", "secret")
+    assert login("reader", "wrong") is None
+    token = login("reader", "secret")
+
+    monkeypatch.setattr(db_handler, "verify_password", lambda *args: pytest.fail("hashed again"))
+    assert session_user(token) == user_id
+    logout(token)
+    assert session_user(token) is None
+
+    monkeypatch.setattr(sessions, "ttl", -1)
+    assert session_user(sessions.create(user_id)) is None
+
+
+# ----------------------------
+# MAINTENANCE TESTS
+# ----------------------------
+
+def test_backup_copies_one_snapshot_while_writes_go_on(test_db, tmp_path):
+    add_books(1, [(f"Book {i}", "Writer", 2000, None, False, "x" * 500) for i in range(300)])
+    written = []
+    # each backup step lets another write commit; the copy must not include them
+    path = backup(tmp_path / "backups", pages=2, sleep=0,
+                  progress=lambda *step: written.append(add_book(1, f"Late {len(written)}", "Writer", 2000, None, False, None)))
+
+    assert len(written) > 10 and len(list_books(1)) == 300 + len(written)
+    copy = sqlite3.connect(Path(path["path"]) / "library.db")
+    assert copy.execute("SELECT COUNT(*) FROM books").fetchone()[0] == 300
+    assert copy.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    copy.close()
+
+
+def test_maintenance_scheduler_runs_due_tasks_offline(test_db, tmp_path):
+    add_books(1, [(f"Book {i}", "Writer", 2000, None, False, "x" * 500) for i in range(2000)])
+    delete_books(1, [book.id for book in list_books(1)][200:])
+    before = database_metrics()
+    assert before["auto_vacuum"] == "incremental" and before["free_ratio"] > 0.3 and not before["analyzed"]
+
+    now = [1_000_000.0]
+    scheduler = MaintenanceScheduler({"backups_kept": 2}, backup_dir=tmp_path / "backups", clock=lambda: now[0])
+    statements = []
+    with connection.transaction() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        reports = {report["task"]: report for report in scheduler.run_pending()}
+    finally:
+        conn.set_trace_callback(None)
+    assert set(reports) == {"backup", "analyze", "optimize", "vacuum"}
+    assert reports["analyze"]["reason"] == "no statistics" and "free pages" in reports["vacuum"]["reason"]
+    # the free pages go in one statement per step, not one per page
+    assert reports["vacuum"]["steps"] == 1
+    assert sum(sql.startswith("PRAGMA incremental_vacuum") for sql in statements) == 1
+    after = database_metrics(detail=True)
+    assert after["free_pages"] == 0 and after["analyzed"] and after["file_bytes"] < before["file_bytes"] - before["free_bytes"] / 2
+    assert after["fragmentation"] is not None
+    assert scheduler.due() == []
+
+    # only the hourly optimize comes round again; backups beyond backups_kept are pruned
+    now[0] += 3600
+    assert [task for task, _, _ in scheduler.due()] == ["optimize"]
+    for day in range(1, 4):
+        now[0] += 86400
+        scheduler.run_pending()
+    assert len(list((tmp_path / "backups").iterdir())) == 2
+    with pytest.raises(ValueError):
+        MaintenanceScheduler({"vacuum_evry": 60})
+
+
+def test_maintenance_thread_outlives_failing_checks(test_db, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("pool timed out")
+
+    monkeypatch.setattr(maintenance, "database_metrics", broken)
+    scheduler = MaintenanceScheduler({"check_every": 0.01})
+    assert scheduler.run_pending() == [{"task": "check", "error": "RuntimeError: pool timed out"}]
+
+    checks = []
+
+    def report(reports):
+        checks.append(reports)
+        raise ValueError("report failed too")
+
+    scheduler.start(report)
+    try:
+        deadline = time.monotonic() + 5
+        while len(checks) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(checks) >= 3 and scheduler._thread.is_alive()
+    finally:
+        scheduler.stop()
@@ -1,53 +1,49 @@
-import sqlite3
 from pathlib import Path
 
+from utils.connection import configure, get_pool
+from utils.migrations import SCHEMA_VERSION, migrate
+from utils.sharding import get_router, seed_id_ranges
+
 base=Path(__file__).resolve().parent.parent
 DB = base / "DATA" / "DB" 
 
-def init_db():
-    """Initialize the SQLite database only if the tables don't exist."""
-    conn = sqlite3.connect(DB / "library.db")
-    c = conn.cursor()
-
-    # Check if tables already exist
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-    user_table = c.fetchone()
-
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='books'")
-    book_table = c.fetchone()
-
-    if user_table and book_table:
+def init_db(profile: str = None, **pragmas):
+    """Create the tables and apply any pending schema migrations.
+
+    `profile` names one of utils.connection.PROFILES and any keyword
+    arguments override individual PRAGMAs; both reopen the connection pool.
+    The schema version is checked first, so launching against an
+    up-to-date database costs one PRAGMA and no write lock; after that the
+    pool remembers it and further calls return at once. When the library is
+    sharded (utils.sharding) every shard file is brought up to date too.
+    """
+    if profile or pragmas:
+        configure(get_pool().path, profile=profile or "default", pragmas=pragmas)
+
+    applied = _migrate(get_pool())
+    router = get_router()
+    if router:
+        for shard, pool in enumerate(router.pools):
+            _migrate(pool, shard)
+
+    if applied is None:
+        return
+    if not applied:
         print("Database already initialized.")
-        conn.close()
         return
 
-    # Create users table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-    """)
-
-    # Create books table
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS books (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        title TEXT NOT NULL,
-        author TEXT NOT NULL,
-        year INTEGER,
-        genre TEXT,
-        read BOOLEAN DEFAULT 0,
-        note TEXT,
-        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-    );
-    """)
-
-    conn.commit()
-    conn.close()
     print("Database initialized.")
+
+
+def _migrate(pool, shard: int = None):
+    """Bring one database up to date; None if the pool already knew it was."""
+    if pool.schema_ready:
+        return None
+    applied = []
+    if pool.user_version() < SCHEMA_VERSION:
+        with pool.transaction() as conn:
+            applied = migrate(conn)
+            if shard is not None:
+                seed_id_ranges(conn, shard)
+    pool.schema_ready = True
+    return applied
@@ -0,0 +1,156 @@
+# ----------------------------
+# Async Data Access
+# ----------------------------
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import db_handler
+
+
+class Lane:
+    """A bounded thread pool that async callers queue work on.
+
+    At most `max_pending` calls may be queued or running; further callers
+    wait for a slot, which pushes back on whoever is producing the load.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.name = name
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"library-{name}")
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_pending)
+        self.pending = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.timed_out = 0
+
+    async def _run(self, fn, args, kwargs):
+        async with self._slots:
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+            finally:
+                self.pending -= 1
+
+    async def run(self, fn, args=(), kwargs=None, timeout: float = None):
+        """Run fn in the lane; waiting for a slot counts towards `timeout`.
+
+        Cancelling the awaiting task (or hitting the timeout) drops calls that
+        have not started yet. A call that is already running finishes in its
+        thread, but its result is discarded.
+        """
+        try:
+            result = await asyncio.wait_for(self._run(fn, args, kwargs or {}), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "timed_out": self.timed_out,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class AsyncLibrary:
+    """Awaitable versions of the db_handler functions.
+
+    Writes go through a single writer thread, matching SQLite's single writer,
+    and reads are spread over `readers` threads. Logins and sign-ups spend
+    most of their time in password hashing, so they get their own lane of
+    `hashers` threads (one per CPU by default) and cannot hold up reads or
+    writes. `timeout` is the default per-call limit in seconds; every method
+    also accepts `timeout=`.
+    """
+
+    def __init__(self, readers: int = 4, max_pending: int = 256, timeout: float = 30.0, hashers: int = None):
+        self.timeout = timeout
+        self.writer = Lane("writer", 1, max_pending)
+        self.reader = Lane("reader", readers, max_pending)
+        self.auth = Lane("auth", hashers or os.cpu_count() or 1, max_pending)
+
+    def _call(self, lane: Lane, fn, args, kwargs):
+        timeout = kwargs.pop("timeout", self.timeout)
+        return lane.run(fn, args, kwargs, timeout)
+
+    # accounts
+    async def check_user(self, *args, **kwargs):
+        return await self._call(self.auth, db_handler.check_user, args, kwargs)
+
+    async def add_user(self, *args, **kwargs):
+        return await self._call(self.auth, db_handler.add_user, args, kwargs)
+
+    async def login(self, *args, **kwargs):
+        return await self._call(self.auth, db_handler.login, args, kwargs)
+
+    # reads
+    async def list_books(self, *args, **kwargs):
+        return await self._call(self.reader, db_handler.list_books, args, kwargs)
+
+    async def search_books(self, *args, **kwargs):
+        return await self._call(self.reader, db_handler.search_books, args, kwargs)
+
+    async def find_book(self, *args, **kwargs):
+        return await self._call(self.reader, db_handler.find_book, args, kwargs)
+
+    async def list_books_page(self, *args, **kwargs):
+        return await self._call(self.reader, db_handler.list_books_page, args, kwargs)
+
+    async def book_changes(self, *args, **kwargs):
+        return await self._call(self.reader, db_handler.book_changes, args, kwargs)
+
+    async def csv_exporter(self, *args, **kwargs):
+        return await self._call(self.reader, db_handler.csv_exporter, args, kwargs)
+
+    # writes
+    async def add_book(self, *args, **kwargs):
+        return await self._call(self.writer, db_handler.add_book, args, kwargs)
+
+    async def add_books(self, *args, **kwargs):
+        return await self._call(self.writer, db_handler.add_books, args, kwargs)
+
+    async def update_book(self, *args, **kwargs):
+        return await self._call(self.writer, db_handler.update_book, args, kwargs)
+
+    async def update_books(self, *args, **kwargs):
+        return await self._call(self.writer, db_handler.update_books, args, kwargs)
+
+    async def delete_book(self, *args, **kwargs):
+        return await self._call(self.writer, db_handler.delete_book, args, kwargs)
+
+    async def delete_books(self, *args, **kwargs):
+        return await self._call(self.writer, db_handler.delete_books, args, kwargs)
+
+    async def csv_importer(self, *args, **kwargs):
+        return await self._call(self.writer, db_handler.csv_importer, args, kwargs)
+
+    def stats(self) -> dict:
+        return {"writer": self.writer.stats(), "reader": self.reader.stats(), "auth": self.auth.stats()}
+
+    def close(self, wait: bool = True):
+        self.writer.shutdown(wait)
+        self.reader.shutdown(wait)
+        self.auth.shutdown(wait)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -0,0 +1,141 @@
+# ----------------------------
+# Read Cache
+# ----------------------------
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.connection import get_pool
+
+MISSING = object()
+
+
+class ReadCache:
+    """Bounded LRU cache with a TTL for per-user read results.
+
+    Every entry belongs to a user, so a write can drop just that user's
+    entries. The TTL bounds how stale an entry can get when the database is
+    changed by another process. The cache empties itself when the connection
+    pool is replaced, e.g. when tests point it at another database.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, enabled: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._generation = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_pool(self):
+        pool = get_pool()
+        if pool is not self._pool:
+            self._entries.clear()
+            self._by_user.clear()
+            self._generation.clear()
+            self._pool = pool
+
+    def _drop(self, key):
+        user_id = self._entries.pop(key)[0]
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    def lookup(self, user_id: int, key) -> tuple:
+        """Return (value, stamp) for `key`; value is MISSING on a miss.
+
+        Pass the stamp back to put() so a result read before a concurrent
+        write is not stored after that write invalidated the user.
+        """
+        if not self.enabled:
+            return MISSING, None
+        with self._lock:
+            self._check_pool()
+            stamp = self._generation.get(user_id, 0)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING, stamp
+            if entry[1] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return MISSING, stamp
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[2]
+        return (list(value) if isinstance(value, list) else value), stamp
+
+    def put(self, user_id: int, key, value, stamp):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_pool()
+            if self._generation.get(user_id, 0) != stamp:
+                return
+            if key in self._entries:
+                self._drop(key)
+            # the caller keeps `value`; store a copy, as lookup() hands out copies
+            self._entries[key] = (user_id, time.monotonic() + self.ttl,
+                                  list(value) if isinstance(value, list) else value)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        """Drop every entry belonging to `user_id`."""
+        with self._lock:
+            for key in self._by_user.pop(user_id, ()):
+                del self._entries[key]
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry of every user."""
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            for user_id in self._generation:
+                self._generation[user_id] += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# LIBRARY_CACHE=0 turns the cache off for the whole process.
+read_cache = ReadCache(enabled=os.getenv("LIBRARY_CACHE", "1") != "0")
+
+
+def configure_cache(maxsize: int = None, ttl: float = None, enabled: bool = None) -> ReadCache:
+    """Adjust the process-wide cache; any change also empties it."""
+    if maxsize is not None:
+        read_cache.maxsize = maxsize
+    if ttl is not None:
+        read_cache.ttl = ttl
+    if enabled is not None:
+        read_cache.enabled = enabled
+    read_cache.clear()
+    return read_cache
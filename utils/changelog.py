@@ -0,0 +1,130 @@
+# ----------------------------
+# Book Change Feed
+# ----------------------------
+
+import json
+
+from utils.connection import reader, transaction
+from utils.records import change_row
+from utils.sharding import SHARD_BITS, routed, seq_range
+
+# Largest batch changes_since hands out, whatever the caller asks for.
+MAX_BATCH = 1000
+
+
+def _head(conn, user_id: int) -> int:
+    row = conn.execute("""
+        SELECT max(ifnull((SELECT MAX(seq) FROM book_changes WHERE user_id = ?), 0),
+                   ifnull((SELECT seq FROM change_horizon WHERE user_id = ?), 0))
+    """, (user_id, user_id)).fetchone()
+    return row[0]
+
+
+@routed
+def change_cursor(user_id: int) -> int:
+    """The user's newest change; a consumer that reads this before a full
+    export can continue with changes_since(user_id, cursor) afterwards."""
+    with reader() as conn:
+        return _head(conn, user_id)
+
+
+def changes_since(user_id: int, cursor: int = 0, limit: int = 500) -> dict:
+    """Return the user's changes after `cursor`, oldest first, at most `limit` (<= MAX_BATCH).
+
+    The result holds `changes` (Change records), the `cursor` to pass next
+    time, and `more` when further changes are waiting. Inserts and updates
+    should be applied as upserts: after compaction a consumer may see a
+    merged change that includes fields it already has. If changes after
+    `cursor` were truncated, `resync` is True and the consumer must start
+    over from a full export, then continue from the returned cursor.
+    Reading uses the (user_id, seq) index, so a sync costs O(changes).
+    """
+    limit = max(1, min(limit, MAX_BATCH))
+    with reader(snapshot=True) as conn:
+        horizon = conn.execute("SELECT seq FROM change_horizon WHERE user_id = ?", (user_id,)).fetchone()
+        # a cursor from another shard (the user has moved) is as stale as a truncated one
+        moved = cursor and cursor >> SHARD_BITS != seq_range(conn)
+        if moved or (horizon and cursor < horizon[0]):
+            return {"changes": [], "cursor": _head(conn, user_id), "more": False, "resync": True}
+        c = conn.cursor()
+        c.row_factory = change_row
+        changes = c.execute("""
+            SELECT seq, book_id, op, fields, changed_at FROM book_changes
+            WHERE user_id = ? AND seq > ?
+            ORDER BY seq
+            LIMIT ?
+        """, (user_id, cursor, limit + 1)).fetchall()
+
+    more = len(changes) > limit
+    changes = changes[:limit]
+    return {
+        "changes": changes,
+        "cursor": changes[-1].seq if changes else cursor,
+        "more": more,
+        "resync": False,
+    }
+
+
+def _user_filter(user_id: int = None) -> tuple:
+    return (" AND user_id = ?", (user_id,)) if user_id is not None else ("", ())
+
+
+def _merge(changes: list) -> tuple:
+    """Fold one book's consecutive changes into a single (op, fields)."""
+    if changes[-1].op == "delete":
+        return "delete", None
+    fields = {}
+    for change in changes:
+        fields.update(change.fields or {})
+    return ("insert" if changes[0].op == "insert" else "update"), fields
+
+
+@routed
+def compact_changes(before: int = None, user_id: int = None) -> dict:
+    """Merge each book's changes with seq < `before` (default: all) into one.
+
+    The merged change keeps the seq and time of the book's latest change,
+    so cursors stay valid and consumers that already read part of the
+    range only see fields again. Returns how many changes were removed and
+    how many books they belonged to.
+    """
+    where, params = _user_filter(user_id)
+    if before is not None:
+        where += " AND seq < ?"
+        params += (before,)
+    removed = 0
+    with transaction() as conn:
+        c = conn.cursor()
+        c.row_factory = lambda cursor, row: (row[0], change_row(cursor, row[1:]))
+        books = {}
+        for user, change in c.execute(f"""
+            SELECT user_id, seq, book_id, op, fields, changed_at FROM book_changes
+            WHERE true {where} ORDER BY seq
+        """, params):
+            books.setdefault((user, change.book_id), []).append(change)
+
+        for (user, book_id), changes in books.items():
+            if len(changes) < 2:
+                continue
+            op, fields = _merge(changes)
+            conn.execute("UPDATE book_changes SET op = ?, fields = ? WHERE seq = ?",
+                         (op, json.dumps(fields) if fields is not None else None, changes[-1].seq))
+            conn.executemany("DELETE FROM book_changes WHERE seq = ?", ((change.seq,) for change in changes[:-1]))
+            removed += len(changes) - 1
+    return {"removed": removed, "books": sum(len(changes) > 1 for changes in books.values())}
+
+
+@routed
+def truncate_changes(before: int, user_id: int = None) -> int:
+    """Drop changes with seq < `before`; consumers behind that point must resync.
+
+    Returns the number of changes dropped.
+    """
+    where, params = _user_filter(user_id)
+    with transaction() as conn:
+        conn.execute(f"""
+            INSERT INTO change_horizon (user_id, seq)
+            SELECT user_id, MAX(seq) FROM book_changes WHERE seq < ? {where} GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET seq = max(seq, excluded.seq)
+        """, (before, *params))
+        return conn.execute(f"DELETE FROM book_changes WHERE seq < ? {where}", (before, *params)).rowcount
@@ -0,0 +1,320 @@
+# ----------------------------
+# Connection Manager
+# ----------------------------
+
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from utils.metrics import metrics
+
+base = Path(__file__).resolve().parent.parent
+DB = base / "DATA" / "DB"
+
+# PRAGMA profiles applied to every pooled connection. auto_vacuum and
+# journal_mode are stored in the database file, so they are only set from the
+# write connection. auto_vacuum must come first: it only takes effect on a
+# new file (or at the next VACUUM, see utils.maintenance).
+PROFILES = {
+    "default": {
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,       # KiB, i.e. ~64 MB of page cache
+        "mmap_size": 268435456,     # 256 MB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,       # ms
+        "wal_autocheckpoint": 1000, # pages
+    },
+    "durable": {
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 10000,
+        "wal_autocheckpoint": 1000,
+    },
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
+
+
+class ConnectionPool:
+    """Thread-aware pool of long-lived SQLite connections.
+
+    SQLite only allows one writer at a time, so the pool keeps a single write
+    connection and up to `readers` query-only connections. Connections are
+    handed to one thread at a time and returned to the pool afterwards.
+    """
+
+    def __init__(self, path, readers: int = 4, timeout: float = 5.0,
+                 profile: str = "default", pragmas: dict = None, checkpoint_every: int = 500):
+        self.path = Path(path)
+        self.readers = readers
+        self.timeout = timeout
+        self.pragmas = {**PROFILES[profile], **(pragmas or {})}
+        self.checkpoint_every = checkpoint_every
+        self._commits = 0
+        self._idle = {"write": queue.LifoQueue(), "read": queue.LifoQueue()}
+        self._limit = {"write": 1, "read": readers}
+        self._opened = {"write": 0, "read": 0}
+        self._all = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+        # set by init_db once the schema is known to be current
+        self.schema_ready = False
+
+    def _connect(self, kind: str) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        for name, value in self.pragmas.items():
+            if name in ("auto_vacuum", "journal_mode") and kind == "read":
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+        if kind == "read":
+            conn.execute("PRAGMA query_only = ON")
+        if metrics.enabled:
+            metrics.count(f"connections_opened.{kind}")
+        return conn
+
+    def _acquire(self, kind: str) -> sqlite3.Connection:
+        if not metrics.enabled:
+            return self._checkout(kind)
+        began = time.perf_counter()
+        conn = self._checkout(kind)
+        metrics.observe(f"pool_wait.{kind}", (time.perf_counter() - began) * 1000)
+        metrics.attach(conn)
+        return conn
+
+    def _checkout(self, kind: str) -> sqlite3.Connection:
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed.")
+        idle = self._idle[kind]
+        try:
+            return idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened[kind] < self._limit[kind]:
+                conn = self._connect(kind)
+                self._opened[kind] += 1
+                self._all.append(conn)
+                return conn
+        try:
+            return idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"Timed out waiting for a {kind} connection.")
+
+    def _release(self, kind: str, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if metrics._clocks:
+            metrics.detach(conn)
+        if self._closed:
+            conn.close()
+            return
+        self._idle[kind].put(conn)
+
+    @contextmanager
+    def transaction(self, pragmas: dict = None):
+        """Yield the write connection inside BEGIN IMMEDIATE ... COMMIT.
+
+        The transaction is rolled back if the block raises. Nested calls on the
+        same thread join the outer transaction. `pragmas` are applied for the
+        duration of the transaction only, e.g. {"synchronous": "OFF"} for bulk
+        loads, and restored afterwards.
+        """
+        outer = getattr(self._local, "writer", None)
+        if outer is not None:
+            yield outer
+            return
+
+        conn = self._acquire("write")
+        self._local.writer = conn
+        saved = {}
+        try:
+            for name, value in (pragmas or {}).items():
+                saved[name] = conn.execute(f"PRAGMA {name}").fetchone()[0]
+                conn.execute(f"PRAGMA {name} = {value}")
+            conn.execute("BEGIN IMMEDIATE")
+            changes = conn.total_changes
+            yield conn
+            conn.execute("COMMIT")
+            self._commits += 1
+            if metrics.enabled:
+                metrics.count("transactions")
+                metrics.count("rows_written", conn.total_changes - changes)
+            if self.checkpoint_every and self._commits % self.checkpoint_every == 0:
+                self._checkpoint(conn, "PASSIVE")
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+                if metrics.enabled:
+                    metrics.count("rollbacks")
+            raise
+        finally:
+            self._local.writer = None
+            for name, value in saved.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            self._release("write", conn)
+
+    @contextmanager
+    def reader(self, snapshot: bool = False):
+        """Yield a query-only connection without opening a write transaction.
+
+        With `snapshot=True` the reads run inside one deferred transaction so
+        several statements see the same data. Inside `transaction()` the write
+        connection is reused so uncommitted changes stay visible.
+        """
+        outer = getattr(self._local, "writer", None)
+        if outer is not None:
+            yield outer
+            return
+
+        conn = self._acquire("read")
+        try:
+            if snapshot:
+                conn.execute("BEGIN")
+            yield conn
+        finally:
+            self._release("read", conn)
+
+    @contextmanager
+    def writer(self):
+        """Yield the write connection outside of any transaction.
+
+        For statements that must not run inside one, such as VACUUM or
+        wal_checkpoint; it still waits until no transaction() is using it.
+        """
+        conn = self._acquire("write")
+        try:
+            yield conn
+        finally:
+            self._release("write", conn)
+
+    @staticmethod
+    def _checkpoint(conn: sqlite3.Connection, mode: str) -> tuple:
+        return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def checkpoint(self, mode: str = "PASSIVE") -> tuple:
+        """Copy WAL frames back into the database file.
+
+        PASSIVE never blocks readers or writers; TRUNCATE also resets the WAL
+        file and is meant for quiet periods. Returns (busy, wal_pages, moved).
+        """
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        with self.writer() as conn:
+            return self._checkpoint(conn, mode)
+
+    def user_version(self) -> int:
+        """PRAGMA user_version, read on the write connection without taking the write lock.
+
+        The write connection is the one that sets journal_mode, so checking
+        the schema through it does not leave a reader opened on a file that
+        is about to switch to WAL.
+        """
+        with self.writer() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def journal_mode(self) -> str:
+        with self.reader() as conn:
+            return conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+    def stats(self) -> dict:
+        """Return how many connections are open and idle per kind."""
+        stats = {
+            kind: {"opened": self._opened[kind], "idle": self._idle[kind].qsize()}
+            for kind in ("write", "read")
+        }
+        stats["commits"] = self._commits
+        return stats
+
+    def close(self):
+        """Close every connection the pool has opened."""
+        self._closed = True
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool, creating it for DB/library.db on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB / "library.db")
+    return _pool
+
+
+def configure(path=None, **options) -> ConnectionPool:
+    """Replace the process-wide pool, e.g. to point it at another database file."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(path or DB / "library.db", **options)
+    return _pool
+
+
+def close_pool():
+    """Close the process-wide pool; the next call will open a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = None
+
+
+# The pool that transaction() and reader() use in the current thread or
+# task; utils.sharding points it at a user's shard for the length of a call.
+_route = ContextVar("library_pool", default=None)
+
+
+def current_pool() -> ConnectionPool:
+    """The routed pool if one is active, else the process-wide pool."""
+    return _route.get() or get_pool()
+
+
+@contextmanager
+def using(pool: ConnectionPool):
+    """Send transaction() and reader() calls in this block to `pool`."""
+    token = _route.set(pool)
+    try:
+        yield pool
+    finally:
+        _route.reset(token)
+
+
+def checkpoint(mode: str = "PASSIVE") -> tuple:
+    return current_pool().checkpoint(mode)
+
+
+def transaction(pragmas: dict = None):
+    return current_pool().transaction(pragmas)
+
+
+def reader(snapshot: bool = False):
+    return current_pool().reader(snapshot)
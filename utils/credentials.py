@@ -0,0 +1,191 @@
+# ----------------------------
+# Credentials
+# ----------------------------
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text.encode("ascii"))
+
+
+class ScryptHasher:
+    """Salted scrypt; stored as scrypt$n$r$p$salt$hash.
+
+    n=2**14, r=8 uses 16 MB and roughly 50-100 ms of CPU per hash.
+    """
+
+    scheme = "scrypt"
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1, salt_bytes: int = 16, dklen: int = 32):
+        self.n, self.r, self.p = n, r, p
+        self.salt_bytes = salt_bytes
+        self.dklen = dklen
+
+    def _derive(self, password: str, salt: bytes, n: int, r: int, p: int, dklen: int) -> bytes:
+        return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                              maxmem=128 * n * r * p + 1024 * 1024, dklen=dklen)
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(self.salt_bytes)
+        derived = self._derive(password, salt, self.n, self.r, self.p, self.dklen)
+        return f"{self.scheme}${self.n}${self.r}${self.p}${_b64(salt)}${_b64(derived)}"
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, n, r, p, salt, expected = encoded.split("$")
+        expected = _unb64(expected)
+        derived = self._derive(password, _unb64(salt), int(n), int(r), int(p), len(expected))
+        return hmac.compare_digest(derived, expected)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        _, n, r, p, *_ = encoded.split("$")
+        return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+
+class Pbkdf2Hasher:
+    """Salted PBKDF2-HMAC-SHA256; stored as pbkdf2_sha256$iterations$salt$hash."""
+
+    scheme = "pbkdf2_sha256"
+
+    def __init__(self, iterations: int = 600000, salt_bytes: int = 16):
+        self.iterations = iterations
+        self.salt_bytes = salt_bytes
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(self.salt_bytes)
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, self.iterations)
+        return f"{self.scheme}${self.iterations}${_b64(salt)}${_b64(derived)}"
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, iterations, salt, expected = encoded.split("$")
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), _unb64(salt), int(iterations))
+        return hmac.compare_digest(derived, _unb64(expected))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        return int(encoded.split("$")[1]) != self.iterations
+
+
+SCHEMES = {hasher.scheme: hasher for hasher in (ScryptHasher, Pbkdf2Hasher)}
+
+_hasher = ScryptHasher() if hasattr(hashlib, "scrypt") else Pbkdf2Hasher()
+_verifiers = {_hasher.scheme: _hasher}
+
+
+def configure_hashing(scheme: str = "scrypt", **cost):
+    """Choose the scheme and cost used for new hashes, e.g. configure_hashing("scrypt", n=2**15).
+
+    Existing hashes of any known scheme still verify; on the next login they
+    are rehashed with the new settings.
+    """
+    global _hasher
+    _hasher = SCHEMES[scheme](**cost)
+    _verifiers.clear()
+    _verifiers[scheme] = _hasher
+    return _hasher
+
+
+def _verifier(encoded: str):
+    scheme = encoded.split("$", 1)[0]
+    hasher = _verifiers.get(scheme)
+    if hasher is None and scheme in SCHEMES:
+        hasher = _verifiers[scheme] = SCHEMES[scheme]()
+    return hasher
+
+
+def is_hashed(stored: str) -> bool:
+    return "$" in stored and stored.split("$", 1)[0] in SCHEMES
+
+
+def hash_password(password: str) -> str:
+    return _hasher.hash(password)
+
+
+def verify_password(password: str, stored: str) -> tuple:
+    """Check `password` against a stored hash or a legacy plaintext value.
+
+    Returns (ok, new_hash): new_hash is set when the password matched but the
+    stored value is plaintext or was made with other settings, and should be
+    written back.
+    """
+    if not is_hashed(stored):
+        ok = hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        return ok, (hash_password(password) if ok else None)
+    hasher = _verifier(stored)
+    if not hasher.verify(password, stored):
+        return False, None
+    if hasher is not _hasher or _hasher.needs_rehash(stored):
+        return True, hash_password(password)
+    return True, None
+
+
+_dummy = None
+
+
+def dummy_verify(password: str):
+    """Spend the same time as a real check, so unknown usernames are not revealed by timing."""
+    global _dummy
+    if _dummy is None or not _dummy.startswith(_hasher.scheme + "$"):
+        _dummy = hash_password(secrets.token_hex(8))
+    _hasher.verify(password, _dummy)
+
+
+class SessionCache:
+    """Short-lived login sessions: token -> user_id with a TTL.
+
+    Checking a token is a dictionary lookup, so operations after login do not
+    pay for password hashing again. Sessions live in this process only and
+    are dropped when they expire, when the cache is full (oldest first) or on
+    logout.
+    """
+
+    def __init__(self, ttl: float = 900.0, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, user_id: int) -> str:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = (user_id, time.monotonic() + self.ttl)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return token
+
+    def user(self, token: str):
+        """Return the session's user_id, or None if it is unknown or expired."""
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._sessions[token]
+                return None
+            return entry[0]
+
+    def drop(self, token: str):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def drop_user(self, user_id: int):
+        with self._lock:
+            for token in [t for t, (uid, _) in self._sessions.items() if uid == user_id]:
+                del self._sessions[token]
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+sessions = SessionCache()
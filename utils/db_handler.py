@@ -2,251 +2,621 @@
 # Utility Functions
 # ----------------------------
 
+import re
 import sqlite3
 from pathlib import Path
-import csv
+
+from utils.cache import MISSING, read_cache
+from utils.changelog import changes_since
+from utils.connection import reader, transaction
+from utils.credentials import dummy_verify, hash_password, sessions, verify_password
+from utils.duplicates import find_near_duplicates
+from utils.exporter import export_books
+from utils.importer import import_csv, import_many, insert_book_sql, insert_books
+from utils.metrics import instrumented
+from utils.migrations import fingerprint_sql
+from utils.records import Book, SearchHit, book_row, search_row, to_columns
+from utils.sharding import routed
+from utils.stats import reading_stats
 
 base=Path(__file__).resolve().parent.parent
-DB = base / "DATA"  /"DB" 
-CSV = base / "DATA" / "EXPORT"
+DB = base / "DATA"  /"DB"
 
 #user functions
+@instrumented
 def check_user(username: str, password: str):
-    try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
+    """Return the user's id if the password matches, else None.
 
-        c.execute(
-        "SELECT id FROM users WHERE username = ? AND password = ?",
-        (username, password)
-    )
+    Legacy rows that still hold a plaintext password, or a hash made with
+    older cost settings, are rehashed with the current settings on a
+    successful login.
+    """
+    try:
+        with reader() as conn:
+            row = conn.execute("SELECT id, password FROM users WHERE username = ?", (username,)).fetchone()
 
-        row = c.fetchone()
-        conn.close()
+        if row is None:
+            dummy_verify(password)
+            return None
 
-        if row:
-            return row[0]   # user_id
+        user_id, stored = row
+        ok, new_hash = verify_password(password, stored)
+        if not ok:
+            return None
+        if new_hash:
+            with transaction() as conn:
+                # only replace the value we verified against
+                conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                             (new_hash, user_id, stored))
+        return user_id
 
-        
     except sqlite3.IntegrityError:
         return None
-    
+
+@instrumented
 def add_user(username: str, email: str, password: str):
+    password = hash_password(password)
     try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-
-        c.execute(
-            "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
-            (username, email, password)
-        )
+        with transaction() as conn:
+            c = conn.cursor()
+            c.execute(
+                "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                (username, email, password)
+            )
+            user_id = c.lastrowid
 
-        conn.commit()
-        user_id = c.lastrowid
-        conn.close()
         return user_id
 
     except sqlite3.IntegrityError:
         return None
 
 
+def login(username: str, password: str):
+    """Check the password once and return a session token, or None.
+
+    Later operations can resolve the token with session_user() instead of
+    hashing the password again.
+    """
+    user_id = check_user(username, password)
+    return sessions.create(user_id) if user_id else None
+
 
+def session_user(token: str):
+    """Return the user_id of a live session token, or None."""
+    return sessions.user(token)
+
+
+def logout(token: str):
+    sessions.drop(token)
 
 
 #book functions
-def add_book(user_id: int, title: str, author: str, year: int, genre: str, read: bool = False, note: str = None) -> bool:
-    """Add a book to the library database."""
-    try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        c.execute("""
-            INSERT INTO books (user_id, title, author, year, genre, read, note)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, title, author, year, genre, int(read), note))
-        conn.commit()
-        conn.close()
+@instrumented
+@routed
+def add_book(user_id: int, title: str, author: str, year: int, genre: str, read: bool = False, note: str = None,
+             on_duplicate: str = "skip") -> bool:
+    """Add a book to the library database.
+
+    A book with the same title, author and year (ignoring case and extra
+    spaces) is handled by `on_duplicate`: "skip" leaves the library alone and
+    returns False, "update" refreshes the existing book's read flag, genre
+    and note, "keep" adds another copy.
+    """
+    try:
+        with transaction() as conn:
+            added = conn.execute(insert_book_sql(on_duplicate),
+                                 (user_id, title, author, year, genre, int(read), note)).rowcount
+        read_cache.invalidate(user_id)
+        if not added and on_duplicate == "skip":
+            print(f"Duplicate book skipped: {title} by {author}")
+            return False
         return True
     except Exception as e:
         print("Error in add_book:", e)
         return False
 
-def search_books(user_id: int, keyword: str) -> list:
-    """Search for books by title or author for a specific user."""
-    try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        c.execute("""
-            SELECT id, title, author, year, read, genre, note 
-            FROM books 
-            WHERE user_id = ? AND (title LIKE ? OR author LIKE ?)
-        """, (user_id, f"%{keyword}%", f"%{keyword}%"))
-        results = c.fetchall()
-        conn.close()
+BOOK_FIELDS = ("title", "author", "year", "genre", "read", "note")
+
+
+def _book_params(user_id: int, book) -> tuple:
+    """INSERT_BOOK parameters from a (title, author, year, genre, read, note)
+    sequence or a mapping with those keys (missing ones default to empty)."""
+    if isinstance(book, dict):
+        book = tuple(book.get(name) for name in BOOK_FIELDS)
+    title, author, year, genre, read, note = (tuple(book) + (None,) * 6)[:6]
+    if not title or not author:
+        raise ValueError(f"book needs a title and an author: {book!r}")
+    return (user_id, title, author, int(year) if year not in (None, "") else None,
+            genre or None, int(bool(read)), note or None)
+
+
+@instrumented
+@routed
+def add_books(user_id: int, books, on_duplicate: str = "skip") -> int:
+    """Add many books to a user's library in one transaction.
+
+    `books` yields (title, author, year, genre, read, note) sequences or
+    dicts with those keys. Duplicates are resolved by `on_duplicate` as in
+    add_book. Either every book is written or, if one is invalid, none is.
+    Returns the number of new books, or False on failure.
+    """
+    try:
+        with transaction() as conn:
+            added = insert_books(conn, (_book_params(user_id, book) for book in books), on_duplicate)
+        read_cache.invalidate(user_id)
+        return added
+    except Exception as e:
+        print("Error in add_books:", e)
+        return False
+
+
+def fts_query(keyword: str) -> str:
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r"\w+", keyword)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _records(conn, factory=book_row):
+    """A cursor on a pooled connection that yields records instead of tuples."""
+    c = conn.cursor()
+    c.row_factory = factory
+    return c
+
+
+def _search_books(conn, user_id: int, keyword: str, ranked: bool, limit: int) -> list:
+    if ranked:
+        query = fts_query(keyword)
+        if not query:
+            return []
+        try:
+            c = _records(conn, search_row).execute("""
+                SELECT b.id, b.title, b.author, b.year, b.read, b.genre, b.note,
+                       snippet(books_fts, -1, '[', ']', '...', 8)
+                FROM books_fts
+                JOIN books b ON b.id = books_fts.rowid
+                WHERE books_fts MATCH ? AND b.user_id = ?
+                ORDER BY bm25(books_fts, 10.0, 5.0, 2.0, 1.0)
+                LIMIT ?
+            """, (query, user_id, limit))
+            return c.fetchall()
+        except sqlite3.OperationalError as e:
+            if "books_fts" not in str(e):
+                raise
+
+    c = _records(conn).execute("""
+        SELECT id, title, author, year, read, genre, note
+        FROM books
+        WHERE user_id = ? AND (title LIKE ? OR author LIKE ?)
+    """, (user_id, f"%{keyword}%", f"%{keyword}%"))
+    if ranked:
+        return [SearchHit(*book, None) for book in c.fetchmany(limit)]
+    return c.fetchall()
+
+
+@instrumented
+@routed
+def search_books(user_id: int, keyword: str, ranked: bool = False, limit: int = 50) -> list:
+    """Search for books by title or author for a specific user.
+
+    With `ranked=True` the full-text index is used instead: title, author,
+    genre and note are matched by word prefix, results are ordered by bm25
+    relevance and an extra snippet column highlights the match. Falls back to
+    LIKE if the database has no full-text index.
+    """
+    key = ("search_books", user_id, keyword, ranked, limit)
+    cached, stamp = read_cache.lookup(user_id, key)
+    if cached is not MISSING:
+        return cached
+    try:
+        with reader() as conn:
+            results = _search_books(conn, user_id, keyword, ranked, limit)
+        read_cache.put(user_id, key, results, stamp)
         return results
     except Exception as e:
         print("Error in search_books:", e)
         return []
-    
+
+@instrumented
+@routed
 def check_book(user_id: int, book_id : int) -> bool:
     """Check if a book exists and belongs a specific user."""
-    try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        c.execute("""
-            SELECT title 
-            FROM books 
-            WHERE user_id = ? AND id = ? 
-        """, (user_id,book_id))
-        results = c.fetchone()
-        conn.close()
-        return results is not None
-        
-    except Exception as e:
-        print("Error in check_books:", e)
-        return []
-    
-def find_book(user_id: int, book_id : int) -> tuple:
+    book = find_book(user_id, book_id)
+    return book is not None and book != []
+
+@instrumented
+@routed
+def find_book(user_id: int, book_id : int) -> Book:
     """find if a book exists and belongs a specific user."""
+    key = ("find_book", user_id, book_id)
+    cached, stamp = read_cache.lookup(user_id, key)
+    if cached is not MISSING:
+        return cached
     try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        c.execute("""
-            SELECT id, title, author, year, read, genre, note
-            FROM books 
-            WHERE user_id = ? AND id = ? 
-        """, (user_id,book_id))
-        results = c.fetchone()
-        conn.close()
-        return results
-        
+        with reader() as conn:
+            c = _records(conn).execute("""
+                SELECT id, title, author, year, read, genre, note
+                FROM books
+                WHERE user_id = ? AND id = ?
+            """, (user_id,book_id))
+            book = c.fetchone()
+        read_cache.put(user_id, key, book, stamp)
+        return book
+
     except Exception as e:
         print("Error in find_books:", e)
         return []
 
-    
+
+@instrumented
+@routed
 def list_books(user_id: int) -> list:
-    """Return all books for a specific user as a list of tuples."""
-    try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        c.execute("""
-            SELECT id, title, author, year, read, genre, note 
-            FROM books 
-            WHERE user_id = ?
-        """, (user_id,))
-        books = c.fetchall()
-        conn.close()
+    """Return all books for a specific user as a list of Book records."""
+    key = ("list_books", user_id)
+    cached, stamp = read_cache.lookup(user_id, key)
+    if cached is not MISSING:
+        return cached
+    try:
+        with reader() as conn:
+            c = _records(conn).execute("""
+                SELECT id, title, author, year, read, genre, note
+                FROM books
+                WHERE user_id = ?
+                ORDER BY id
+            """, (user_id,))
+            books = c.fetchall()
+        read_cache.put(user_id, key, books, stamp)
         return books
     except Exception as e:
         print("Error in list_books:", e)
         return []
 
 
-def update_book(book_id: int, title: str = None, author: str = None, year: int = None, genre: str = None, read: bool = None, note: str = None) -> bool:
-    """Update book info by ID; only provided fields are updated."""
-    try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        if title:
-            c.execute("UPDATE books SET title = ? WHERE id = ?", (title, book_id))
-        if author:
-            c.execute("UPDATE books SET author = ? WHERE id = ?", (author, book_id))
-        if year:
-            c.execute("UPDATE books SET year = ? WHERE id = ?", (year, book_id))
-        if genre:
-            c.execute("UPDATE books SET genre = ? WHERE id = ?", (genre, book_id))
-        if read is not None:
-            c.execute("UPDATE books SET read = ? WHERE id = ?", (int(read), book_id))
-        if note is not None:
-            c.execute("UPDATE books SET note = ? WHERE id = ?", (note, book_id))
-        conn.commit()
-        conn.close()
-        return True
+@instrumented
+@routed
+def list_books_columns(user_id: int) -> dict:
+    """Return all of a user's books column by column, for bulk analysis.
+
+    The result maps each field name to a column: id, read and any year column
+    without gaps are array('q'), the rest are lists. Rows are streamed off the
+    cursor, so no list of per-row tuples is built on the way. Not cached.
+    """
+    try:
+        with reader() as conn:
+            c = conn.execute("""
+                SELECT id, title, author, year, read, genre, note
+                FROM books
+                WHERE user_id = ?
+                ORDER BY id
+            """, (user_id,))
+            return to_columns(c)
     except Exception as e:
-        print("Error in update_book:", e)
+        print("Error in list_books_columns:", e)
+        return to_columns(())
+
+
+@instrumented
+@routed
+def book_stats(user_id: int, top: int = 10):
+    """Reading statistics for a user; see utils.stats.reading_stats.
+
+    Returns the statistics dict, or False on failure.
+    """
+    try:
+        return reading_stats(user_id, top)
+    except Exception as e:
+        print("Error in book_stats:", e)
         return False
 
 
-def delete_book(book_id: int) -> bool:
-    """Delete a book by its ID."""
+@instrumented
+@routed
+def near_duplicates(user_id: int, threshold: float = 0.85):
+    """Likely duplicate pairs in a user's library; see utils.duplicates.
+
+    Returns (score, book, other) triples, or [] on failure.
+    """
     try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        c.execute("DELETE FROM books WHERE id = ?", (book_id,))
-        conn.commit()
-        conn.close()
-        return True
+        return find_near_duplicates(user_id, threshold)
+    except Exception as e:
+        print("Error in near_duplicates:", e)
+        return []
+
+
+@instrumented
+@routed
+def book_changes(user_id: int, cursor: int = 0, limit: int = 500):
+    """A batch of the user's book changes after `cursor`; see utils.changelog.changes_since.
+
+    Returns the batch dict, or False on failure.
+    """
+    try:
+        return changes_since(user_id, cursor, limit)
+    except Exception as e:
+        print("Error in book_changes:", e)
+        return False
+
+
+# Sort orders for keyset pagination and export: the key columns (ending in
+# id so the key is unique) and the index that already holds the books in
+# that order, so listings never need a sort step. title_key and author_key
+# are the generated sort keys of migration 12.
+SORT_KEYS = {
+    "id": (("id",), "idx_books_user"),
+    "title": (("title_key", "id"), "idx_books_user_title_key"),
+    "author": (("author_key", "title_key", "id"), "idx_books_user_author_key"),
+    "year": (("ifnull(year, -1)", "id"), "idx_books_user_year"),
+    "read": (("read", "title_key", "id"), "idx_books_user_read"),
+}
+
+
+def _seek_ranges(keys: tuple, after: tuple):
+    """Split `(keys) > (after)` into index seeks, yielded in sort order.
+
+    For keys (a, b, id) that is: a = ? AND b = ? AND id > ?, then a = ? AND
+    b > ?, then a > ?. SQLite can seek straight to the start of each range,
+    whereas a single row-value comparison only seeks on the first column.
+    """
+    for depth in range(len(keys) - 1, -1, -1):
+        conditions = [f"{key} = ?" for key in keys[:depth]] + [f"{keys[depth]} > ?"]
+        yield " AND " + " AND ".join(conditions), list(after[:depth + 1]), keys[depth:]
+
+
+@instrumented
+@routed
+def list_books_page(user_id: int, sort: str = "id", read: bool = None, after: tuple = None, limit: int = 50) -> tuple:
+    """Return one page of a user's books and the cursor for the next page.
+
+    Pages are found by seeking past `after` (the previous page's cursor) on the
+    sort key instead of using OFFSET, so late pages cost the same as the first.
+    `read` restricts the page to read (True) or unread (False) books. The
+    returned cursor is None once there are no more pages, or on failure,
+    when the page is [] as well.
+    """
+    if sort not in SORT_KEYS:
+        print(f"Error in list_books_page: unknown sort order {sort!r}")
+        return [], None
+    keys, index = SORT_KEYS[sort]
+    if read is not None and keys[0] == "read":
+        keys = keys[1:]
+    select = f"""
+        SELECT id, title, author, year, read, genre, note, {", ".join(keys)}
+        FROM books INDEXED BY {index}
+        WHERE user_id = ?
+    """
+    params = [user_id]
+    if read is not None:
+        select += " AND read = ?"
+        params.append(int(read))
+    ranges = [("", [], keys)] if after is None else _seek_ranges(keys, after)
+
+    rows = []
+    try:
+        with reader() as conn:
+            for condition, bounds, order in ranges:
+                rows += conn.execute(
+                    f"{select}{condition} ORDER BY {', '.join(order)} LIMIT ?",
+                    params + bounds + [limit - len(rows)]
+                ).fetchall()
+                if len(rows) >= limit:
+                    break
+    except Exception as e:
+        print("Error in list_books_page:", e)
+        return [], None
+    cursor = rows[-1][7:] if len(rows) >= limit else None
+    return [Book._make(row[:7]) for row in rows], cursor
+
+
+def iter_book_pages(user_id: int, sort: str = "id", read: bool = None, page_size: int = 50):
+    """Lazily yield pages of a user's books; each page is queried on demand."""
+    after = None
+    while True:
+        page, after = list_books_page(user_id, sort, read, after, page_size)
+        if page:
+            yield page
+        if after is None:
+            return
+
+
+def _book_owner(conn, book_id: int):
+    row = conn.execute("SELECT user_id FROM books WHERE id = ?", (book_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _changed_fields(title=None, author=None, year=None, genre=None, read=None, note=None) -> dict:
+    """Collect the columns an update should touch, in a stable order.
+
+    Empty title/author/year/genre mean "leave as is", as in the CLI prompts;
+    read and note are only skipped when None.
+    """
+    fields = {}
+    if title:
+        fields["title"] = title
+    if author:
+        fields["author"] = author
+    if year:
+        fields["year"] = year
+    if genre:
+        fields["genre"] = genre
+    if read is not None:
+        fields["read"] = int(read)
+    if note is not None:
+        fields["note"] = note
+    return fields
+
+
+# Fields that make up a book's duplicate fingerprint (see migration 8).
+FINGERPRINT_FIELDS = ("title", "author", "year")
+
+
+def _assignments(fields: dict) -> tuple:
+    """SET clause and its parameters for `fields`.
+
+    A change to the fingerprint also moves the book to the next free copy
+    number among the user's other books with the new fingerprint (0 if
+    there are none), so it never collides with an equal book.
+    """
+    assignments = [f"{name} = ?" for name in fields]
+    params = list(fields.values())
+    if any(name in fields for name in FINGERPRINT_FIELDS):
+        fingerprint = fingerprint_sql(*("?" if name in fields else f"books.{name}" for name in FINGERPRINT_FIELDS))
+        assignments.append(f"""copy = (
+            SELECT ifnull(MAX(other.copy) + 1, 0) FROM books AS other
+            WHERE other.user_id = books.user_id AND other.fingerprint = {fingerprint} AND other.id != books.id
+        )""")
+        params += [fields[name] for name in FINGERPRINT_FIELDS if name in fields]
+    return ", ".join(assignments), params
+
+
+@instrumented
+@routed
+def update_book(book_id: int, title: str = None, author: str = None, year: int = None, genre: str = None,
+                read: bool = None, note: str = None, user_id: int = None) -> int:
+    """Update book info by ID; only provided fields are updated.
+
+    All changed fields are written by one UPDATE statement. When `user_id` is
+    given the book must belong to that user. A book edited to the same
+    title, author and year as another of the user's books is kept as one
+    more copy of it, as add_book(on_duplicate="keep") would. Returns the
+    number of rows changed (0 if the book does not exist, is not owned by
+    the user, or the update fails).
+    """
+    fields = _changed_fields(title, author, year, genre, read, note)
+    if not fields:
+        return 0
+    assignments, params = _assignments(fields)
+    sql = f"UPDATE books SET {assignments} WHERE id = ?"
+    params.append(book_id)
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params.append(user_id)
+    try:
+        with transaction() as conn:
+            owner = user_id if user_id is not None else _book_owner(conn, book_id)
+            changed = conn.execute(sql, params).rowcount
+        read_cache.invalidate(owner)
+        return changed
+    except Exception as e:
+        print("Error in update_book:", e)
+        return 0
+
+
+@instrumented
+@routed
+def update_books(user_id: int, book_ids, title: str = None, author: str = None, year: int = None,
+                 genre: str = None, read: bool = None, note: str = None) -> int:
+    """Apply the same change to many of a user's books in one transaction.
+
+    e.g. update_books(user_id, ids, read=True) marks them all as read. Books
+    that do not belong to the user are skipped; books that become equal to
+    another are kept as copies, as in update_book. Returns the number of
+    rows changed (0 if the update fails).
+    """
+    fields = _changed_fields(title, author, year, genre, read, note)
+    if not fields:
+        return 0
+    assignments, values = _assignments(fields)
+    sql = f"UPDATE books SET {assignments} WHERE id = ? AND user_id = ?"
+    try:
+        with transaction() as conn:
+            changed = conn.executemany(sql, ((*values, book_id, user_id) for book_id in book_ids)).rowcount
+        read_cache.invalidate(user_id)
+        return changed
+    except Exception as e:
+        print("Error in update_books:", e)
+        return 0
+
+
+@instrumented
+@routed
+def delete_book(book_id: int, user_id: int = None) -> bool:
+    """Delete a book by its ID.
+
+    When `user_id` is given the book must belong to that user, and False is
+    returned if no such book was deleted.
+    """
+    sql = "DELETE FROM books WHERE id = ?"
+    params = [book_id]
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params.append(user_id)
+    try:
+        with transaction() as conn:
+            owner = user_id if user_id is not None else _book_owner(conn, book_id)
+            deleted = conn.execute(sql, params).rowcount
+        read_cache.invalidate(owner)
+        return user_id is None or deleted > 0
     except Exception as e:
         print("Error in delete_book:", e)
         return False
 
 
+@instrumented
+@routed
+def delete_books(user_id: int, book_ids) -> int:
+    """Delete many of a user's books in one transaction.
+
+    Ids that do not exist or belong to another user are skipped. Returns
+    the number of books deleted, or False on failure.
+    """
+    try:
+        with transaction() as conn:
+            deleted = conn.executemany("DELETE FROM books WHERE id = ? AND user_id = ?",
+                                       ((book_id, user_id) for book_id in book_ids)).rowcount
+        read_cache.invalidate(user_id)
+        return deleted
+    except Exception as e:
+        print("Error in delete_books:", e)
+        return False
+
+
 #csv handler
-def csv_exporter(user_id: int) -> bool :
-    """Exports all the user data to a csv file"""
-    try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
-        conn.execute("BEGIN")
-        c.execute("select username from users where id = ?",(user_id,))
-        username=c.fetchone()[0]
-        c.execute("""
-            SELECT b.id, title, author, year, read, genre, note 
-            FROM books b
-            where  user_id = ?
-        """, (user_id,))
-        books = c.fetchall()
-        filname =  CSV / f"{username}.csv" 
-        filname.touch(exist_ok=True)
-        File=open(filname,mode="r+",newline="\n")
-        writeread=csv.writer(File)
-        writeread.writerow(["id","title","author","year","genre","read","note"])
-        writeread.writerows(books)
-        File.close()
-        conn.close()
-        return True
+@instrumented
+@routed
+def csv_exporter(user_id: int, **options):
+    """Export the user's books; CSV to DATA/export/<username>.csv by default.
+
+    Options are passed to utils.exporter.export_books (path, fmt, compress,
+    since, sort, batch_size). Returns the export summary, or False on failure.
+    """
+    try:
+        return export_books(user_id, **options)
     except Exception as e:
         print("Error in csv_exporter:", e)
         return False
 
-def csv_importer(user_id: int, file_path: str) -> bool:
+@instrumented
+@routed
+def csv_importer(user_id: int, file_path: str, **options):
+    """Stream a CSV file into the user's library in chunked transactions.
+
+    Options are passed to utils.importer.import_csv (chunk_size, reject_path,
+    progress, resume). Returns the import summary, or False on failure.
+    """
     try:
-        conn = sqlite3.connect(DB / "library.db")
-        c = conn.cursor()
+        return import_csv(user_id, file_path, **options)
 
-        rows = []
-        target = Path(file_path)
+    except Exception as e:
+        print("Error in csv_importer:", e)
+        return False
+    finally:
+        # chunks committed before a failure are visible too
+        read_cache.invalidate(user_id)
 
-        with target.open(newline="", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            next(reader, None)  # yeet header if it exists
-            for book in reader:
-                book.pop(0)
-                book.append(user_id)
-                rows.append(book)
 
-        conn.execute("BEGIN")
-        c.executemany(
-            """INSERT INTO books (title, author, year, genre, read, note, user_id)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            rows
-        )
-        conn.commit()
+@instrumented
+@routed
+def csv_batch_importer(user_id: int, source, **options):
+    """Import every CSV in a directory, glob pattern or list of paths.
 
-        c.close()
-        conn.close()
-        return True
+    Files are parsed in parallel worker processes and written by this process
+    alone; options (workers, chunk_size) go to utils.importer.import_many.
+    Returns the summary with per-file results, or False on failure.
+    """
+    try:
+        return import_many(user_id, source, **options)
 
     except Exception as e:
-        print("Error in csv_importer:", e)
+        print("Error in csv_batch_importer:", e)
         return False
-
+    finally:
+        read_cache.invalidate(user_id)
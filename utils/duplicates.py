@@ -0,0 +1,103 @@
+# ----------------------------
+# Near-Duplicate Detection
+# ----------------------------
+
+import re
+from difflib import SequenceMatcher
+
+from utils.connection import reader
+from utils.records import BOOK_COLUMNS, book_row
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_ARTICLES = ("the ", "a ", "an ")
+
+
+def normalize_title(title: str) -> str:
+    """Lowercase, drop punctuation and a leading article, collapse spaces."""
+    title = " ".join(_PUNCTUATION.sub(" ", title.lower()).split())
+    for article in _ARTICLES:
+        if title.startswith(article):
+            return title[len(article):]
+    return title
+
+
+def _surname(author: str) -> str:
+    words = _PUNCTUATION.sub(" ", author.lower()).split()
+    if not words:
+        return ""
+    # "Tolkien, J.R.R." lists the surname first
+    return words[0] if "," in author else words[-1]
+
+
+def blocking_keys(title: str, author: str) -> tuple:
+    """Keys under which a book is compared with others.
+
+    Only books sharing a key are compared: the author's surname with the
+    first letters of the title catches title typos, and a longer title
+    prefix catches author typos or "J. Smith" vs "John Smith".
+    """
+    title = normalize_title(title)
+    return (f"a:{_surname(author)}|{title[:2]}", f"t:{title[:8]}")
+
+
+def find_near_duplicates(user_id: int, threshold: float = 0.85, window: int = 20) -> list:
+    """Pairs of a user's books that look like the same book.
+
+    Books are grouped by blocking_keys(); inside a group they are sorted by
+    title and each book is compared with the next `window` books only, so
+    the work grows with the library size rather than with its square.
+    A pair scores the lower of difflib's title and author ratios (titles
+    compared after normalize_title), so a shared prolific author does not
+    make different titles look alike; the matcher's cheap upper bounds
+    skip hopeless pairs before the full ratio. Books with different known
+    years, and copies that share a fingerprint (kept on purpose), are not
+    reported. Returns (score, book, other) triples, best matches first.
+    """
+    with reader() as conn:
+        c = conn.cursor()
+        c.row_factory = lambda cursor, row: (book_row(cursor, row[:-1]), row[-1])
+        books = c.execute(
+            f"SELECT {', '.join(BOOK_COLUMNS)}, fingerprint FROM books WHERE user_id = ?", (user_id,)
+        ).fetchall()
+
+    blocks = {}
+    texts = {}
+    for book, fingerprint in books:
+        texts[book.id] = (normalize_title(book.title), " ".join(book.author.lower().split()), fingerprint)
+        for key in blocking_keys(book.title, book.author):
+            blocks.setdefault(key, []).append(book)
+
+    titles = SequenceMatcher(autojunk=False)
+    authors = SequenceMatcher(autojunk=False)
+    seen = set()
+    pairs = []
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        block.sort(key=lambda book: texts[book.id])
+        for i, book in enumerate(block):
+            title, author, fingerprint = texts[book.id]
+            titles.set_seq2(title)
+            authors.set_seq2(author)
+            for other in block[i + 1:i + 1 + window]:
+                pair = (book.id, other.id) if book.id < other.id else (other.id, book.id)
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                other_title, other_author, other_fingerprint = texts[other.id]
+                if other_fingerprint == fingerprint or (book.year and other.year and book.year != other.year):
+                    continue
+                titles.set_seq1(other_title)
+                if titles.real_quick_ratio() < threshold or titles.quick_ratio() < threshold:
+                    continue
+                score = titles.ratio()
+                if score < threshold:
+                    continue
+                if author != other_author:
+                    authors.set_seq1(other_author)
+                    score = min(score, authors.ratio())
+                if score >= threshold:
+                    pairs.append((round(score, 3), *((book, other) if book.id < other.id else (other, book))))
+
+    pairs.sort(key=lambda item: (-item[0], item[1].id, item[2].id))
+    return pairs
@@ -0,0 +1,122 @@
+# ----------------------------
+# Streaming Export
+# ----------------------------
+
+import csv
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+
+from utils.connection import get_pool, reader
+
+base = Path(__file__).resolve().parent.parent
+EXPORT = base / "DATA" / "export"
+
+EXPORT_COLUMNS = ("id", "title", "author", "year", "read", "genre", "note")
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl"}
+
+
+def _open_text(raw, compress: bool):
+    """Wrap a binary file in a text stream, gzip-compressed if asked to."""
+    stream = gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw
+    return stream, io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+def _writer(fmt: str, out):
+    if fmt == "csv":
+        rows = csv.writer(out)
+        rows.writerow(EXPORT_COLUMNS)
+        return rows.writerows
+
+    def write_jsonl(batch):
+        for row in batch:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record["read"] = bool(record["read"])
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return write_jsonl
+
+
+def _export_mode(target: Path) -> int:
+    """The mode of the file being replaced, or what the umask gives a new file."""
+    try:
+        return target.stat().st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def export_books(user_id: int, path=None, fmt: str = "csv", compress: bool = False,
+                 since: str = None, sort: str = "id", batch_size: int = 1000) -> dict:
+    """Stream a user's books to `path` and atomically replace it when done.
+
+    Rows are pulled from the cursor `batch_size` at a time, so memory does not
+    grow with the library. The output is written to a temporary file in the
+    same directory and renamed over `path` only after it is complete; a
+    failed export leaves the previous file untouched. `since` (an added_at
+    style 'YYYY-MM-DD HH:MM:SS' timestamp) limits the export to books added
+    or changed after that moment. `sort` is one of db_handler.SORT_KEYS; rows
+    come off that order's index, so no sort step runs.
+    """
+    from utils.db_handler import SORT_KEYS  # db_handler imports this module
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort order: {sort}")
+    keys, index = SORT_KEYS[sort]
+
+    if path is None:
+        # users live in the catalog even when books are sharded
+        with get_pool().reader() as conn:
+            user = conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()
+        if user is None:
+            raise LookupError(f"No user with id {user_id}")
+        path = EXPORT / f"{user[0]}{FORMATS[fmt]}{'.gz' if compress else ''}"
+
+    with reader(snapshot=True) as conn:
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        sql = f"""
+            SELECT id, title, author, year, read, genre, note
+            FROM books INDEXED BY {index}
+            WHERE user_id = ?
+        """
+        params = (user_id,)
+        if since is not None:
+            sql += " AND (added_at > ? OR updated_at > ?)"
+            params += (since, since)
+        cursor = conn.execute(f"{sql} ORDER BY {', '.join(keys)}", params)
+
+        import tempfile  # only exports need it; keeps utils quick to import
+
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+        rows = 0
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                stream, out = _open_text(raw, compress)
+                write = _writer(fmt, out)
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    write(batch)
+                    rows += len(batch)
+                out.flush()
+                out.detach()
+                if compress:
+                    stream.close()
+                raw.flush()
+                os.fsync(raw.fileno())
+            # mkstemp files are owner-only; keep the mode an export used to get
+            os.chmod(tmp_name, _export_mode(target))
+            os.replace(tmp_name, target)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+
+    return {"file": str(target), "format": fmt, "compressed": compress, "rows": rows, "since": since}
@@ -8,11 +8,11 @@ import html
 import os
 import time
 import random
-import smtplib
 import datetime
 from datetime import timezone
-from dotenv import load_dotenv
-from flask import request,session
+
+# flask, smtplib and dotenv are imported on first use: most callers only
+# need the logging helpers, and importing them up front slows every launch.
 
 #logging errors and users
 #to store errors for debugging
@@ -23,17 +23,20 @@ def log_error(message):
 #logging activity
 def log_activity(action):
     try:
+        from flask import request, session
         ip = request.headers.get('X-Forwarded-For', request.remote_addr)
         user_id = session.get('user_id', 'Unknown')
         username = session.get('username', 'Guest')
-    except RuntimeError:
+    except (ImportError, RuntimeError):
         ip = "NoRequest"
         user_id = "NoSession"
         username = "Unknown"
 
-    timestamp = datetime.now(timezone.utc).strftime("[%Y-%m-%d %H:%M:%S UTC]")
+    timestamp = datetime.datetime.now(timezone.utc).strftime("[%Y-%m-%d %H:%M:%S UTC]")
 
     entry = f"{timestamp} [ACTIVITY] [IP: {ip}] [UserID: {user_id}] [Username: {username}] {action}"
+    with open("DB/activity.log", "a", encoding='utf-8') as log_file:
+        log_file.write(entry + "\n")
 
 
 #working with files
@@ -46,9 +49,28 @@ def allowed_file(filename):
 #mailer functuanlity
 
 #State making
-load_dotenv()
-APP_PASSWORD = os.getenv("APP_PASSWORD")
-APP_EMAIL = os.getenv("APP_EMAIL")
+_env_loaded = False
+
+
+def load_env():
+    """Read .env into os.environ once, the first time settings are needed."""
+    global _env_loaded
+    if not _env_loaded:
+        try:
+            from dotenv import load_dotenv
+        except ImportError:
+            pass
+        else:
+            load_dotenv()
+        _env_loaded = True
+
+
+def __getattr__(name):
+    # APP_PASSWORD / APP_EMAIL used to be read at import time
+    if name in ("APP_PASSWORD", "APP_EMAIL"):
+        load_env()
+        return os.getenv(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def check_required_env_keys(*keys):
@@ -77,7 +99,12 @@ def generate_otp():
 
 #sending mails
 def send_email(rece_mail, content,subject=""):
-    check_required_env_keys(APP_EMAIL,APP_PASSWORD)
+    import smtplib
+
+    load_env()
+    check_required_env_keys("APP_EMAIL", "APP_PASSWORD")
+    APP_EMAIL = os.getenv("APP_EMAIL")
+    APP_PASSWORD = os.getenv("APP_PASSWORD")
     try:
          to_email=rece_mail
          msg = content
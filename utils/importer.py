@@ -0,0 +1,986 @@
+# ----------------------------
+# Streaming CSV Import
+# ----------------------------
+
+import csv
+import datetime as dt
+import glob
+import mmap
+import os
+import queue as queues
+import time
+from operator import itemgetter
+from pathlib import Path
+
+from utils.connection import reader, transaction
+from utils.migrations import add_stats, fingerprint_sql, log_inserts
+
+COLUMNS = ("id", "title", "author", "year", "read", "genre", "note")
+
+# Header written by the old csv_exporter. It labels the fifth and sixth
+# columns genre,read while the values were emitted as read,genre, so files
+# carrying it are read positionally in COLUMNS order.
+LEGACY_HEADER = ["id", "title", "author", "year", "genre", "read", "note"]
+
+TRUE_VALUES = {"1", "yes", "y", "true", "t"}
+FALSE_VALUES = {"", "0", "no", "n", "false", "f"}
+
+INSERT_BOOK = """
+    INSERT INTO books (user_id, title, author, year, genre, read, note)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# What to do with a book whose fingerprint (normalized title, author and
+# year) is already in the user's library: skip it, update the existing
+# book's read flag, genre and note, or keep both as numbered copies.
+DUPLICATE_POLICIES = ("skip", "update", "keep")
+
+
+def insert_book_sql(policy: str = "skip") -> str:
+    """An INSERT taking INSERT_BOOK's parameters that resolves duplicates by `policy`."""
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate policy: {policy}")
+    copy = "0"
+    if policy == "keep":
+        copy = f"""(
+            SELECT ifnull(MAX(b.copy) + 1, 0) FROM books b
+            WHERE b.user_id = v.user_id AND b.fingerprint = {fingerprint_sql("v.title", "v.author", "v.year")}
+        )"""
+    resolve = "DO NOTHING"
+    if policy == "update":
+        resolve = """DO UPDATE SET
+            read = excluded.read,
+            genre = coalesce(excluded.genre, genre),
+            note = coalesce(excluded.note, note)"""
+    return f"""
+        INSERT INTO books (user_id, title, author, year, genre, read, note, copy)
+        SELECT v.*, {copy}
+        FROM (SELECT ? AS user_id, ? AS title, ? AS author, ? AS year, ? AS genre, ? AS read, ? AS note) AS v
+        WHERE true
+        ON CONFLICT (user_id, fingerprint, copy) {resolve}
+    """
+
+
+def insert_books(conn, rows: list, policy: str = "skip") -> int:
+    """Insert INSERT_BOOK parameter rows under `policy`; return how many are new books."""
+    last_id = conn.execute("SELECT ifnull(MAX(id), 0) FROM books").fetchone()[0]
+    conn.executemany(insert_book_sql(policy), rows)
+    return conn.execute("SELECT COUNT(*) FROM books WHERE id > ?", (last_id,)).fetchone()[0]
+
+
+class RowError(ValueError):
+    """Raised for a CSV row that cannot be imported."""
+
+
+def parse_year(value: str):
+    if not value:
+        return None
+    try:
+        year = int(value)
+    except ValueError:
+        raise RowError(f"year '{value}' is not a number")
+    if year < 0 or year > dt.date.today().year:
+        raise RowError(f"year {year} is out of range")
+    return year
+
+
+def parse_read(value: str) -> int:
+    flag = value.lower()
+    if flag in TRUE_VALUES:
+        return 1
+    if flag in FALSE_VALUES:
+        return 0
+    raise RowError(f"read flag '{value}' is not yes/no/1/0")
+
+
+def header_positions(first_row: list):
+    """Map column names to indexes, or return None if the row is not a header."""
+    names = [name.strip().lower() for name in first_row]
+    if names == LEGACY_HEADER:
+        return {name: i for i, name in enumerate(COLUMNS)}
+    if "title" in names and "author" in names:
+        return {name: names.index(name) for name in COLUMNS if name in names}
+    return None
+
+
+def read_csv(f):
+    """Return (positions, records) for an open CSV file.
+
+    `records` lazily yields (number, row) for every data row, numbered from 1,
+    so only one row is held in memory at a time.
+    """
+    rows = csv.reader(f)
+    first = next(rows, None)
+    positions = header_positions(first) if first is not None else None
+
+    def records():
+        number = 0
+        if first is not None and positions is None:
+            number += 1
+            yield number, first
+        for row in rows:
+            number += 1
+            yield number, row
+
+    return positions or {name: i for i, name in enumerate(COLUMNS)}, records()
+
+
+def fields(row: list, positions: dict) -> tuple:
+    """Pick the stripped (title, author, year, genre, read, note) strings out of a row."""
+    def field(name):
+        i = positions.get(name)
+        return row[i].strip() if i is not None and i < len(row) else ""
+
+    return (field("title"), field("author"), field("year"),
+            field("genre"), field("read"), field("note"))
+
+
+def to_params(user_id: int, row: list, positions: dict) -> tuple:
+    """Validate one CSV row and coerce it into INSERT_BOOK parameters."""
+    title, author, year, genre, read, note = fields(row, positions)
+    if not title:
+        raise RowError("title is empty")
+    if not author:
+        raise RowError("author is empty")
+    return (
+        user_id,
+        title,
+        author,
+        parse_year(year),
+        genre or None,
+        parse_read(read),
+        note or None,
+    )
+
+
+# ----------------------------
+# Memory-Mapped Reader
+# ----------------------------
+
+# How many bytes MappedCSV cuts into records at once.
+BLOCK_SIZE = 1 << 20
+
+FIELDS = ("title", "author", "year", "genre", "read", "note")
+_TRUE_BYTES = frozenset(value.encode() for value in TRUE_VALUES)
+_FALSE_BYTES = frozenset(value.encode() for value in FALSE_VALUES)
+
+
+def _quoted_after(line: bytes, quoted: bool = False) -> bool:
+    """Whether `line` ends inside a quoted field; `quoted` says whether it starts in one.
+
+    As in the csv module, a quote opens a quoted field only at the start of
+    a field. Anywhere else, as in 12" Single, it is an ordinary character.
+    """
+    pos = 0
+    while True:
+        i = line.find(b'"', pos)
+        if i == -1:
+            return quoted
+        if quoted:
+            if line[i + 1:i + 2] == b'"':
+                pos = i + 2
+                continue
+            quoted = False
+        elif i == 0 or line[i - 1:i] == b",":
+            quoted = True
+        pos = i + 1
+
+
+class MappedCSV:
+    """A CSV file read through mmap and split into records on byte offsets.
+
+    The mapped file is cut into blocks that end on a record boundary, and
+    each block is split into lines in one call. Only the six columns of a
+    book are decoded, straight into the tuples that get inserted; other
+    columns, such as an exported id, are never turned into text. Lines
+    containing a quote go through the csv module instead, after a quoted
+    field that spans lines has been joined back, so the results match
+    read_csv() and to_params() row for row. Records the csv module cannot
+    read at all are rejected with a RowError; so is a header it cannot read,
+    from the constructor, which then leaves nothing open.
+
+    Every reading method takes a byte range, so split() can share a large
+    file out between workers. Use it as a context manager.
+    """
+
+    def __init__(self, path, block_size: int = BLOCK_SIZE):
+        self.path = Path(path)
+        self.block_size = block_size
+        self._file = self.path.open("rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # an empty file cannot be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+        first = next(self._blocks(0, min(1, self.size)), b"")
+        header = self._split(first)[:1]
+        try:
+            positions = header_positions(self._row(header[0])) if header else None
+        except RowError as e:
+            self.close()
+            raise RowError(f"header: {e}") from None
+        self.data_start = len(header[0]) + 1 if positions else 0
+        self.positions = positions or {name: i for i, name in enumerate(COLUMNS)}
+
+        indexes = [self.positions.get(name) for name in FIELDS]
+        # files without some of the columns take the csv module path
+        self._pick = itemgetter(*indexes) if None not in indexes else None
+        self._splits = max(i for i in indexes if i is not None) + 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.size:
+            self._map.close()
+        self._file.close()
+
+    def _blocks(self, start: int, end: int):
+        """Yield the bytes from `start` (a record start) onwards in blocks of
+        whole records, until the block that reaches `end`."""
+        mm, size = self._map, self.size
+        pos = start
+        while pos < end:
+            stop = mm.find(b"\n", max(pos, min(pos + self.block_size, end) - 1))
+            stop = size if stop == -1 else stop + 1
+            block = mm[pos:stop]
+            quoted = False
+            if b'"' in block:
+                for line in block.split(b"\n"):
+                    if b'"' in line:
+                        quoted = _quoted_after(line, quoted)
+            if quoted:
+                # a newline inside a quoted field is not a record boundary
+                pieces = [block]
+                while quoted and stop < size:
+                    more = mm.find(b"\n", stop)
+                    more = size if more == -1 else more + 1
+                    pieces.append(mm[stop:more])
+                    quoted = _quoted_after(pieces[-1], True)
+                    stop = more
+                block = b"".join(pieces)
+            yield block
+            pos = stop
+
+    @staticmethod
+    def _split(block: bytes) -> list:
+        """Cut a block into records, without their final newline."""
+        lines = block.split(b"\n")
+        if block.endswith(b"\n"):
+            del lines[-1]
+        if b'"' not in block:
+            return lines
+        records = []
+        pending = None
+        quoted = False
+        for line in lines:
+            if b'"' in line:
+                quoted = _quoted_after(line, quoted)
+            if pending is not None:
+                pending.append(line)
+                if not quoted:
+                    records.append(b"\n".join(pending))
+                    pending = None
+            elif quoted:
+                pending = [line]
+            else:
+                records.append(line)
+        if pending is not None:
+            records.append(b"\n".join(pending))
+        return records
+
+    @staticmethod
+    def _count(block: bytes) -> int:
+        if b'"' in block:
+            return len(MappedCSV._split(block))
+        return block.count(b"\n") + (not block.endswith(b"\n"))
+
+    @staticmethod
+    def _row(record: bytes) -> list:
+        try:
+            return next(csv.reader([record.decode()]), [])
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise RowError(f"unreadable CSV record: {e}")
+
+    def _range(self, start, end) -> tuple:
+        if start is None or start < self.data_start:
+            start = self.data_start
+        elif start > self.data_start and self._map[start - 1:start] != b"\n":
+            # not a record start: begin with the next line
+            start = self._map.find(b"\n", start)
+            start = self.size if start == -1 else start + 1
+        return start, self.size if end is None else min(end, self.size)
+
+    def _records(self, start, end):
+        for block in self._blocks(*self._range(start, end)):
+            yield from self._split(block)
+
+    def skip(self, rows: int) -> int:
+        """The byte offset of the data record that follows the first `rows`."""
+        pos = self.data_start
+        for block in self._blocks(pos, self.size):
+            count = self._count(block)
+            if count > rows:
+                for record in self._split(block)[:rows]:
+                    pos += len(record) + 1
+                return pos
+            rows -= count
+            pos += len(block)
+        return pos
+
+    def split(self, parts: int) -> list:
+        """Cut the data records into up to `parts` byte ranges of about equal size.
+
+        Ranges start and end on record boundaries. Returns (start, end,
+        number) triples, `number` being how many records come before
+        `start`, ready to be passed on to params() or fields().
+        """
+        ranges = []
+        start = self.data_start
+        number = 0
+        for part in range(1, parts + 1):
+            target = self.data_start + (self.size - self.data_start) * part // parts
+            if target <= start:
+                continue
+            end = start
+            count = 0
+            for block in self._blocks(start, target):
+                count += self._count(block)
+                end += len(block)
+            ranges.append((start, end, number))
+            start = end
+            number += count
+        return ranges
+
+    def fields(self, start: int = None, end: int = None, number: int = 0):
+        """Yield (number, title, author, year, genre, read, note, reason) for every
+        record in [start, end), numbered on from `number`.
+
+        The fields are stripped strings and reason is None. For a record the
+        csv module cannot read, reason says why and title holds the raw record.
+        """
+        pick, splits, positions = self._pick, self._splits, self.positions
+        for record in self._records(start, end):
+            number += 1
+            if pick is not None and b'"' not in record:
+                try:
+                    title, author, year, genre, read, note = pick(record.split(b",", splits))
+                    yield (number, title.decode().strip(), author.decode().strip(), year.decode().strip(),
+                           genre.decode().strip(), read.decode().strip(), note.decode().strip(), None)
+                    continue
+                except (IndexError, UnicodeDecodeError):
+                    pass
+            try:
+                yield (number, *fields(self._row(record), positions), None)
+            except RowError as e:
+                yield number, record.decode(errors="replace"), "", "", "", "", "", str(e)
+
+    def params(self, user_id: int, start: int = None, end: int = None, number: int = 0, reject=None):
+        """Yield (number, INSERT_BOOK parameters) for every valid record in [start, end).
+
+        Records are numbered on from `number`, the count of records before
+        `start`. An invalid record is passed to `reject(number, error, row)`,
+        with `row` its csv.reader columns, instead of being yielded; without
+        `reject` its RowError is raised.
+        """
+        pick, splits, positions = self._pick, self._splits, self.positions
+        latest = dt.date.today().year
+        true, false = _TRUE_BYTES, _FALSE_BYTES
+        for record in self._records(start, end):
+            number += 1
+            if pick is not None and b'"' not in record:
+                try:
+                    title, author, year, genre, read, note = pick(record.split(b",", splits))
+                    title = title.decode().strip()
+                    author = author.decode().strip()
+                    year = year.strip()
+                    year = int(year) if year else None
+                    read = read.strip().lower()
+                    read = 1 if read in true else 0 if read in false else None
+                except (IndexError, ValueError):
+                    pass
+                else:
+                    if title and author and read is not None and (year is None or 0 <= year <= latest):
+                        yield number, (user_id, title, author, year, genre.decode().strip() or None, read,
+                                       note.decode().strip() or None)
+                        continue
+            # quoted, short or invalid records: to_params decides, and explains
+            row = [record.decode(errors="replace")]
+            try:
+                row = self._row(record)
+                yield number, to_params(user_id, row, positions)
+            except RowError as e:
+                if reject is None:
+                    raise
+                reject(number, e, row)
+
+
+def _reject_path(target: Path, reject_path) -> Path:
+    return Path(reject_path) if reject_path else target.with_name(target.stem + ".rejects.csv")
+
+
+def import_csv(user_id: int, file_path: str, chunk_size: int = 1000, reject_path: str = None,
+               progress=None, resume: bool = False, bulk: bool = False, on_duplicate: str = "skip") -> dict:
+    """Stream a CSV file into the books table, committing every `chunk_size` rows.
+
+    Invalid rows are written to `reject_path` (default: <file>.rejects.csv)
+    with their row number and reason instead of aborting the import. Each
+    commit also records how far the file has been read, so `resume=True`
+    continues after the last committed chunk. `progress` is called with the
+    running summary after every commit.
+
+    Rows already in the library (or earlier in the file) are handled by
+    `on_duplicate`, one of DUPLICATE_POLICIES, so importing the same file
+    twice does not double the library. `duplicates` in the summary counts
+    the rows that were skipped or merged into an existing book.
+
+    `bulk=True` switches to bulk_import_csv for very large one-off loads.
+    A file whose header cannot be read raises RowError before anything is
+    written, as a missing file raises OSError.
+    """
+    if bulk:
+        return bulk_import_csv(user_id, file_path, reject_path=reject_path, on_duplicate=on_duplicate)
+    insert_book_sql(on_duplicate)
+
+    target = Path(file_path)
+    source = str(target.resolve())
+    reject_path = _reject_path(target, reject_path)
+
+    start_at = 0
+    if resume:
+        with reader() as conn:
+            saved = conn.execute(
+                "SELECT position FROM import_progress WHERE user_id = ? AND source = ?",
+                (user_id, source)
+            ).fetchone()
+        start_at = saved[0] if saved else 0
+
+    summary = {
+        "file": str(target),
+        "resumed_from": start_at,
+        "rows_read": 0,
+        "imported": 0,
+        "duplicates": 0,
+        "rejected": 0,
+        "chunks": 0,
+        "reject_file": None,
+        "seconds": 0.0,
+        "rows_per_sec": 0.0,
+    }
+    began = time.perf_counter()
+    reject_file = None
+    rejects = None
+    chunk = []
+
+    def reject(number: int, error: RowError, row: list):
+        nonlocal reject_file, rejects
+        if rejects is None:
+            reject_file = reject_path.open("a" if resume else "w", newline="", encoding="utf-8")
+            rejects = csv.writer(reject_file)
+            if reject_file.tell() == 0:
+                rejects.writerow(["row", "reason", *COLUMNS])
+            summary["reject_file"] = str(reject_path)
+        rejects.writerow([number, str(error), *row])
+        summary["rows_read"] += 1
+        summary["rejected"] += 1
+
+    def flush(position: int, done: bool):
+        with transaction() as conn:
+            added = insert_books(conn, chunk, on_duplicate)
+            if done:
+                conn.execute(
+                    "DELETE FROM import_progress WHERE user_id = ? AND source = ?",
+                    (user_id, source)
+                )
+            else:
+                conn.execute("""
+                    INSERT INTO import_progress (user_id, source, position, imported)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (user_id, source) DO UPDATE SET
+                        position = excluded.position,
+                        imported = imported + excluded.imported,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (user_id, source, position, added))
+        summary["imported"] += added
+        summary["duplicates"] += len(chunk) - added
+        summary["chunks"] += 1
+        chunk.clear()
+        if reject_file:
+            reject_file.flush()
+        elapsed = time.perf_counter() - began
+        summary["seconds"] = elapsed
+        summary["rows_per_sec"] = summary["imported"] / elapsed if elapsed else 0.0
+        if progress:
+            progress(dict(summary))
+
+    try:
+        with MappedCSV(target) as mapped:
+            number = start_at
+            for number, params in mapped.params(user_id, mapped.skip(start_at), number=start_at, reject=reject):
+                summary["rows_read"] += 1
+                chunk.append(params)
+                if len(chunk) >= chunk_size:
+                    flush(number, done=False)
+            flush(number, done=True)
+    finally:
+        if reject_file:
+            reject_file.close()
+
+    return summary
+
+
+# ----------------------------
+# Bulk Load
+# ----------------------------
+
+# Durability is relaxed for the load: a crash can only lose the whole bulk
+# transaction, never leave part of it behind.
+BULK_PRAGMAS = {
+    "synchronous": "OFF",
+    "cache_size": -262144,  # ~256 MB
+    "temp_store": "MEMORY",
+}
+
+DUPLICATE_REASONS = ("duplicate row in file", "already in library")
+
+# bulk_import_csv rebuilds the indexes of books rather than updating them
+# row by row only for loads of at least this many rows that also add at
+# least this fraction of the rows already in the table.
+DEFER_INDEXES_ROWS = 10000
+DEFER_INDEXES_RATIO = 0.5
+
+
+def _validate_staging(conn, user_id: int):
+    """Fill staging_books.reason for every row that must not be loaded."""
+    flags = (*TRUE_VALUES, *FALSE_VALUES)
+    conn.execute(f"""
+        UPDATE staging_books SET reason = coalesce(reason, CASE
+            WHEN title = '' THEN 'title is empty'
+            WHEN author = '' THEN 'author is empty'
+            WHEN year GLOB '*[^0-9]*' THEN 'year ''' || year || ''' is not a number'
+            WHEN year <> '' AND CAST(year AS INTEGER) > ? THEN 'year ' || year || ' is out of range'
+            WHEN lower(read) NOT IN ({",".join("?" * len(flags))}) THEN 'read flag ''' || read || ''' is not yes/no/1/0'
+        END)
+    """, (dt.date.today().year, *flags))
+    conn.execute(f"""
+        UPDATE staging_books SET fingerprint = {fingerprint_sql(year="CAST(nullif(year, '') AS INTEGER)")}
+        WHERE reason IS NULL
+    """)
+    conn.execute("CREATE INDEX temp.staging_fingerprint ON staging_books (fingerprint, line)")
+
+
+def _resolve_staging_duplicates(conn, user_id: int, policy: str):
+    """Apply the duplicate policy to the valid staging rows.
+
+    skip: repeats within the file and books already in the library get a
+    duplicate reason. update: rows matching a library book are pointed at it
+    through merge_id (the last such row wins) and repeats of new books are
+    skipped. keep: every row is loaded, numbered after the copies that
+    already exist.
+    """
+    if policy == "keep":
+        conn.execute("""
+            UPDATE staging_books SET copy = numbered.copy
+            FROM (
+                SELECT s.line, row_number() OVER (PARTITION BY s.fingerprint ORDER BY s.line) - 1 + ifnull((
+                    SELECT MAX(b.copy) + 1 FROM books b WHERE b.user_id = ? AND b.fingerprint = s.fingerprint
+                ), 0) AS copy
+                FROM staging_books s WHERE s.reason IS NULL
+            ) AS numbered
+            WHERE staging_books.line = numbered.line
+        """, (user_id,))
+        return
+
+    if policy == "update":
+        conn.execute("""
+            UPDATE staging_books SET merge_id = (
+                SELECT b.id FROM books b WHERE b.user_id = ? AND b.fingerprint = staging_books.fingerprint AND b.copy = 0
+            )
+            WHERE reason IS NULL
+        """, (user_id,))
+    else:
+        conn.execute("""
+            UPDATE staging_books SET reason = 'already in library'
+            WHERE reason IS NULL AND EXISTS (
+                SELECT 1 FROM books b WHERE b.user_id = ? AND b.fingerprint = staging_books.fingerprint
+            )
+        """, (user_id,))
+    conn.execute("""
+        UPDATE staging_books SET reason = 'duplicate row in file'
+        WHERE reason IS NULL AND merge_id IS NULL AND line > (
+            SELECT MIN(s.line) FROM staging_books s
+            WHERE s.fingerprint = staging_books.fingerprint AND s.reason IS NULL
+        )
+    """)
+
+
+def bulk_import_csv(user_id: int, file_path: str, reject_path: str = None, defer_indexes: bool = None,
+                    on_duplicate: str = "skip") -> dict:
+    """Load a large CSV through a staging table in a single transaction.
+
+    Raw rows are copied into a temp table, validated and matched against the
+    user's library by fingerprint in SQL, with duplicates resolved by
+    `on_duplicate` (see DUPLICATE_POLICIES), then moved into books with
+    one INSERT ... SELECT. With `defer_indexes` the secondary indexes and the
+    full-text, statistics and change-feed insert triggers are dropped for
+    the load, and the new rows are indexed, counted and logged in one pass
+    afterwards. That rebuilds the indexes for every user's books, so by
+    default (None) it is only done when the load is large next to the
+    table (see DEFER_INDEXES_ROWS and DEFER_INDEXES_RATIO).
+    """
+    insert_book_sql(on_duplicate)
+    target = Path(file_path)
+    reject_path = _reject_path(target, reject_path)
+    began = time.perf_counter()
+    summary = {
+        "file": str(target),
+        "rows_read": 0,
+        "imported": 0,
+        "rejected": 0,
+        "duplicates": 0,
+        "reject_file": None,
+        "seconds": 0.0,
+        "rows_per_sec": 0.0,
+    }
+
+    with transaction(BULK_PRAGMAS) as conn:
+        conn.execute("DROP TABLE IF EXISTS temp.staging_books")
+        conn.execute("""
+            CREATE TEMP TABLE staging_books (
+                line INTEGER PRIMARY KEY,
+                title TEXT, author TEXT, year TEXT, genre TEXT, read TEXT, note TEXT,
+                reason TEXT, fingerprint TEXT, copy INTEGER NOT NULL DEFAULT 0, merge_id INTEGER
+            )
+        """)
+        with MappedCSV(target) as mapped:
+            conn.executemany(
+                "INSERT INTO staging_books (line, title, author, year, genre, read, note, reason) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                mapped.fields()
+            )
+        _validate_staging(conn, user_id)
+        _resolve_staging_duplicates(conn, user_id, on_duplicate)
+        # merges run before the triggers are deferred, so the FTS index,
+        # statistics and change feed follow them
+        if on_duplicate == "update":
+            conn.execute(f"""
+                UPDATE books SET
+                    read = lower(s.read) IN ({",".join("?" * len(TRUE_VALUES))}),
+                    genre = coalesce(nullif(s.genre, ''), books.genre),
+                    note = coalesce(nullif(s.note, ''), books.note)
+                FROM (
+                    SELECT merge_id, read, genre, note FROM staging_books
+                    WHERE line IN (SELECT MAX(line) FROM staging_books WHERE merge_id IS NOT NULL GROUP BY merge_id)
+                ) AS s
+                WHERE books.id = s.merge_id
+            """, tuple(TRUE_VALUES))
+            summary["duplicates"] += conn.execute(
+                "SELECT COUNT(*) FROM staging_books WHERE merge_id IS NOT NULL").fetchone()[0]
+
+        if defer_indexes is None:
+            incoming = conn.execute(
+                "SELECT COUNT(*) FROM staging_books WHERE reason IS NULL AND merge_id IS NULL").fetchone()[0]
+            existing = conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+            defer_indexes = incoming >= DEFER_INDEXES_ROWS and incoming >= existing * DEFER_INDEXES_RATIO
+        summary["deferred_indexes"] = bool(defer_indexes)
+        deferred = []
+        if defer_indexes:
+            deferred = conn.execute("""
+                SELECT type, name, sql FROM sqlite_master
+                WHERE tbl_name = 'books' AND sql IS NOT NULL
+                  AND (type = 'index' OR (type = 'trigger' AND (name LIKE 'books_fts_%' OR name LIKE 'books_stats_%'
+                                                                OR name = 'books_changes_insert')))
+            """).fetchall()
+            for kind, name, _ in deferred:
+                conn.execute(f"DROP {kind.upper()} {name}")
+
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM books").fetchone()[0]
+        true_values = ",".join("?" * len(TRUE_VALUES))
+        cur = conn.execute(f"""
+            INSERT INTO books (user_id, title, author, year, genre, read, note, copy)
+            SELECT ?, title, author, CAST(nullif(year, '') AS INTEGER), nullif(genre, ''),
+                   lower(read) IN ({true_values}), nullif(note, ''), copy
+            FROM staging_books
+            WHERE reason IS NULL AND merge_id IS NULL
+            ORDER BY line
+        """, (user_id, *TRUE_VALUES))
+        summary["imported"] = cur.rowcount
+
+        triggers = {name for kind, name, _ in deferred if kind == "trigger"}
+        if "books_fts_insert" in triggers:
+            conn.execute("""
+                INSERT INTO books_fts (rowid, title, author, genre, note)
+                SELECT id, title, author, genre, note FROM books WHERE id > ?
+            """, (last_id,))
+        if "books_stats_insert" in triggers:
+            add_stats(conn, "WHERE id > ?", (last_id,))
+        if "books_changes_insert" in triggers:
+            log_inserts(conn, "WHERE id > ?", (last_id,))
+        # rebuilt inside the transaction: if the load fails, transaction()
+        # rolls back the drops along with everything else
+        for _, _, sql in deferred:
+            conn.execute(sql)
+
+        summary["rows_read"] = conn.execute("SELECT COUNT(*) FROM staging_books").fetchone()[0]
+        rejected = conn.execute("""
+            SELECT line, reason, title, author, year, genre, read, note
+            FROM staging_books WHERE reason IS NOT NULL ORDER BY line
+        """)
+        reject_file = None
+        try:
+            for line, reason, *values in rejected:
+                if reject_file is None:
+                    reject_file = reject_path.open("w", newline="", encoding="utf-8")
+                    rejects = csv.writer(reject_file)
+                    rejects.writerow(["row", "reason", "title", "author", "year", "genre", "read", "note"])
+                    summary["reject_file"] = str(reject_path)
+                rejects.writerow([line, reason, *values])
+                if reason in DUPLICATE_REASONS:
+                    summary["duplicates"] += 1
+                else:
+                    summary["rejected"] += 1
+        finally:
+            if reject_file:
+                reject_file.close()
+        conn.execute("DROP TABLE temp.staging_books")
+
+    elapsed = time.perf_counter() - began
+    summary["seconds"] = elapsed
+    summary["rows_per_sec"] = summary["imported"] / elapsed if elapsed else 0.0
+    return summary
+
+
+# ----------------------------
+# Parallel Multi-File Import
+# ----------------------------
+
+_queue = None
+_stop = None
+
+
+def _init_worker(queue, stop):
+    global _queue, _stop
+    _queue = queue
+    _stop = stop
+
+
+def _parse_worker(user_id: int, file_path: str, chunk_size: int, part: tuple = None):
+    """Parse and validate one file in a worker process.
+
+    With `part` = (index, start, end, number) only that byte range of the
+    file is read (see MappedCSV.split). Valid rows are sent to the parent in
+    chunks over the shared queue, which is bounded, so a slow writer
+    throttles the parsers. Rejected rows go to the file's own
+    <file>.rejects.csv, or for a part to <file>.part<index>.rejects.csv,
+    which import_many joins afterwards. Once `_stop` is set the worker
+    gives up at its next chunk.
+    """
+    if _stop.is_set():
+        return
+    target = Path(file_path)
+    index, start, end, number = part or (0, None, None, 0)
+    key = (file_path, index)
+    reject_path = _reject_path(target, None if part is None else target.with_name(f"{target.stem}.part{index}.rejects.csv"))
+    summary = {"rows_read": 0, "rejected": 0, "reject_file": None}
+    reject_file = None
+    rejects = None
+    chunk = []
+
+    def reject(number: int, error: RowError, row: list):
+        nonlocal reject_file, rejects
+        if rejects is None:
+            reject_file = reject_path.open("w", newline="", encoding="utf-8")
+            rejects = csv.writer(reject_file)
+            rejects.writerow(["row", "reason", *COLUMNS])
+            summary["reject_file"] = str(reject_path)
+        rejects.writerow([number, str(error), *row])
+        summary["rows_read"] += 1
+        summary["rejected"] += 1
+
+    try:
+        with MappedCSV(target) as mapped:
+            for _, params in mapped.params(user_id, start, end, number, reject):
+                summary["rows_read"] += 1
+                chunk.append(params)
+                if len(chunk) >= chunk_size:
+                    if _stop.is_set():
+                        return
+                    _queue.put(("rows", key, chunk))
+                    chunk = []
+        if chunk:
+            _queue.put(("rows", key, chunk))
+        _queue.put(("done", key, summary))
+    except Exception as e:
+        _queue.put(("error", key, f"{type(e).__name__}: {e}"))
+    finally:
+        if reject_file:
+            reject_file.close()
+
+
+def _stop_workers(futures, queue, stop):
+    """Make the workers of an abandoned import return.
+
+    Workers blocked on the full queue only see `stop` once there is room
+    again, so the queue is drained until every started task has ended.
+    """
+    stop.set()
+    for future in futures:
+        future.cancel()
+    while not all(future.done() for future in futures):
+        try:
+            queue.get(timeout=0.1)
+        except queues.Empty:
+            pass
+
+
+def _split_sources(files: list, workers: int, split_size: int) -> list:
+    """(path, part) tasks: one per file, or one per byte range for files of at
+    least twice `split_size`, in as many ranges as there are workers."""
+    tasks = []
+    for path in files:
+        try:
+            parts = min(workers, os.path.getsize(path) // split_size)
+        except OSError:
+            parts = 1  # the worker reports it
+        if parts < 2:
+            tasks.append((path, None))
+            continue
+        try:
+            with MappedCSV(path) as mapped:
+                ranges = mapped.split(parts)
+        except RowError:
+            tasks.append((path, None))  # an unreadable header: the worker reports it
+            continue
+        tasks += [(path, (index, *bounds)) for index, bounds in enumerate(ranges)]
+    return tasks
+
+
+def _join_rejects(path: str, parts: list) -> str:
+    """Concatenate the part reject files of `path`, in file order, into its own."""
+    target = _reject_path(Path(path), None)
+    with target.open("w", newline="", encoding="utf-8") as out:
+        for number, (_, part_file) in enumerate(sorted(parts)):
+            with open(part_file, newline="", encoding="utf-8") as f:
+                if number:
+                    f.readline()  # header
+                out.write(f.read())
+            os.remove(part_file)
+    return str(target)
+
+
+def find_sources(source) -> list:
+    """Expand a directory, glob pattern or list of paths into CSV files."""
+    if isinstance(source, (list, tuple)):
+        return [str(Path(path)) for path in source]
+    path = Path(source)
+    if path.is_dir():
+        return sorted(str(p) for p in path.glob("*.csv"))
+    if glob.has_magic(str(source)):
+        return sorted(glob.glob(str(source)))
+    return [str(path)]
+
+
+# Files at least twice this size are shared out between import_many's
+# workers in byte ranges, so one huge export does not leave the rest idle.
+SPLIT_SIZE = 64 << 20
+
+
+def import_many(user_id: int, source, workers: int = None, chunk_size: int = 1000, on_duplicate: str = "skip",
+                split_size: int = SPLIT_SIZE) -> dict:
+    """Import many CSV files at once.
+
+    Files are parsed and validated by `workers` processes in parallel while
+    this process is the only writer, inserting each chunk in its own
+    transaction, so SQLite never sees competing writers. A file of at least
+    twice `split_size` bytes is read by several workers, each from its own
+    byte range. Duplicates are resolved by `on_duplicate` as in import_csv;
+    which of two equal rows in different files or ranges arrives first is
+    not defined. Returns a summary with per-file results; a file that fails
+    does not stop the others. That includes a chunk that cannot be written:
+    the file gets the error, keeps the chunks already committed, and the
+    rest of its rows are dropped.
+    """
+    insert_book_sql(on_duplicate)
+    files = find_sources(source)
+    began = time.perf_counter()
+    results = {
+        path: {"rows_read": 0, "imported": 0, "duplicates": 0, "rejected": 0, "reject_file": None, "error": None}
+        for path in files
+    }
+    if not files:
+        return {"files": results, "imported": 0, "duplicates": 0, "rejected": 0, "seconds": 0.0, "rows_per_sec": 0.0}
+
+    # imported here so that loading utils does not pay for them
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = _split_sources(files, workers or multiprocessing.cpu_count(), split_size)
+    workers = workers or min(len(tasks), multiprocessing.cpu_count())
+    ctx = multiprocessing.get_context("spawn")
+    chunks = ctx.Queue(maxsize=workers * 4)
+    stop = ctx.Event()
+    remaining = {(path, part[0] if part else 0) for path, part in tasks}
+    part_rejects = {}
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                               initializer=_init_worker, initargs=(chunks, stop))
+    futures = {}
+    finished = False
+    try:
+        futures = {
+            pool.submit(_parse_worker, user_id, path, chunk_size, part): (path, part[0] if part else 0)
+            for path, part in tasks
+        }
+        while remaining:
+            try:
+                kind, key, payload = chunks.get(timeout=0.5)
+            except queues.Empty:
+                # a worker that died never reports back
+                for future, key in futures.items():
+                    if key in remaining and future.done() and future.exception():
+                        results[key[0]]["error"] = f"worker failed: {future.exception()}"
+                        remaining.discard(key)
+                continue
+            path = key[0]
+            if kind == "rows":
+                if results[path]["error"]:
+                    continue
+                try:
+                    with transaction() as conn:
+                        added = insert_books(conn, payload, on_duplicate)
+                except Exception as e:
+                    results[path]["error"] = f"write failed: {type(e).__name__}: {e}"
+                    continue
+                results[path]["imported"] += added
+                results[path]["duplicates"] += len(payload) - added
+            elif kind == "done":
+                results[path]["rows_read"] += payload["rows_read"]
+                results[path]["rejected"] += payload["rejected"]
+                if payload["reject_file"]:
+                    part_rejects.setdefault(path, []).append((key[1], payload["reject_file"]))
+                remaining.discard(key)
+            else:
+                results[path]["error"] = payload
+                remaining.discard(key)
+        finished = True
+    finally:
+        if not finished:
+            _stop_workers(futures, chunks, stop)
+        pool.shutdown(cancel_futures=True)
+
+    for path, parts in part_rejects.items():
+        single = len(parts) == 1 and parts[0][1] == str(_reject_path(Path(path), None))
+        results[path]["reject_file"] = parts[0][1] if single else _join_rejects(path, parts)
+
+    imported = sum(result["imported"] for result in results.values())
+    elapsed = time.perf_counter() - began
+    return {
+        "files": results,
+        "imported": imported,
+        "duplicates": sum(result["duplicates"] for result in results.values()),
+        "rejected": sum(result["rejected"] for result in results.values()),
+        "workers": workers,
+        "seconds": elapsed,
+        "rows_per_sec": imported / elapsed if elapsed else 0.0,
+    }
@@ -0,0 +1,423 @@
+# ----------------------------
+# Database Maintenance
+# ----------------------------
+
+import json
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+
+from utils.connection import current_pool, get_pool
+from utils.sharding import all_pools
+
+# Defaults for MaintenanceScheduler. Intervals are in seconds; 0 turns a
+# scheduled task off.
+SETTINGS = {
+    "check_every": 300,         # how often start() looks for due tasks
+    "backup_every": 86400,
+    "backups_kept": 7,
+    "backup_pages": 1024,       # pages copied per backup step
+    "backup_sleep": 0.005,      # pause between steps, in seconds
+    "analyze_every": 7 * 86400, # also as soon as a database has no statistics
+    "optimize_every": 3600,
+    "analysis_limit": 1000,     # rows ANALYZE samples per index
+    "vacuum_every": 86400,      # release whatever pages are free ...
+    "vacuum_free_ratio": 0.1,   # ... or as soon as this share of pages is free
+    "vacuum_min_pages": 256,    # ... and at least this many
+    "vacuum_step": 512,         # pages released per write transaction
+    "vacuum_sleep": 0.005,      # pause between transactions, in seconds
+    "full_vacuum": False,       # allow a blocking VACUUM, see vacuum()
+    "fragmentation": 0.3,       # with full_vacuum: rebuild files this fragmented
+}
+
+TASKS = ("backup", "analyze", "optimize", "vacuum")
+
+AUTO_VACUUM = ("none", "full", "incremental")
+
+
+def _fragmentation(conn) -> float:
+    """Share of b-tree pages that do not follow the previous page of their
+    table or index, walking each tree in order; None without dbstat."""
+    try:
+        rows = conn.execute("SELECT name, pageno FROM dbstat ORDER BY name, path").fetchall()
+    except sqlite3.OperationalError:
+        return None
+    scattered = 0
+    previous = (None, None)
+    for name, pageno in rows:
+        if name == previous[0] and pageno != previous[1] + 1:
+            scattered += 1
+        previous = (name, pageno)
+    return round(scattered / len(rows), 4) if rows else 0.0
+
+
+def database_metrics(pool=None, detail: bool = False) -> dict:
+    """Size and free-space figures of one database file.
+
+    free_ratio is the share of pages on the freelist: space a mass delete
+    left behind that only vacuuming returns to the file system. With
+    `detail=True` the fragmentation is measured too, which reads every page
+    of the file, so it is meant for reports rather than frequent checks.
+    """
+    pool = pool or current_pool()
+    with pool.reader() as conn:
+        page_size, pages, free, auto_vacuum = (
+            conn.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+        )
+        analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+        fragmentation = _fragmentation(conn) if detail else None
+    wal = Path(f"{pool.path}-wal")
+    return {
+        "path": str(pool.path),
+        "file_bytes": pool.path.stat().st_size,
+        "wal_bytes": wal.stat().st_size if wal.exists() else 0,
+        "page_size": page_size,
+        "pages": pages,
+        "free_pages": free,
+        "free_bytes": free * page_size,
+        "free_ratio": round(free / pages, 4) if pages else 0.0,
+        "fragmentation": fragmentation,
+        "auto_vacuum": AUTO_VACUUM[auto_vacuum],
+        "analyzed": analyzed,
+    }
+
+
+def _backup_name(pool, root: Path) -> str:
+    try:
+        return str(pool.path.relative_to(root))
+    except ValueError:
+        return pool.path.name
+
+
+def _prune(directory: Path, keep: int) -> list:
+    backups = sorted(path for path in directory.iterdir() if path.is_dir() and not path.name.endswith(".part"))
+    removed = backups[:-keep] if keep > 0 else []
+    for path in removed:
+        shutil.rmtree(path)
+    return [path.name for path in removed]
+
+
+def backup(directory=None, pages: int = 1024, sleep: float = 0.005, keep: int = 0,
+           progress=None, now: float = None) -> dict:
+    """Copy library.db and every shard into a new timestamped folder of `directory`.
+
+    Uses SQLite's online backup API `pages` pages at a time, pausing
+    `sleep` seconds between steps. In WAL mode every database is read from
+    one snapshot taken before the first page is copied: writers carry on
+    undisturbed and the copy never has to restart because of them, but the
+    WAL cannot be checkpointed past the snapshot until the backup is done.
+    Under a rollback journal a long read would block writers instead, so
+    the copy restarts if a write lands between two steps.
+
+    Copies are written to a ".part" folder, verified with quick_check and
+    switched to DELETE journaling, then renamed, so a crash never leaves a
+    half-written backup that looks complete. Only the newest `keep`
+    backups are kept (0: all). `progress(file, remaining, total)` is
+    called after each step.
+    """
+    catalog = get_pool()
+    directory = Path(directory) if directory else catalog.path.parent / "backups"
+    stamp = datetime.fromtimestamp(time.time() if now is None else now).strftime("%Y%m%d-%H%M%S")
+    final = directory / stamp
+    suffix = 0
+    while final.exists():
+        suffix += 1
+        final = directory / f"{stamp}-{suffix}"
+    part = final.with_name(final.name + ".part")
+    began = time.perf_counter()
+
+    files = []
+    with ExitStack() as snapshots:
+        # a failed copy must not leave a folder behind
+        snapshots.callback(lambda: part.exists() and shutil.rmtree(part))
+        sources = []
+        for pool in all_pools():
+            wal = pool.journal_mode() == "wal"
+            conn = snapshots.enter_context(pool.reader(snapshot=wal))
+            if wal:
+                conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            sources.append((pool, conn))
+
+        for pool, conn in sources:
+            name = _backup_name(pool, catalog.path.parent)
+            path = part / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            steps = [0]
+
+            def step(status, remaining, total):
+                steps[0] += 1
+                if progress:
+                    progress(name, remaining, total)
+
+            copied = time.perf_counter()
+            target = sqlite3.connect(path)
+            try:
+                conn.backup(target, pages=pages, progress=step, sleep=sleep)
+                target.execute("PRAGMA journal_mode = DELETE")
+                check = target.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                target.close()
+            if check != "ok":
+                raise sqlite3.DatabaseError(f"Backup of {name} failed quick_check: {check}")
+            files.append({
+                "file": name,
+                "bytes": path.stat().st_size,
+                "steps": steps[0],
+                "seconds": round(time.perf_counter() - copied, 4),
+            })
+        part.rename(final)
+
+    return {
+        "path": str(final),
+        "files": files,
+        "bytes": sum(file["bytes"] for file in files),
+        "seconds": round(time.perf_counter() - began, 4),
+        "removed": _prune(directory, keep),
+    }
+
+
+def analyze(pool=None, analysis_limit: int = 1000) -> dict:
+    """Rebuild the query planner's statistics with ANALYZE.
+
+    analysis_limit caps the rows sampled per index, so the cost stays
+    roughly constant however large the library grows.
+    """
+    pool = pool or current_pool()
+    with pool.transaction() as conn:
+        conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        conn.execute("ANALYZE")
+        tables = conn.execute("SELECT COUNT(DISTINCT tbl) FROM sqlite_stat1").fetchone()[0]
+    return {"tables": tables}
+
+
+def optimize(pool=None, analysis_limit: int = 1000) -> dict:
+    """Run PRAGMA optimize on the write connection.
+
+    SQLite re-analyzes only the tables whose statistics look stale for the
+    queries this connection has run, which is why it goes through the
+    pool's long-lived write connection rather than a fresh one.
+    """
+    pool = pool or current_pool()
+    with pool.transaction() as conn:
+        conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        conn.execute("PRAGMA optimize").fetchall()
+    return {}
+
+
+def incremental_vacuum(pool=None, step: int = 512, sleep: float = 0.005, pages: int = None) -> dict:
+    """Give free pages back to the file system, `step` pages per write transaction.
+
+    The write connection is let go for `sleep` seconds after every step:
+    taken back at once it would never reach a waiting writer, which would
+    then wait for the whole run rather than for one step. Needs
+    auto_vacuum=INCREMENTAL, which new databases get from the connection
+    profiles; older files switch over at their first vacuum(). Releases up
+    to `pages` pages (default: all free).
+    """
+    pool = pool or current_pool()
+    freed = steps = 0
+    while pages is None or freed < pages:
+        with pool.writer() as conn:
+            if AUTO_VACUUM[conn.execute("PRAGMA auto_vacuum").fetchone()[0]] != "incremental":
+                return {"freed": freed, "steps": steps, "skipped": "auto_vacuum is not incremental"}
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            count = min(step, free, pages - freed if pages is not None else free)
+            # every step of incremental_vacuum releases one page, and
+            # execute() steps statements that return no rows only once;
+            # executescript() runs it to the end as its own write transaction
+            conn.executescript(f"PRAGMA incremental_vacuum({count})")
+            released = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        freed += released
+        steps += 1
+        if not released:
+            break
+        time.sleep(sleep)
+    # in WAL mode the file only shrinks once the truncation is checkpointed
+    pool.checkpoint("PASSIVE")
+    return {"freed": freed, "steps": steps}
+
+
+def vacuum(pool=None) -> dict:
+    """Rebuild the whole file with VACUUM.
+
+    Defragments the file, releases every free page and applies the
+    profile's auto_vacuum mode, so files created before incremental
+    vacuuming switch over. It holds the write lock for the whole run and
+    needs free disk space for a second copy of the database, so the
+    scheduler only uses it when the "full_vacuum" setting allows.
+    """
+    pool = pool or current_pool()
+    before = pool.path.stat().st_size
+    with pool.writer() as conn:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return {"bytes_before": before, "bytes_after": pool.path.stat().st_size}
+
+
+def last_runs(pool=None) -> dict:
+    """{task: (ran_at, seconds, result)} from the database's maintenance log."""
+    pool = pool or current_pool()
+    with pool.reader() as conn:
+        return {
+            task: (ran_at, seconds, json.loads(result) if result else None)
+            for task, ran_at, seconds, result in conn.execute(
+                "SELECT task, ran_at, seconds, result FROM maintenance_log")
+        }
+
+
+def _record(pool, task: str, ran_at: float, seconds: float, result: dict):
+    with pool.transaction() as conn:
+        conn.execute("""
+            INSERT INTO maintenance_log (task, ran_at, seconds, result) VALUES (?, ?, ?, ?)
+            ON CONFLICT (task) DO UPDATE SET
+                ran_at = excluded.ran_at, seconds = excluded.seconds, result = excluded.result
+        """, (task, ran_at, seconds, json.dumps(result)))
+
+
+class MaintenanceScheduler:
+    """Works out which maintenance tasks are due and runs them.
+
+    library.db and every shard are looked at separately. A task is due when
+    its interval has passed since it last ran on that database, as recorded
+    in the database's maintenance_log, so the schedule survives restarts.
+    ANALYZE is also due on a database without statistics, and vacuuming as
+    soon as the free pages cross the vacuum_free_ratio and vacuum_min_pages
+    thresholds. Backups always cover every database and are logged in
+    library.db.
+
+    `settings` override SETTINGS. `clock` returns the time in seconds; tests
+    pass a fake one and call run_pending() instead of start().
+    """
+
+    def __init__(self, settings: dict = None, backup_dir=None, clock=time.time):
+        unknown = set(settings or {}) - set(SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown maintenance settings: {', '.join(sorted(unknown))}")
+        self.settings = {**SETTINGS, **(settings or {})}
+        self.backup_dir = backup_dir
+        self.clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _elapsed(self, runs: dict, task: str, now: float) -> bool:
+        every = self.settings[f"{task}_every"]
+        return bool(every) and (task not in runs or now - runs[task][0] >= every)
+
+    def _fragmented(self, stats: dict) -> bool:
+        fragmentation = stats["fragmentation"]
+        return self.settings["full_vacuum"] and fragmentation is not None \
+            and fragmentation >= self.settings["fragmentation"]
+
+    def _vacuum_reason(self, stats: dict, runs: dict, now: float):
+        settings = self.settings
+        if stats["auto_vacuum"] != "incremental" and not settings["full_vacuum"]:
+            return None
+        if stats["free_pages"] >= settings["vacuum_min_pages"] and stats["free_ratio"] >= settings["vacuum_free_ratio"]:
+            return f"{stats['free_pages']} free pages ({stats['free_ratio']:.0%})"
+        if self._fragmented(stats):
+            return f"fragmentation {stats['fragmentation']:.0%}"
+        if stats["free_pages"] and self._elapsed(runs, "vacuum", now):
+            return "schedule"
+        return None
+
+    def due(self, now: float = None) -> list:
+        """(task, pool, reason) for every task that should run now."""
+        now = self.clock() if now is None else now
+        jobs = []
+        if self._elapsed(last_runs(get_pool()), "backup", now):
+            jobs.append(("backup", get_pool(), "schedule"))
+        for pool in all_pools():
+            runs = last_runs(pool)
+            stats = database_metrics(pool, detail=self.settings["full_vacuum"])
+            if not stats["analyzed"]:
+                jobs.append(("analyze", pool, "no statistics"))
+            elif self._elapsed(runs, "analyze", now):
+                jobs.append(("analyze", pool, "schedule"))
+            if self._elapsed(runs, "optimize", now):
+                jobs.append(("optimize", pool, "schedule"))
+            reason = self._vacuum_reason(stats, runs, now)
+            if reason:
+                jobs.append(("vacuum", pool, reason))
+        return jobs
+
+    def run(self, task: str, pool=None, now: float = None) -> dict:
+        """Run one task now, whether or not it is due (pool: default library.db)."""
+        settings = self.settings
+        pool = pool or get_pool()
+        if task == "backup":
+            return backup(self.backup_dir, settings["backup_pages"], settings["backup_sleep"],
+                          settings["backups_kept"], now=self.clock() if now is None else now)
+        if task == "analyze":
+            return analyze(pool, settings["analysis_limit"])
+        if task == "optimize":
+            return optimize(pool, settings["analysis_limit"])
+        if task == "vacuum":
+            stats = database_metrics(pool, detail=settings["full_vacuum"])
+            if stats["auto_vacuum"] == "incremental" and not self._fragmented(stats):
+                return incremental_vacuum(pool, settings["vacuum_step"], settings["vacuum_sleep"])
+            return vacuum(pool) if settings["full_vacuum"] else {"skipped": "full_vacuum is off"}
+        raise ValueError(f"Unknown maintenance task: {task}")
+
+    def run_pending(self, now: float = None) -> list:
+        """Run every due task and log it; returns one report per task.
+
+        A task that fails is reported with its error and not logged, so it
+        is tried again at the next check. If the due tasks cannot be worked
+        out, a single "check" report carries the error.
+        """
+        now = self.clock() if now is None else now
+        try:
+            jobs = self.due(now)
+        except Exception as e:
+            return [{"task": "check", "error": f"{type(e).__name__}: {e}"}]
+        reports = []
+        for task, pool, reason in jobs:
+            began = time.perf_counter()
+            report = {"task": task, "database": str(pool.path), "reason": reason}
+            try:
+                result = self.run(task, pool, now)
+            except Exception as e:
+                reports.append({**report, "error": str(e)})
+                continue
+            seconds = round(time.perf_counter() - began, 4)
+            _record(pool, task, now, seconds, result)
+            reports.append({**report, "seconds": seconds, **result})
+        return reports
+
+    def start(self, report=None):
+        """Check for due tasks every check_every seconds in a daemon thread.
+
+        `report(reports)` is called after each check that ran something.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while True:
+                # a failed check must not end the thread, or maintenance stops for good
+                try:
+                    reports = self.run_pending()
+                    if reports and report:
+                        report(reports)
+                except Exception as e:
+                    print("Error in maintenance check:", e)
+                if self._stop.wait(self.settings["check_every"]):
+                    return
+
+        self._thread = threading.Thread(target=loop, name="library-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
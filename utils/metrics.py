@@ -0,0 +1,272 @@
+# ----------------------------
+# Instrumentation
+# ----------------------------
+
+import functools
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from pathlib import Path
+
+base = Path(__file__).resolve().parent.parent
+SNAPSHOT = base / "DATA" / "metrics.json"
+
+# Upper bounds (ms) of the latency histogram buckets; slower samples go into
+# a final overflow bucket.
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# The progress handler fires every this many SQLite VM instructions.
+PROGRESS_STEPS = 1000
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|\bNULL\b")
+_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def normalize_sql(sql: str) -> str:
+    """Reduce a traced statement to its shape: literals become ? and
+    whitespace is collapsed, so repeated calls share one histogram."""
+    sql = _LITERALS.sub("?", sql)
+    sql = _LISTS.sub("?, ...", sql)
+    return " ".join(sql.split())
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; percentiles are bucket upper bounds."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, pct: float) -> float:
+        rank = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        labels = [f"<={bound}" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class _StatementClock:
+    """Trace and progress callbacks for one connection while it is checked out.
+
+    A statement is timed from the moment SQLite starts it until the next
+    statement starts or the connection goes back to the pool, so the time
+    spent fetching its rows is included.
+    """
+
+    __slots__ = ("metrics", "sql", "began", "steps", "slow")
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.sql = None
+        self.began = 0.0
+        self.steps = 0
+        self.slow = []
+
+    def __call__(self, sql: str):
+        if sql == self.sql or sql.startswith("--"):
+            # triggers report their parent statement (or a comment) again;
+            # that work belongs to the statement already being timed
+            return
+        now = time.perf_counter()
+        self.stop(now)
+        self.sql = sql
+        self.began = now
+        self.steps = 0
+
+    def tick(self) -> int:
+        self.steps += 1
+        return 0
+
+    def stop(self, now: float = None):
+        if self.sql is None:
+            return
+        ms = ((now or time.perf_counter()) - self.began) * 1000
+        self.metrics._statement(self.sql, ms, self.steps, self)
+        self.sql = None
+
+
+def _rows(result) -> int:
+    """Rows in a handler result: a list, a (page, cursor) pair or one record."""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, tuple):
+        return 1
+    return 0
+
+
+class Metrics:
+    """Process-wide timings and counters for the data layer.
+
+    While disabled, instrumented handlers and the connection pool only check
+    `enabled` and carry on, so leaving the hooks in place costs next to
+    nothing. When enabled it records per-handler call latencies, per-statement
+    latencies (through sqlite3 trace and progress callbacks), connection,
+    transaction and row counters, and the EXPLAIN QUERY PLAN of statements
+    slower than `slow_ms`.
+    """
+
+    def __init__(self, enabled: bool = False, slow_ms: float = 100.0, slow_log=None, max_slow: int = 100):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.max_slow = max_slow
+        self._lock = threading.Lock()
+        self._clocks = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.statements = {}
+            self.counters = {}
+            self.slow = deque(maxlen=self.max_slow)
+            self.started = time.time()
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, ms: float):
+        with self._lock:
+            histogram = self.calls.get(name)
+            if histogram is None:
+                histogram = self.calls[name] = Histogram()
+            histogram.add(ms)
+
+    def _statement(self, sql: str, ms: float, steps: int, clock: _StatementClock):
+        shape = normalize_sql(sql)
+        with self._lock:
+            entry = self.statements.get(shape)
+            if entry is None:
+                entry = self.statements[shape] = [Histogram(), 0]
+            entry[0].add(ms)
+            entry[1] += steps
+            self.counters["statements"] = self.counters.get("statements", 0) + 1
+            self.counters["vm_steps"] = self.counters.get("vm_steps", 0) + steps * PROGRESS_STEPS
+        if ms >= self.slow_ms:
+            clock.slow.append((sql, ms))
+
+    # connection hooks, called by utils.connection.ConnectionPool
+    def attach(self, conn):
+        clock = _StatementClock(self)
+        self._clocks[id(conn)] = clock
+        conn.set_trace_callback(clock)
+        conn.set_progress_handler(clock.tick, PROGRESS_STEPS)
+
+    def detach(self, conn):
+        clock = self._clocks.pop(id(conn), None)
+        if clock is None:
+            return
+        clock.stop()
+        conn.set_trace_callback(None)
+        conn.set_progress_handler(None, 0)
+        for sql, ms in clock.slow:
+            self._log_slow(conn, sql, ms)
+
+    def _log_slow(self, conn, sql: str, ms: float):
+        plan = None
+        if sql.lstrip().upper().startswith(_EXPLAINABLE):
+            try:
+                plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            except Exception as e:
+                plan = [f"unavailable: {e}"]
+        entry = {"at": time.time(), "ms": round(ms, 3), "sql": " ".join(sql.split()), "plan": plan}
+        with self._lock:
+            self.slow.append(entry)
+            self.counters["slow_statements"] = self.counters.get("slow_statements", 0) + 1
+        if self.slow_log:
+            with open(self.slow_log, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps(entry) + "\n")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "since": self.started,
+                "seconds": round(time.time() - self.started, 3),
+                "counters": dict(sorted(self.counters.items())),
+                "calls": {name: h.snapshot() for name, h in sorted(self.calls.items())},
+                "statements": {
+                    shape: {**h.snapshot(), "vm_steps": steps * PROGRESS_STEPS}
+                    for shape, (h, steps) in sorted(self.statements.items(), key=lambda item: -item[1][0].total)
+                },
+                "slow": list(self.slow),
+            }
+
+    def write_snapshot(self, path=None) -> str:
+        """Write snapshot() as JSON to `path` (DATA/metrics.json by default)."""
+        path = Path(path or SNAPSHOT)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return str(path)
+
+
+# LIBRARY_METRICS=1 turns instrumentation on for the whole process.
+metrics = Metrics(enabled=os.getenv("LIBRARY_METRICS", "0") == "1")
+
+
+def configure_metrics(enabled: bool = None, slow_ms: float = None, slow_log=None) -> Metrics:
+    """Adjust the process-wide instrumentation and reset what it collected."""
+    if enabled is not None:
+        metrics.enabled = enabled
+    if slow_ms is not None:
+        metrics.slow_ms = slow_ms
+    if slow_log is not None:
+        metrics.slow_log = slow_log
+    metrics.reset()
+    return metrics
+
+
+def instrumented(fn):
+    """Record the latency, result rows and errors of every call to `fn`."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return fn(*args, **kwargs)
+        began = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            metrics.count(f"{name}.errors")
+            raise
+        metrics.observe(name, (time.perf_counter() - began) * 1000)
+        metrics.count("rows_returned", _rows(result))
+        return result
+
+    return wrapper
@@ -0,0 +1,389 @@
+# ----------------------------
+# Schema Migrations
+# ----------------------------
+
+import sqlite3
+
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    options = {row[0] for row in conn.execute("PRAGMA compile_options")}
+    return "ENABLE_FTS5" in options
+
+
+def _create_books_fts(conn: sqlite3.Connection):
+    """Mirror the searchable book fields into an FTS5 index kept in sync by triggers.
+
+    Skipped when SQLite was built without FTS5; search_books then falls back to LIKE.
+    """
+    if not fts5_available(conn):
+        return
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            title, author, genre, note,
+            content='books', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author, genre, note)
+            VALUES (new.id, new.title, new.author, new.genre, new.note);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, genre, note)
+            VALUES ('delete', old.id, old.title, old.author, old.genre, old.note);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, genre, note ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, genre, note)
+            VALUES ('delete', old.id, old.title, old.author, old.genre, old.note);
+            INSERT INTO books_fts (rowid, title, author, genre, note)
+            VALUES (new.id, new.title, new.author, new.genre, new.note);
+        END
+    """)
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+
+# Per-user reading statistics: every book counts once towards each of these
+# buckets. `{row}` is replaced by "new." / "old." in the triggers and by ""
+# when aggregating the books table directly.
+STAT_BUCKETS = (
+    ("all", "''"),
+    ("author", "{row}author"),
+    ("genre", "ifnull({row}genre, '')"),
+    ("decade", "ifnull(CAST({row}year / 10 * 10 AS TEXT), '')"),
+    ("added", "ifnull(strftime('%Y-%m', {row}added_at), '')"),
+)
+STAT_READ = "(ifnull({row}read, 0) != 0)"
+
+_STATS_UPSERT = """
+    ON CONFLICT (user_id, dimension, bucket)
+    DO UPDATE SET total = total + excluded.total, read = read + excluded.read
+"""
+
+
+def stats_select(where: str = "") -> str:
+    """Aggregate books into (user_id, dimension, bucket, total, read) rows.
+
+    `where` is repeated once per bucket, and so must its parameters be.
+    """
+    read = STAT_READ.format(row="")
+    return "\nUNION ALL\n".join(
+        f"SELECT user_id, '{dimension}', {bucket.format(row='')}, COUNT(*), SUM({read}) "
+        f"FROM books {where} GROUP BY 1, 2, 3"
+        for dimension, bucket in STAT_BUCKETS
+    )
+
+
+def add_stats(conn: sqlite3.Connection, where: str = "", params: tuple = ()):
+    """Add the books matched by `where` to book_stats."""
+    conn.execute(
+        f"INSERT INTO book_stats (user_id, dimension, bucket, total, read) "
+        f"SELECT * FROM ({stats_select(where)}) WHERE true {_STATS_UPSERT}",
+        tuple(params) * len(STAT_BUCKETS),
+    )
+
+
+def _stats_values(row: str, sign: str) -> str:
+    read = STAT_READ.format(row=row)
+    return ", ".join(
+        f"({row}user_id, '{dimension}', {bucket.format(row=row)}, {sign}1, {sign}{read})"
+        for dimension, bucket in STAT_BUCKETS
+    )
+
+
+def create_stats_triggers(conn: sqlite3.Connection):
+    insert = "INSERT INTO book_stats (user_id, dimension, bucket, total, read) VALUES"
+    add = f"{insert} {_stats_values('new.', '')} {_STATS_UPSERT};"
+    remove = f"{insert} {_stats_values('old.', '-')} {_STATS_UPSERT};"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS books_stats_insert AFTER INSERT ON books BEGIN {add} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS books_stats_delete AFTER DELETE ON books BEGIN {remove} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS books_stats_update
+        AFTER UPDATE OF user_id, author, genre, year, read, added_at ON books
+        BEGIN {remove} {add} END
+    """)
+
+
+def _create_book_stats(conn: sqlite3.Connection):
+    """Summary counts per user and bucket, kept current by triggers on books."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS book_stats (
+            user_id INTEGER NOT NULL,
+            dimension TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            read INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, dimension, bucket)
+        ) WITHOUT ROWID
+    """)
+    create_stats_triggers(conn)
+    conn.execute("DELETE FROM book_stats")
+    add_stats(conn)
+
+
+def _normalized(expr: str) -> str:
+    """SQL for `expr` case-folded with its whitespace trimmed and collapsed.
+
+    Tabs and newlines become spaces and each replace() halves a run of
+    spaces, so runs of up to 32 collapse to one. lower() only folds ASCII.
+    """
+    expr = f"replace(replace(replace({expr}, char(9), ' '), char(10), ' '), char(13), ' ')"
+    for _ in range(5):
+        expr = f"replace({expr}, '  ', ' ')"
+    return f"lower(trim({expr}))"
+
+
+def fingerprint_sql(title: str = "title", author: str = "author", year: str = "year") -> str:
+    """SQL computing a book's duplicate fingerprint from three column expressions."""
+    return f"{_normalized(title)} || '|' || {_normalized(author)} || '|' || ifnull({year}, '')"
+
+
+def _number_duplicate_copies(conn: sqlite3.Connection):
+    """Give existing duplicates distinct copy numbers so the unique index can be built."""
+    conn.execute("""
+        UPDATE books SET copy = numbered.copy
+        FROM (
+            SELECT id, row_number() OVER (PARTITION BY user_id, fingerprint ORDER BY id) - 1 AS copy
+            FROM books
+        ) AS numbered
+        WHERE books.id = numbered.id AND numbered.copy > 0
+    """)
+
+
+# Leading words dropped from titles when sorting: "The Hobbit" sorts as "hobbit".
+SORT_ARTICLES = ("the", "a", "an")
+
+
+def title_key_sql(title: str = "title") -> str:
+    """SQL for a title's sort key: case-folded, trimmed, without a leading article."""
+    folded = f"lower(trim({title}))"
+    articles = " ".join(
+        f"WHEN {folded} LIKE '{article} %' THEN ltrim(substr({folded}, {len(article) + 2}))"
+        for article in SORT_ARTICLES
+    )
+    return f"CASE {articles} ELSE {folded} END"
+
+
+def author_key_sql(author: str = "author") -> str:
+    """SQL for an author's sort key: "surname, given names", case-folded.
+
+    Names already written surname first (with a comma) and single names are
+    kept as they are. rtrim() with every non-space character of the name
+    strips the last word, which leaves the given names.
+    """
+    folded = f"lower(trim({author}))"
+    given = f"rtrim({folded}, replace({folded}, ' ', ''))"
+    return (
+        f"CASE WHEN instr({folded}, ',') OR NOT instr({folded}, ' ') THEN {folded} "
+        f"ELSE substr({folded}, length({given}) + 1) || ', ' || rtrim({given}) END"
+    )
+
+
+# Book fields carried by the change feed; `{row}` as in STAT_BUCKETS.
+CHANGE_FIELDS = ("title", "author", "year", "genre", "read", "note")
+
+
+def _change_object(row: str) -> str:
+    return "json_object(" + ", ".join(f"'{name}', {row}{name}" for name in CHANGE_FIELDS) + ")"
+
+
+def log_inserts(conn: sqlite3.Connection, where: str = "", params: tuple = ()):
+    """Record an 'insert' change for every book matched by `where`, in id order."""
+    conn.execute(
+        f"INSERT INTO book_changes (user_id, book_id, op, fields) "
+        f"SELECT user_id, id, 'insert', {_change_object('')} FROM books {where} ORDER BY id",
+        params,
+    )
+
+
+def create_change_triggers(conn: sqlite3.Connection):
+    """Log every insert, delete and field change of a book into book_changes.
+
+    Updates record only the fields whose value changed, and updates that
+    change none of CHANGE_FIELDS (such as the updated_at touch) are not logged.
+    """
+    changed = " OR ".join(f"new.{name} IS NOT old.{name}" for name in CHANGE_FIELDS)
+    pairs = " UNION ALL ".join(f"SELECT '{name}' AS name, new.{name} AS value, old.{name} AS old"
+                               for name in CHANGE_FIELDS)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS books_changes_insert AFTER INSERT ON books BEGIN
+            INSERT INTO book_changes (user_id, book_id, op, fields)
+            VALUES (new.user_id, new.id, 'insert', {_change_object('new.')});
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_changes_delete AFTER DELETE ON books BEGIN
+            INSERT INTO book_changes (user_id, book_id, op) VALUES (old.user_id, old.id, 'delete');
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS books_changes_update AFTER UPDATE ON books
+        WHEN {changed} BEGIN
+            INSERT INTO book_changes (user_id, book_id, op, fields)
+            SELECT new.user_id, new.id, 'update', json_group_object(name, value)
+            FROM ({pairs}) WHERE value IS NOT old;
+        END
+    """)
+
+
+def _create_book_changes(conn: sqlite3.Connection):
+    """Change feed of books: one row per insert, update or delete.
+
+    seq is AUTOINCREMENT, so it only ever grows, even after old changes are
+    truncated. change_horizon remembers per user the last truncated seq, so
+    readers further behind know they must resync. Books that existed before
+    this migration are not in the feed; consumers start from a full export.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS book_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            book_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            fields TEXT,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_book_changes_user ON book_changes (user_id, seq)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_horizon (
+            user_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    """)
+    create_change_triggers(conn)
+
+
+# Each migration is (version, description, steps). A step is either an SQL
+# string or a callable taking the connection. The applied version is stored
+# in PRAGMA user_version, so every migration runs exactly once per database.
+MIGRATIONS = [
+    (1, "create users and books tables", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            year INTEGER,
+            genre TEXT,
+            read BOOLEAN DEFAULT 0,
+            note TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        );
+        """,
+    ]),
+    (2, "per-user indexes on books", [
+        "CREATE INDEX IF NOT EXISTS idx_books_user ON books (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_books_user_author ON books (user_id, author)",
+        "CREATE INDEX IF NOT EXISTS idx_books_user_title ON books (user_id, title COLLATE NOCASE)",
+    ]),
+    (3, "full-text index over title, author, genre and note", [
+        _create_books_fts,
+    ]),
+    (4, "resumable CSV import checkpoints", [
+        """
+        CREATE TABLE IF NOT EXISTS import_progress (
+            user_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            imported INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, source)
+        );
+        """,
+    ]),
+    (5, "track when a book was last changed", [
+        "ALTER TABLE books ADD COLUMN updated_at TIMESTAMP",
+        """
+        CREATE TRIGGER IF NOT EXISTS books_touch AFTER UPDATE ON books
+        WHEN new.updated_at IS old.updated_at BEGIN
+            UPDATE books SET updated_at = CURRENT_TIMESTAMP WHERE id = new.id;
+        END
+        """,
+    ]),
+    (6, "indexes for keyset pagination by year and read status", [
+        "CREATE INDEX IF NOT EXISTS idx_books_user_year ON books (user_id, ifnull(year, -1))",
+        "CREATE INDEX IF NOT EXISTS idx_books_user_read ON books (user_id, read, title COLLATE NOCASE)",
+    ]),
+    (7, "reading statistics summary table", [
+        _create_book_stats,
+    ]),
+    (8, "duplicate fingerprints with a unique index per user", [
+        f"ALTER TABLE books ADD COLUMN fingerprint TEXT GENERATED ALWAYS AS ({fingerprint_sql()}) VIRTUAL",
+        # books the user deliberately keeps twice are numbered copies 1, 2, ...
+        "ALTER TABLE books ADD COLUMN copy INTEGER NOT NULL DEFAULT 0",
+        _number_duplicate_copies,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_books_user_fingerprint ON books (user_id, fingerprint, copy)",
+    ]),
+    (9, "change feed of book inserts, updates and deletes", [
+        _create_book_changes,
+    ]),
+    (10, "shard placement of users", [
+        """
+        CREATE TABLE IF NOT EXISTS user_shards (
+            user_id INTEGER PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+        """,
+    ]),
+    (11, "last run of each maintenance task", [
+        """
+        CREATE TABLE IF NOT EXISTS maintenance_log (
+            task TEXT PRIMARY KEY,
+            ran_at REAL NOT NULL,
+            seconds REAL NOT NULL,
+            result TEXT
+        )
+        """,
+    ]),
+    (12, "title and author sort keys with per-user indexes", [
+        f"ALTER TABLE books ADD COLUMN title_key TEXT GENERATED ALWAYS AS ({title_key_sql()}) VIRTUAL",
+        f"ALTER TABLE books ADD COLUMN author_key TEXT GENERATED ALWAYS AS ({author_key_sql()}) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_books_user_title_key ON books (user_id, title_key)",
+        "CREATE INDEX IF NOT EXISTS idx_books_user_author_key ON books (user_id, author_key, title_key)",
+        # read-status listings order by the title key from now on
+        "DROP INDEX IF EXISTS idx_books_user_read",
+        "CREATE INDEX idx_books_user_read ON books (user_id, read, title_key)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: int = SCHEMA_VERSION) -> list:
+    """Apply every pending migration up to `target` on an open transaction.
+
+    Returns the list of (version, description) pairs that were applied.
+    """
+    current = schema_version(conn)
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+        conn.execute(f"PRAGMA user_version = {version}")
+        applied.append((version, description))
+    return applied
@@ -0,0 +1,81 @@
+# ----------------------------
+# Result Records
+# ----------------------------
+
+import json
+from array import array
+from typing import NamedTuple, Optional
+
+BOOK_COLUMNS = ("id", "title", "author", "year", "read", "genre", "note")
+
+
+class Book(NamedTuple):
+    """One row of the books table, in the order every handler selects it.
+
+    A named tuple costs the same memory as a plain tuple (no per-instance
+    __dict__), and book[1] style indexing keeps working.
+    """
+    id: int
+    title: str
+    author: str
+    year: Optional[int]
+    read: int
+    genre: Optional[str]
+    note: Optional[str]
+
+
+class SearchHit(NamedTuple):
+    """A ranked search result: the book columns plus a highlighted snippet."""
+    id: int
+    title: str
+    author: str
+    year: Optional[int]
+    read: int
+    genre: Optional[str]
+    note: Optional[str]
+    snippet: Optional[str]
+
+
+class Change(NamedTuple):
+    """One entry of the book change feed.
+
+    `op` is "insert", "update" or "delete"; `fields` maps the changed book
+    fields to their new values (all of them for an insert, None for a delete).
+    """
+    seq: int
+    book_id: int
+    op: str
+    fields: Optional[dict]
+    changed_at: str
+
+
+def book_row(cursor, row) -> Book:
+    """sqlite3 row factory producing Book records."""
+    return Book._make(row)
+
+
+def search_row(cursor, row) -> SearchHit:
+    return SearchHit._make(row)
+
+
+def change_row(cursor, row) -> Change:
+    seq, book_id, op, fields, changed_at = row
+    return Change(seq, book_id, op, json.loads(fields) if fields else None, changed_at)
+
+
+def to_columns(rows, names=BOOK_COLUMNS) -> dict:
+    """Turn an iterable of rows into one column per field.
+
+    Non-empty integer columns without NULLs are packed into array('q'), which
+    stores 8 bytes per value instead of a pointer to a separate int object;
+    other columns stay lists.
+    """
+    columns = {name: [] for name in names}
+    appends = [columns[name].append for name in names]
+    for row in rows:
+        for append, value in zip(appends, row):
+            append(value)
+    for name, values in columns.items():
+        if values and all(type(value) is int for value in values):
+            columns[name] = array("q", values)
+    return columns
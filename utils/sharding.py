@@ -0,0 +1,254 @@
+# ----------------------------
+# Sharding by User
+# ----------------------------
+
+import functools
+import inspect
+import os
+import threading
+from pathlib import Path
+
+from utils.cache import read_cache
+from utils.connection import ConnectionPool, _route, get_pool, using
+
+# Book ids and change-feed seqs of shard i start at (i + 1) << SHARD_BITS,
+# so they are unique across shards and never collide with the ids of an
+# unsharded library.db. A cursor's range also tells which shard issued it.
+SHARD_BITS = 40
+
+# Stored columns of books (fingerprint and the sort keys are generated) and of import
+# checkpoints, copied when a user moves to another shard.
+MOVED_TABLES = {
+    "books": ("id", "user_id", "title", "author", "year", "genre", "read", "note", "added_at", "updated_at", "copy"),
+    "import_progress": ("user_id", "source", "position", "imported", "updated_at"),
+}
+# Everything a user leaves behind on the old shard. books goes first so its
+# triggers have run before the feed and summaries are cleared.
+USER_TABLES = ("books", "import_progress", "book_changes", "change_horizon", "book_stats")
+
+
+class ShardRouter:
+    """Places each user's books in one of `count` shard databases.
+
+    library.db stays the catalog: it holds users and the user_shards
+    placement table. Each shard file has the full books schema (FTS index,
+    statistics, change feed) for the users placed on it, and its own write
+    lock, so writers of different shards never wait for each other.
+
+    New users are placed on shard user_id % count. Users whose books are
+    still in library.db from before sharding keep being served from there
+    until scripts/rebalance.py moves them. Placements are cached per
+    process; rebalance while other processes are stopped.
+    """
+
+    def __init__(self, directory, count: int, **options):
+        self.directory = Path(directory)
+        self.count = count
+        self.pools = [ConnectionPool(self.directory / f"library-{i}.db", **options) for i in range(count)]
+        self._placement = {}
+        self._lock = threading.Lock()
+
+    def _placed(self, user_id: int):
+        """The user's stored shard, or None; -1 means library.db itself."""
+        catalog = get_pool()
+        with catalog.reader() as conn:
+            row = conn.execute("SELECT shard FROM user_shards WHERE user_id = ?", (user_id,)).fetchone()
+            if row:
+                return row[0]
+            if conn.execute("SELECT 1 FROM books WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
+                return -1
+        return None
+
+    def shard_of(self, user_id: int) -> int:
+        """The shard index holding the user's books (-1: still in library.db)."""
+        shard = self._placement.get(user_id)
+        if shard is not None:
+            return shard
+        with self._lock:
+            shard = self._placed(user_id)
+            if shard is None:
+                shard = user_id % self.count
+                with get_pool().transaction() as conn:
+                    conn.execute("INSERT OR IGNORE INTO user_shards (user_id, shard) VALUES (?, ?)", (user_id, shard))
+                    shard = conn.execute("SELECT shard FROM user_shards WHERE user_id = ?", (user_id,)).fetchone()[0]
+            self._placement[user_id] = shard
+        return shard
+
+    def pool(self, shard: int) -> ConnectionPool:
+        return get_pool() if shard == -1 else self.pools[shard]
+
+    def pool_for(self, user_id: int) -> ConnectionPool:
+        return self.pool(self.shard_of(user_id))
+
+    def pool_for_book(self, book_id: int):
+        """The pool holding `book_id`, probing the shard its id range points at first."""
+        guess = (book_id >> SHARD_BITS) - 1
+        candidates = [self.pools[guess]] if 0 <= guess < self.count else []
+        candidates += [pool for pool in self.pools if pool not in candidates] + [get_pool()]
+        for pool in candidates:
+            with pool.reader() as conn:
+                if conn.execute("SELECT 1 FROM books WHERE id = ?", (book_id,)).fetchone():
+                    return pool
+        return None
+
+    def forget(self, user_id: int = None):
+        """Drop cached placements (of one user or everyone)."""
+        with self._lock:
+            if user_id is None:
+                self._placement.clear()
+            else:
+                self._placement.pop(user_id, None)
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
+
+
+def seed_id_ranges(conn, shard: int):
+    """Start the shard's book ids and change seqs at its own range."""
+    start = (shard + 1) << SHARD_BITS
+    for table in ("books", "book_changes"):
+        if not conn.execute("SELECT 1 FROM sqlite_sequence WHERE name = ?", (table,)).fetchone():
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, start))
+
+
+def seq_range(conn) -> int:
+    """Which id range the database's change seqs come from (0: unsharded)."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'book_changes'").fetchone()
+    return row[0] >> SHARD_BITS if row else 0
+
+
+_router = None  # None: not decided yet, _OFF: not sharded
+_router_lock = threading.Lock()
+_OFF = object()
+
+
+def get_router():
+    """The process-wide router, or None when the library is not sharded.
+
+    LIBRARY_SHARDS=N shards the default database into N files under
+    DATA/DB/shards/.
+    """
+    global _router
+    if _router is _OFF:
+        return None
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                count = int(os.getenv("LIBRARY_SHARDS", "0"))
+                _router = ShardRouter(get_pool().path.parent / "shards", count) if count > 0 else _OFF
+    return _router if _router is not _OFF else None
+
+
+def configure_shards(count: int = 0, directory=None, **options):
+    """Shard books over `count` files in `directory` (default: shards/ next to
+    library.db), or turn sharding off with count=0. Returns the router."""
+    global _router
+    with _router_lock:
+        if isinstance(_router, ShardRouter):
+            _router.close()
+        _router = _OFF
+        if count > 0:
+            _router = ShardRouter(directory or get_pool().path.parent / "shards", count, **options)
+    return get_router()
+
+
+def all_pools() -> list:
+    """library.db followed by every shard: what maintenance jobs must visit."""
+    router = get_router()
+    return [get_pool()] + (router.pools if router else [])
+
+
+def routed(fn):
+    """Run `fn` against the shard of its user_id argument (or, failing that,
+    of its book_id) when the library is sharded."""
+    names = list(inspect.signature(fn).parameters)
+    positions = {name: names.index(name) for name in ("user_id", "book_id") if name in names}
+
+    def argument(name, args, kwargs):
+        if name in kwargs:
+            return kwargs[name]
+        position = positions.get(name)
+        return args[position] if position is not None and position < len(args) else None
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        router = get_router()
+        if router is None or _route.get() is not None:
+            return fn(*args, **kwargs)
+        user_id = argument("user_id", args, kwargs)
+        if user_id is not None:
+            pool = router.pool_for(user_id)
+        else:
+            book_id = argument("book_id", args, kwargs)
+            pool = router.pool_for_book(book_id) if book_id is not None else None
+        if pool is None:
+            return fn(*args, **kwargs)
+        with using(pool):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def move_user(user_id: int, target: int, router: ShardRouter = None, batch: int = 10000) -> int:
+    """Move a user's books and import checkpoints to shard `target`.
+
+    The source shard's write lock is held for the whole move, so no write
+    for the user can slip in between the copy and the delete. Books keep
+    their ids, except books from a higher shard's id range, which get new
+    ids from the target's range. The target shard's triggers rebuild the
+    FTS index and the statistics, and log every moved book as an insert.
+    Change-feed cursors from the old shard are answered with resync.
+    Returns the number of books moved.
+    """
+    router = router or get_router()
+    source = router.pool(router.shard_of(user_id))
+    destination = router.pool(target)
+    if source is destination:
+        return 0
+    # AUTOINCREMENT continues after the highest id in the table, so a book
+    # from a higher range would make the target issue ids of that range
+    renumber_from = (target + 2) << SHARD_BITS
+    moved = 0
+    with source.transaction() as src:
+        with destination.transaction() as dst:
+            # leftovers of an interrupted move
+            for table in USER_TABLES:
+                dst.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            for table, columns in MOVED_TABLES.items():
+                names = ", ".join(columns)
+                insert = f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))})"
+                rows = src.execute(f"SELECT {names} FROM {table} WHERE user_id = ?", (user_id,))
+                while chunk := rows.fetchmany(batch):
+                    if table == "books":
+                        chunk = [(None, *row[1:]) if row[0] >= renumber_from else row for row in chunk]
+                        moved += len(chunk)
+                    dst.executemany(insert, chunk)
+        with get_pool().transaction() as conn:
+            conn.execute("""
+                INSERT INTO user_shards (user_id, shard) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard
+            """, (user_id, target))
+        for table in USER_TABLES:
+            src.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+    router.forget(user_id)
+    read_cache.invalidate(user_id)
+    return moved
+
+
+def plan_rebalance(router: ShardRouter = None) -> list:
+    """(user_id, from, to) for every user not on shard user_id % count.
+
+    `from` is -1 for users whose books are still in library.db. Users
+    without books or placement are skipped; they are placed on first use.
+    """
+    router = router or get_router()
+    with get_pool().reader() as conn:
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+    plan = []
+    for user_id in user_ids:
+        current = router._placed(user_id)
+        target = user_id % router.count
+        if current is not None and current != target:
+            plan.append((user_id, current, target))
+    return plan
@@ -0,0 +1,106 @@
+# ----------------------------
+# Reading Statistics
+# ----------------------------
+
+from utils.connection import reader, transaction
+from utils.migrations import STAT_BUCKETS, add_stats, stats_select
+from utils.sharding import routed
+
+
+def _buckets(conn, user_id: int, dimension: str, order: str, limit: int = -1) -> list:
+    return conn.execute(f"""
+        SELECT bucket, total, read FROM book_stats
+        WHERE user_id = ? AND dimension = ? AND total > 0
+        ORDER BY {order}
+        LIMIT ?
+    """, (user_id, dimension, limit)).fetchall()
+
+
+def reading_stats(user_id: int, top: int = 10) -> dict:
+    """Summarise a user's library from the book_stats summary table.
+
+    Returns totals, the read percentage, the `top` authors and genres as
+    (name, books, read) triples, (decade, books, read) per decade and
+    (YYYY-MM, books added) per month. Only summary rows are read, so the cost
+    depends on the number of distinct authors/genres/months, not on the
+    number of books. Books without a genre, year or added date are grouped
+    under None.
+    """
+    with reader() as conn:
+        row = conn.execute("""
+            SELECT total, read FROM book_stats
+            WHERE user_id = ? AND dimension = 'all' AND bucket = ''
+        """, (user_id,)).fetchone()
+        total, read = row if row else (0, 0)
+        authors = _buckets(conn, user_id, "author", "total DESC, bucket", top)
+        genres = _buckets(conn, user_id, "genre", "total DESC, bucket", top)
+        decades = [(int(decade) if decade else None, books, done)
+                   for decade, books, done in _buckets(conn, user_id, "decade", "bucket")]
+        added = _buckets(conn, user_id, "added", "bucket")
+
+    return {
+        "total": total,
+        "read": read,
+        "unread": total - read,
+        "read_pct": round(100.0 * read / total, 1) if total else 0.0,
+        "authors": authors,
+        "genres": [(genre or None, books, done) for genre, books, done in genres],
+        "decades": sorted(decades, key=lambda bucket: (bucket[0] is None, bucket[0] or 0)),
+        "added": [(month or None, books) for month, books, _ in added],
+    }
+
+
+def _user_filter(user_id: int = None) -> tuple:
+    return ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+
+
+def _drift(conn, user_id: int = None) -> list:
+    where, params = _user_filter(user_id)
+    stored = {
+        (uid, dimension, bucket): (total, read)
+        for uid, dimension, bucket, total, read in conn.execute(
+            f"SELECT user_id, dimension, bucket, total, read FROM book_stats {where}", params)
+        if total
+    }
+    actual = {
+        (uid, dimension, bucket): (total, read)
+        for uid, dimension, bucket, total, read in conn.execute(
+            stats_select(where), params * len(STAT_BUCKETS))
+    }
+    return [
+        (*key, stored.get(key, (0, 0)), actual.get(key, (0, 0)))
+        for key in sorted(stored.keys() | actual.keys())
+        if stored.get(key, (0, 0)) != actual.get(key, (0, 0))
+    ]
+
+
+@routed
+def check_stats(user_id: int = None) -> list:
+    """Compare the summary table with a full recount of books.
+
+    Returns (user_id, dimension, bucket, stored, actual) for every bucket that
+    disagrees, where stored and actual are (books, read) pairs; an empty list
+    means the summaries are consistent. Scans books, so it is a maintenance
+    check rather than something to call per request.
+    """
+    with reader(snapshot=True) as conn:
+        return _drift(conn, user_id)
+
+
+@routed
+def rebuild_stats(user_id: int = None) -> dict:
+    """Recompute the summaries of one user (or everyone) from the books table.
+
+    Reports how many buckets had drifted before the rebuild and verifies,
+    inside the same transaction, that none are left afterwards.
+    """
+    where, params = _user_filter(user_id)
+    with transaction() as conn:
+        drifted = _drift(conn, user_id)
+        conn.execute(f"DELETE FROM book_stats {where}", params)
+        add_stats(conn, where, params)
+        remaining = _drift(conn, user_id)
+        if remaining:
+            raise RuntimeError(f"book_stats still inconsistent after rebuild: {remaining[:5]}")
+        buckets = conn.execute(f"SELECT COUNT(*) FROM book_stats {where}", params).fetchone()[0]
+    return {"user_id": user_id, "buckets": buckets, "drifted": len(drifted), "consistent": True}